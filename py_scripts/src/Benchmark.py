@@ -0,0 +1,428 @@
+from contextlib import contextmanager
+from csv import writer
+from multiprocessing import get_context
+from pathlib import Path
+from platform import python_version
+from random import Random
+from sys import platform
+from time import perf_counter
+from pymongo import monitoring
+from Model import Model, MockModel
+from Templates import Clothes
+from Categories import read_categories, import_categories
+from DataBuilder.Generator import CatalogueGenerator
+import addPincode
+
+try:
+    import mongomock
+except ModuleNotFoundError:
+    mongomock = None
+
+try:
+    from resource import getrusage, RUSAGE_SELF
+except ModuleNotFoundError:
+    getrusage = None
+
+# Database used by benchmarks on a real server. It is dropped on every run
+BENCH_DB = 'fusionx_bench'
+
+# Categories written to product_categories and used by the datasets
+CATEGORIES = ('camxts', 'cawxts', 'camxho', 'efacfr')
+
+# mongomock methods counted as round trips
+MOCK_OPERATIONS = ('insert_one', 'insert_many', 'bulk_write', 'find',
+                   'find_one', 'aggregate', 'update_one', 'update_many',
+                   'distinct', 'count_documents', 'create_index',
+                   'index_information', 'drop')
+
+
+def parse_size(size: str):
+    'Returns the row count for sizes like 1000, 100k or 1M'
+
+    size = size.strip().lower()
+    scale = {'k': 1_000, 'm': 1_000_000}.get(size[-1])
+
+    if scale:
+        return int(float(size[:-1]) * scale)
+
+    return int(size)
+
+
+class RoundTrips(monitoring.CommandListener):
+    'Counts commands sent to the server'
+
+    count = 0
+
+    def started(self, event):
+        RoundTrips.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def _counted(fn):
+    def counted(*args, **kwargs):
+        RoundTrips.count += 1
+        return fn(*args, **kwargs)
+
+    return counted
+
+
+@contextmanager
+def mock_round_trips():
+    '''Counts calls to the MOCK_OPERATIONS mongomock collection methods
+    in RoundTrips.count, as a stand-in for commands sent to a server.
+    The original methods are restored on exit.
+
+    Requires mongomock. $merge is not supported, so atomic imports
+    cannot be benchmarked on the mock.
+    '''
+
+    if mongomock is None:
+        raise ModuleNotFoundError(
+            'mongomock is required to benchmark without a server')
+
+    originals = {
+        name: getattr(mongomock.Collection, name)
+        for name in MOCK_OPERATIONS
+    }
+
+    for name, fn in originals.items():
+        setattr(mongomock.Collection, name, _counted(fn))
+
+    try:
+        yield
+    finally:
+        for name, fn in originals.items():
+            setattr(mongomock.Collection, name, fn)
+
+
+class Datasets:
+    '''
+    Generates benchmark input files in data_dir, named by kind and size.
+    Files are deterministic for a seed and reused if they exist.
+    '''
+
+    # SUB rows per MAIN row in template files
+    variants = 6
+
+    def __init__(self, data_dir: Path, seed=0):
+        self.data_dir = data_dir
+        self.seed = seed
+
+    def path(self, kind: str, size: int):
+        'Returns the path to the dataset, generating it if missing'
+
+        ext = 'tsv' if kind == 'clothes' else 'csv'
+        path = self.data_dir / f'{kind}-{size}-{self.seed}.{ext}'
+
+        if not path.exists():
+            self.data_dir.mkdir(parents=True, exist_ok=True)
+
+            # write to a temporary file, so an interrupted run is not reused
+            tmp = path.with_suffix('.tmp')
+
+            dialect = 'excel-tab' if ext == 'tsv' else 'excel'
+
+            with tmp.open('w', newline='') as f:
+                getattr(self, f'_{kind}')(writer(f, dialect), size,
+                                          Random(self.seed))
+
+            tmp.replace(path)
+
+        return path
+
+    def _clothes(self, out, size: int, rng: Random):
+        'size rows including the header, as MAIN rows of upto 6 SUB rows'
+
+        columns = (Clothes.parent_columns + Clothes.type_columns +
+                   Clothes.all_spec_columns + Clothes.all_other_spec_columns +
+                   Clothes.child_columns)
+
+        out.writerow(columns)
+
+        width = len(columns)
+        parent = len(Clothes.parent_columns)
+        rows = 1
+
+        for group in range(size):
+            # every MAIN row needs atleast 1 SUB row
+            if size - rows < 2:
+                break
+
+            out.writerow([
+                'MAIN', rng.choice(('Apollo', 'Rogue')), f'Shirt {group}',
+                rng.choice(CATEGORIES), f'shirt-{group}', 5
+            ] + [''] * (width - parent))
+
+            rows += 1
+
+            for num in range(min(self.variants, size - rows)):
+                price = rng.randint(200, 1000)
+                images = [
+                    f'323299/eee?text={i}&font=roboto, image {i}'
+                    for i in range(1, 6)
+                ]
+
+                out.writerow(['SUB'] + [''] * (parent - 1) + [
+                    rng.choice(('Red', 'Blue')),
+                    ('XS', 'S', 'M', 'L', 'XL', 'XXL')[num],
+                    'India',
+                    'Cotton',
+                    rng.choice(('Red', 'Blue')),
+                    '470 Grams',
+                    '34 x 26 x 8 cms',
+                    price,
+                    price + 50,
+                    rng.randint(0, 50),
+                ] + images + [f'<p>Shirt {group} variant {num}</p>'])
+
+                rows += 1
+
+    def _pincodes(self, out, size: int, rng: Random):
+        out.writerow(('pincode', 'district', 'state'))
+
+        for num in range(size):
+            out.writerow((100000 + num, f'District {num % 700}',
+                          f'State {num % 36}'))
+
+    def _categories(self, out, size: int, rng: Random):
+        out.writerow(('category', 'code', 'desc', 'subcategory'))
+
+        for num in range(size):
+            out.writerow((f'Category {num % 20}', f'bench{num:08d}',
+                          f'Category {num}', f'Subcategory {num % 50}'))
+
+
+# Benchmark cases: name -> (dataset kind, function, mock size limit)
+# Each function is called with (model, db, path, size, options)
+# and returns the number of rows processed
+CASES = {}
+
+
+def case(name: str, kind: str, mock_limit=None):
+    '''Register a benchmark case
+    Sizes above mock_limit are skipped on mongomock, where upserts scan
+    the whole collection and the time measured is mongomock's own
+    '''
+
+    def register(fn):
+        CASES[name] = (kind, fn, mock_limit)
+        return fn
+
+    return register
+
+
+@case('template-run', 'clothes')
+def template_run(model, db, path, size, options):
+    with Clothes(path,
+                 model,
+                 batch_size=options['batch_size'],
+                 atomic=options['atomic'],
+                 writers=options['writers']) as tmp:
+        tmp.run()
+
+    return size
+
+
+@case('validate-file', 'clothes')
+def validate_file(model, db, path, size, options):
+    with Clothes(path, model) as tmp:
+        tmp._validate_file()
+
+    return size
+
+
+@case('pincodes', 'pincodes', mock_limit=2000)
+def pincodes(model, db, path, size, options):
+    progress = addPincode.load(db,
+                               path,
+                               chunk_size=options['batch_size'],
+                               workers=options['writers'],
+                               model=model)
+
+    return progress.rows
+
+
+@case('categories', 'categories', mock_limit=2000)
+def categories(model, db, path, size, options):
+    inserted, _ = import_categories(db,
+                                    read_categories(path),
+                                    batch_size=options['batch_size'],
+                                    writers=options['writers'],
+                                    model=model)
+
+    return inserted
+
+
+@case('generator', None)
+def generator(model, db, path, size, options):
+    'Builds documents only, nothing is written'
+
+    generator = CatalogueGenerator(0, 3, CATEGORIES)
+    count = 0
+
+    for chunk, start in enumerate(range(0, size, 1000)):
+        _, _, variants = generator.products(chunk, start,
+                                            min(1000, size - start))
+        count += len(variants)
+
+    return count
+
+
+def peak_rss():
+    'Returns the peak resident memory of this process in MB or None'
+
+    if getrusage is None:
+        return None
+
+    rss = getrusage(RUSAGE_SELF).ru_maxrss
+
+    # bytes on macOS, kilobytes on Linux
+    return rss / 1024**2 if platform == 'darwin' else rss / 1024
+
+
+def format_mb(mb):
+    'Returns a peak RSS for reports, n/a where it is not measured'
+
+    return 'n/a' if mb is None else f'{mb:.0f} MB'
+
+
+def run_case(name: str, size: int, path, env_path, options: dict):
+    '''Run one case and return its result. Runs in a fresh process,
+    so peak RSS is measured for this case only
+    '''
+
+    if env_path is None:
+        with mock_round_trips():
+            return _run_case(name, size, path,
+                             MockModel(mongomock.MongoClient(), BENCH_DB),
+                             False, options)
+
+    monitoring.register(RoundTrips())
+
+    return _run_case(name, size, path, Model(env_path, BENCH_DB), True,
+                     options)
+
+
+def _run_case(name: str, size: int, path, model, server: bool,
+              options: dict):
+    db = model.connect()
+
+    model.client.drop_database(BENCH_DB)
+
+    # mongomock checks unique indexes by scanning the collection
+    if server:
+        model.ensure_indexes()
+
+    db.product_categories.insert_many([{
+        'category': code,
+        'code': code,
+        'desc': code,
+        'subcategory': code
+    } for code in CATEGORIES])
+
+    RoundTrips.count = 0
+    start = perf_counter()
+
+    try:
+        rows = CASES[name][1](model, db, path, size, options)
+    except SystemExit as e:
+        # templates exit on errors, which would leave the pool waiting
+        raise RuntimeError(f'{name} {size} failed: {e}')
+
+    seconds = perf_counter() - start
+
+    result = {
+        'case': name,
+        'size': size,
+        'rows': rows,
+        'seconds': round(seconds, 3),
+        'rows_per_sec': round(rows / seconds, 1) if seconds else None,
+        'peak_rss_mb': peak_rss(),
+        'round_trips': RoundTrips.count
+    }
+
+    model.client.drop_database(BENCH_DB)
+    model.close()
+
+    return result
+
+
+def run(cases: list, sizes: list, datasets: Datasets, env_path=None,
+        **options):
+    '''Run every case at every size and return a results dict.
+    Uses a server from the .env at env_path, or mongomock if None
+    '''
+
+    results = []
+    ctx = get_context('spawn')
+
+    for name in cases:
+        kind, _, mock_limit = CASES[name]
+
+        for size in sizes:
+            if env_path is None and mock_limit and size > mock_limit:
+                print(f'{name} {size}: Skipped, above {mock_limit} rows '
+                      'on mongomock')
+                continue
+
+            path = datasets.path(kind, size) if kind else None
+
+            with ctx.Pool(1) as pool:
+                result = pool.apply(run_case,
+                                    (name, size, path, env_path, options))
+
+            print(f"{name} {size}: {result['rows_per_sec']} rows/sec "
+                  f"{format_mb(result['peak_rss_mb'])} "
+                  f"{result['round_trips']} round trips")
+
+            results.append(result)
+
+    return {
+        'backend': 'mock' if env_path is None else 'mongod',
+        'python': python_version(),
+        'options': options,
+        'results': results
+    }
+
+
+def compare(current: dict, baseline: dict, threshold=0.2):
+    '''Returns a list of regressions, where rows/sec dropped or peak RSS
+    grew by more than threshold compared to the baseline. Only results
+    with the same backend, case and size are compared
+    '''
+
+    if current['backend'] != baseline['backend']:
+        return []
+
+    base = {(r['case'], r['size']): r for r in baseline['results']}
+    regressions = []
+
+    for result in current['results']:
+        old = base.get((result['case'], result['size']))
+
+        if old is None:
+            continue
+
+        name = f"{result['case']} {result['size']}"
+
+        if (old['rows_per_sec'] and result['rows_per_sec'] is not None
+                and result['rows_per_sec'] <
+                old['rows_per_sec'] * (1 - threshold)):
+            regressions.append(
+                f"{name}: {result['rows_per_sec']} rows/sec, "
+                f"baseline {old['rows_per_sec']}")
+
+        # peak RSS is None where resource is not available
+        if (old['peak_rss_mb'] and result['peak_rss_mb'] is not None
+                and result['peak_rss_mb'] >
+                old['peak_rss_mb'] * (1 + threshold)):
+            regressions.append(
+                f"{name}: {format_mb(result['peak_rss_mb'])} peak RSS, "
+                f"baseline {format_mb(old['peak_rss_mb'])}")
+
+    return regressions
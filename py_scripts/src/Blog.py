@@ -0,0 +1,202 @@
+from datetime import date, datetime, timezone
+from pathlib import Path
+from bson.objectid import ObjectId
+from Writer import BulkWriter
+
+try:
+    import yaml
+except ModuleNotFoundError:
+    yaml = None
+
+try:
+    from markdown import markdown
+except ModuleNotFoundError:
+    markdown = None
+
+# File extensions imported as posts
+EXTENSIONS = ('.md', '.markdown', '.html', '.htm')
+
+# Header image used if the front matter has none
+DEFAULT_IMAGE = '770x431/485fc7/fff?text=FusionX'
+
+# Length limits, as checked by the admin post form
+TITLE_LENGTH = (10, 200)
+DESCRIPTION_LENGTH = (10, 1000)
+
+
+class PostWriter(BulkWriter):
+    '''BulkWriter for blog posts. Bodies are written before the posts
+    linking to them. Failed writes are reported by file name
+    '''
+
+    collections = ('post_body', 'posts')
+    content_addressed = ()
+    row_label = 'File'
+
+
+def split_front_matter(text: str):
+    '''Returns (front matter, body) for text starting with a front matter
+    block between --- lines. Front matter is {} if there is none
+    '''
+
+    lines = text.splitlines(keepends=True)
+
+    if not lines or lines[0].strip() != '---':
+        return {}, text
+
+    for i, line in enumerate(lines[1:], 1):
+        if line.strip() == '---':
+            head = ''.join(lines[1:i])
+            return parse_front_matter(head), ''.join(lines[i + 1:])
+
+    raise ValueError('Front matter is not closed with ---')
+
+
+def parse_front_matter(head: str):
+    '''Parse front matter with PyYAML if installed, else as
+    `key: value` lines, where [a, b] is a list
+    '''
+
+    if yaml is not None:
+        meta = yaml.safe_load(head) or {}
+
+        if not isinstance(meta, dict):
+            raise ValueError('Front matter must be key: value pairs')
+
+        return meta
+
+    meta = {}
+
+    for line in head.splitlines():
+        if not line.strip() or line.lstrip().startswith('#'):
+            continue
+
+        key, sep, value = line.partition(':')
+
+        if not sep:
+            raise ValueError(f'Invalid front matter line: {line}')
+
+        value = value.strip().strip('"\'')
+
+        if value.startswith('[') and value.endswith(']'):
+            value = [
+                v.strip().strip('"\'') for v in value[1:-1].split(',')
+                if v.strip()
+            ]
+
+        meta[key.strip()] = value
+
+    return meta
+
+
+def slug(text: str):
+    'Returns a post href, as written by the admin post form and test data'
+    return text.strip().replace(' ', '-').lower()
+
+
+def to_datetime(value):
+    'Returns an aware datetime for a front matter date, UTC if no timezone'
+
+    if isinstance(value, datetime):
+        dt = value
+    elif isinstance(value, date):
+        dt = datetime(value.year, value.month, value.day)
+    else:
+        dt = datetime.fromisoformat(str(value))
+
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+
+    return dt
+
+
+def dated_id(dt: datetime):
+    '''Returns a new ObjectId with the timestamp of dt,
+    so imported posts sort by date on _id, as the blog list does.
+    Raises ValueError for dates outside the 4 byte ObjectId timestamp
+    '''
+
+    seconds = int(dt.timestamp())
+
+    if not 0 <= seconds < 2**32:
+        raise ValueError(f'date must be between 1970 and 2106: {dt}')
+
+    return ObjectId(seconds.to_bytes(4, 'big') + ObjectId().binary[4:])
+
+
+def _check_length(meta: dict, key: str, limits: tuple):
+    value = meta.get(key)
+
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError(f'{key} is required')
+
+    low, high = limits
+
+    if not low <= len(value.strip()) <= high:
+        raise ValueError(f'{key} must be {low} to {high} characters')
+
+    return value.strip()
+
+
+def convert(file: Path, author=None):
+    '''Returns (post_body, post) documents for a Markdown or HTML file
+    with front matter. Markdown requires the markdown package.
+
+    Front matter keys:
+    title, description: Required
+    author: Defaults to the author argument
+    tags: List or a single tag
+    date: ISO date or datetime, defaults to now
+    href: Defaults to the file name without extension
+    image, image_alt: Header image, defaults to DEFAULT_IMAGE and the title
+
+    The body _id is assigned here, so both documents can be written
+    in the same batch
+    '''
+
+    meta, body = split_front_matter(file.read_text(encoding='utf-8'))
+
+    title = _check_length(meta, 'title', TITLE_LENGTH)
+    description = _check_length(meta, 'description', DESCRIPTION_LENGTH)
+
+    author = meta.get('author') or author
+
+    if not author:
+        raise ValueError('author is required')
+
+    tags = meta.get('tags') or []
+
+    if isinstance(tags, str):
+        tags = [tags]
+
+    if file.suffix.lower() in ('.md', '.markdown'):
+        if markdown is None:
+            raise ModuleNotFoundError(
+                'markdown is required to import Markdown files')
+
+        body = markdown(body, extensions=['extra'])
+
+    if not body.strip():
+        raise ValueError('Post body is empty')
+
+    mod_dt = to_datetime(meta['date']) if meta.get(
+        'date') else datetime.now(timezone.utc)
+
+    post_body = {'_id': ObjectId(), 'body': body}
+
+    post = {
+        '_id': dated_id(mod_dt),
+        'title': title,
+        'description': description,
+        'href': slug(str(meta.get('href') or file.stem)),
+        'body_id': post_body['_id'],
+        'author': author,
+        'header_image': {
+            'image': meta.get('image') or DEFAULT_IMAGE,
+            'alt_text': meta.get('image_alt') or title
+        },
+        'tags': [str(tag) for tag in tags],
+        'mod_dt': mod_dt
+    }
+
+    return post_body, post
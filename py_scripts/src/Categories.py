@@ -0,0 +1,114 @@
+from csv import DictReader
+from functools import partial
+from itertools import islice
+from pathlib import Path
+from pymongo import UpdateOne
+from Ingest import IngestEngine
+
+# Columns required in the categories CSV
+COLUMNS = ('category', 'code', 'desc', 'subcategory')
+
+# Fields updated on existing categories when update=True
+UPDATE_FIELDS = ('desc', 'subcategory')
+
+
+def read_categories(file: Path):
+    '''Returns a list of category documents from the CSV file
+
+    Raises KeyError if a column is missing and ValueError if a code
+    is repeated within the file
+    '''
+
+    with file.open() as f:
+        reader = DictReader(f)
+
+        fields = reader.fieldnames or []
+
+        for col in COLUMNS:
+            if col not in fields:
+                raise KeyError(f'Invalid CSV file: Missing {col} field.')
+
+        docs = []
+
+        # code: first row number, for reporting duplicates
+        rows = {}
+        duplicates = []
+
+        for count, row in enumerate(reader, 2):
+            code = row['code']
+
+            if code in rows:
+                duplicates.append(
+                    f'Row {count}: {code} repeats Row {rows[code]}')
+                continue
+
+            rows[code] = count
+            docs.append({col: row[col] for col in COLUMNS})
+
+    if duplicates:
+        raise ValueError('Duplicate codes\n' + '\n'.join(duplicates))
+
+    return docs
+
+
+def import_categories(db,
+                      docs: list,
+                      update=False,
+                      batch_size=1000,
+                      writers=1,
+                      model=None):
+    '''Upsert category documents keyed on code, in batches
+
+    Existing codes are left unchanged, unless update is True,
+    then their UPDATE_FIELDS are set from the document.
+
+    Batches are written by writers concurrent writers, see Ingest.py
+
+    Returns a tuple (inserted, updated)
+    '''
+
+    # inserted, updated
+    counts = [0, 0]
+    docs = iter(docs)
+
+    with IngestEngine(db, writers=writers, model=model) as engine:
+        while batch := list(islice(docs, batch_size)):
+            engine.submit('product_categories',
+                          'bulk_write',
+                          _upserts(batch, update),
+                          ordered=False,
+                          done=partial(_count, counts))
+
+    return tuple(counts)
+
+
+def _upserts(batch: list, update: bool):
+    'Returns upserts keyed on code for a batch of category documents'
+
+    requests = []
+
+    for doc in batch:
+        if update:
+            fields = {field: doc[field] for field in UPDATE_FIELDS}
+            insert_only = {
+                k: v
+                for k, v in doc.items() if k not in UPDATE_FIELDS
+            }
+
+            op = {'$set': fields, '$setOnInsert': insert_only}
+        else:
+            op = {'$setOnInsert': doc}
+
+        requests.append(UpdateOne({'code': doc['code']}, op, upsert=True))
+
+    return requests
+
+
+def _count(counts: list, res, error=None):
+    'Add a bulk_write result to counts, called by the IngestEngine'
+
+    if error is not None:
+        raise error
+
+    counts[0] += res.upserted_count
+    counts[1] += res.modified_count
@@ -0,0 +1,209 @@
+from datetime import datetime, timezone
+from pathlib import Path
+from bson.objectid import ObjectId
+from Facets import rebuild
+from Manifest import file_hash
+
+# Statuses of an import run
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+ROLLED_BACK = 'rolled_back'
+
+
+class ImportRun:
+    '''
+    A checkpointed import of one template file, recorded in the
+    import_runs collection. See BaseTemplate.run.
+
+    Every document written by the run is tagged with import_run set to
+    the run id, so a failed run can be removed with rollback, and
+    import_batch, the number of checkpoints saved before it was written.
+
+    The checkpoint is the row number of the next product group to write.
+    Every group before it, including its variants and variant_info,
+    is in the database. row starts at 2, the first row after the header.
+    Products and variants written after it are removed by discard_unsaved
+    before the run resumes, as their groups are read again.
+
+    The file's size and content hash are recorded, a run can only be
+    resumed if the file is unchanged.
+    '''
+
+    collection = 'import_runs'
+
+    def __init__(self, db, doc: dict):
+        self.db = db
+        self.doc = doc
+
+    @property
+    def id(self):
+        return self.doc['_id']
+
+    @property
+    def row(self):
+        return self.doc['row']
+
+    @staticmethod
+    def _key(file: Path):
+        return str(file.resolve())
+
+    @classmethod
+    def start(cls, db, file: Path, version: str):
+        'Record a new run of the file, starting at the first row'
+
+        now = datetime.now(timezone.utc)
+
+        doc = {
+            '_id': str(ObjectId()),
+            'file': cls._key(file),
+            'version': version,
+            'size': file.stat().st_size,
+            'hash': file_hash(file),
+            'status': RUNNING,
+            'row': 2,
+            'groups': 0,
+            'batches': 0,
+            'started': now,
+            'updated': now
+        }
+
+        db[cls.collection].insert_one(doc)
+
+        return cls(db, doc)
+
+    @classmethod
+    def resumable(cls, db, file: Path, version: str):
+        '''Returns the last unfinished run of the file or None.
+        Raises ValueError if the file changed since that run
+        '''
+
+        doc = db[cls.collection].find_one(
+            {
+                'file': cls._key(file),
+                'status': {
+                    '$in': [RUNNING, FAILED]
+                }
+            },
+            sort=[('started', -1)])
+
+        if doc is None:
+            return None
+
+        if (doc['version'] != version
+                or doc['size'] != file.stat().st_size
+                or doc['hash'] != file_hash(file)):
+            raise ValueError(
+                f"{file.name} changed since run {doc['_id']}. "
+                f"Roll it back and import again")
+
+        return cls(db, doc)
+
+    def save(self, row: int, groups: int, batches: int):
+        'Record the checkpoint, once every group before row is written'
+
+        self._set(row=row, groups=groups, batches=batches)
+
+    def discard_unsaved(self):
+        '''Delete products and variants written after the checkpoint.
+        Returns the number of documents deleted
+        '''
+
+        query = {
+            'import_run': self.id,
+            'import_batch': {
+                '$gte': self.doc['batches']
+            }
+        }
+
+        return (self.db.products.delete_many(query).deleted_count +
+                self.db.product_variants.delete_many(query).deleted_count)
+
+    def finish(self, status: str):
+        self._set(status=status)
+
+    def _set(self, **fields):
+        fields['updated'] = datetime.now(timezone.utc)
+
+        self.doc.update(fields)
+        self.db[self.collection].update_one({'_id': self.id},
+                                            {'$set': fields})
+
+
+def _delete_unused(db, ids: list):
+    '''Delete the variant_info documents no variant refers to.
+    Returns the number deleted
+    '''
+
+    # ids still in use, with the info_id index
+    used = set(
+        db.product_variants.distinct('info_id', {'info_id': {
+            '$in': ids
+        }}))
+
+    unused = [key for key in ids if key not in used]
+
+    if not unused:
+        return 0
+
+    return db.variant_info.delete_many({
+        '_id': {
+            '$in': unused
+        }
+    }).deleted_count
+
+
+def rollback(db, run_id: str, batch_size=1000, rebuild_facets=True):
+    '''Delete the products, variants and variant_info written by a run.
+
+    variant_info is shared between variants with the same description,
+    so documents the run created but other variants still use are kept.
+    Facet counts of the run's categories are rebuilt, unless
+    rebuild_facets is False because the run's counts were never written.
+
+    Returns {collection: deleted count}
+    '''
+
+    run = db[ImportRun.collection].find_one({'_id': run_id})
+
+    if run is None:
+        raise ValueError(f'No import run {run_id}')
+
+    query = {'import_run': run_id}
+
+    categories = db.product_variants.distinct('category_code', query)
+
+    deleted = {
+        'products': db.products.delete_many(query).deleted_count,
+        'product_variants':
+        db.product_variants.delete_many(query).deleted_count,
+        'variant_info': 0
+    }
+
+    cursor = db.variant_info.find(query,
+                                  projection={'_id': 1},
+                                  batch_size=batch_size)
+
+    chunk = []
+
+    for doc in cursor:
+        chunk.append(doc['_id'])
+
+        if len(chunk) == batch_size:
+            deleted['variant_info'] += _delete_unused(db, chunk)
+            chunk = []
+
+    if chunk:
+        deleted['variant_info'] += _delete_unused(db, chunk)
+
+    if rebuild_facets:
+        rebuild(db, categories)
+
+    db[ImportRun.collection].update_one({'_id': run_id}, {
+        '$set': {
+            'status': ROLLED_BACK,
+            'updated': datetime.now(timezone.utc)
+        }
+    })
+
+    return deleted
@@ -0,0 +1,149 @@
+from datetime import datetime, timezone
+from random import choices
+from re import escape
+from string import ascii_lowercase, digits
+from pymongo.errors import BulkWriteError
+
+
+class CodeAllocator:
+    '''
+    Allocates unique product codes - category code + 6 alphanumeric chars
+
+    Existing codes are loaded once per category prefix, using a projection
+    only query, into a set for O(1) lookups. Every code handed out is added
+    to the set, so codes are never repeated within a run.
+
+    Codes are generated in batches of pool_size per prefix and handed out
+    one at a time by allocate.
+
+    db: pymongo Database - Optional
+        If None, only codes allocated by this instance are checked
+
+    reserve: bool - Optional
+        If True, allocated codes are inserted into the
+        product_code_reservations collection with the code as _id.
+        A code reserved by a concurrent importer fails the unique _id index
+        and is replaced with a new code. Reservations expire a week after
+        they are created, by the TTL index in Model.INDEXES. By then the
+        code is in products, where load finds it.
+    '''
+
+    alpha_num = ascii_lowercase + digits
+    length = 6
+
+    def __init__(self, db=None, reserve=False, pool_size=100):
+        if reserve and db is None:
+            raise ValueError('reserve requires a database')
+
+        self.db = db
+        self.reserve = reserve
+        self.pool_size = pool_size
+
+        self.codes = set()
+
+        # prefixes loaded from the database
+        self.loaded = set()
+
+        # pre-generated codes per prefix
+        self.pools = {}
+
+    def __contains__(self, code: str):
+        return code in self.codes
+
+    def load(self, prefix: str):
+        'Load existing product codes starting with prefix'
+
+        if self.db is None or prefix in self.loaded:
+            return
+
+        # anchored regex can use the product_code index
+        cursor = self.db.products.find(
+            {'product_code': {
+                '$regex': f'^{escape(prefix)}'
+            }},
+            projection={
+                '_id': 0,
+                'product_code': 1
+            })
+
+        self.codes.update(doc['product_code'] for doc in cursor)
+        self.loaded.add(prefix)
+
+    def _generate(self, prefix: str):
+        'Returns a new code not in use'
+
+        code = prefix + ''.join(choices(self.alpha_num, k=self.length))
+
+        while code in self.codes:
+            code = prefix + ''.join(choices(self.alpha_num, k=self.length))
+
+        return code
+
+    def allocate_many(self, prefix: str, count: int):
+        'Returns a list of count unique codes starting with prefix'
+
+        self.load(prefix)
+
+        codes = []
+
+        while len(codes) < count:
+            batch = []
+
+            for _ in range(count - len(codes)):
+                code = self._generate(prefix)
+                self.codes.add(code)
+                batch.append(code)
+
+            if self.reserve:
+                batch = self._reserve(batch)
+
+            codes += batch
+
+        return codes
+
+    def allocate(self, prefix: str):
+        'Returns a unique code starting with prefix'
+
+        pool = self.pools.get(prefix)
+
+        if not pool:
+            pool = self.pools[prefix] = self.allocate_many(
+                prefix, self.pool_size)
+
+        return pool.pop()
+
+    def claim(self, code: str):
+        '''Mark a code generated elsewhere as used.
+        Returns False if the code is already taken
+        '''
+
+        self.load(code[:-self.length])
+
+        if code in self.codes:
+            return False
+
+        self.codes.add(code)
+
+        if self.reserve:
+            return bool(self._reserve([code]))
+
+        return True
+
+    def _reserve(self, codes: list):
+        'Returns the codes that were successfully reserved'
+
+        created = datetime.now(timezone.utc)
+
+        try:
+            self.db.product_code_reservations.insert_many(
+                [{
+                    '_id': code,
+                    'created': created
+                } for code in codes], ordered=False)
+        except BulkWriteError as e:
+            taken = set(codes[err['index']]
+                        for err in e.details.get('writeErrors', []))
+
+            return [code for code in codes if code not in taken]
+
+        return codes
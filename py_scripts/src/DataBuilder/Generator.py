@@ -0,0 +1,278 @@
+from datetime import datetime, timedelta
+from hashlib import blake2b
+from multiprocessing import Pool
+from pathlib import Path
+from random import Random
+from string import ascii_lowercase, digits
+from time import perf_counter
+from bson.objectid import ObjectId
+from pymongo.errors import BulkWriteError
+from faker import Faker
+from Model import Model
+from Templates import info_id
+from Writer import DUPLICATE_KEY
+
+BASE36 = digits + ascii_lowercase
+
+# posts are dated upto 180 days before this date
+POSTS_END_DATE = datetime(2023, 1, 1)
+
+
+def base36(num: int, width=6):
+    'Returns num as a zero padded base 36 string'
+
+    chars = []
+
+    while num:
+        num, rem = divmod(num, 36)
+        chars.append(BASE36[rem])
+
+    return ''.join(reversed(chars)).rjust(width, '0')
+
+
+class TextPool:
+    '''
+    Words, sentences and paragraphs generated once with Faker.
+    Documents are built by sampling from the pool, which is much faster
+    than calling Faker for every field.
+    '''
+
+    def __init__(self, seed: int, size=2000):
+        fake = Faker('en_IN')
+        fake.seed_instance(seed)
+
+        self.words = fake.words(nb=size)
+        self.sentences = [fake.sentence(nb_words=8) for _ in range(size)]
+        self.paragraphs = [
+            fake.paragraph(nb_sentences=10, variable_nb_sentences=False)
+            for _ in range(size // 10)
+        ]
+
+    def title(self, rng: Random, wordCount=3):
+        return ' '.join(rng.choices(self.words, k=wordCount)).capitalize()
+
+    def text(self, rng: Random, sentenceCount=3):
+        return ' '.join(rng.choices(self.sentences, k=sentenceCount))
+
+    def paragraph(self, rng: Random):
+        return rng.choice(self.paragraphs)
+
+
+class CatalogueGenerator:
+    '''
+    Builds products, variant_info and product_variants documents
+    in the shape written by Templates.py, for load testing.
+
+    Output is deterministic for a seed. Every chunk uses its own random
+    generator seeded from the seed and chunk number, so chunks can be
+    built in any order and in parallel.
+
+    Product codes are the category code + the product number in base 36,
+    so they are unique across workers without coordination. Generate into
+    an empty database to avoid clashing with random codes.
+
+    variant_info documents are content addressed like an import, see
+    Templates.info_id, and post_body ids are derived from the seed and
+    post number, so ids are deterministic too.
+    '''
+
+    brands = ('FooBar', 'BarBaz', 'Apollo', 'Rogue')
+    materials = ('Foo', 'Bar', 'Cotton', 'Latex')
+    countries = ('India', 'China')
+    colors = {'Red': '8c1919', 'Green': '009966', 'Blue': '323299'}
+    types = ('XS', 'S', 'M', 'L', 'XL', 'XXL')
+
+    def __init__(self, seed: int, variants_per_product: int,
+                 categories: tuple):
+        self.seed = seed
+        self.variants_per_product = variants_per_product
+        self.categories = categories
+        self.pool = TextPool(seed)
+
+    def rng(self, kind: str, chunk: int):
+        return Random(f'{self.seed}:{kind}:{chunk}')
+
+    def products(self, chunk: int, start: int, count: int):
+        '''Returns (products, variant_info, product_variants) lists for
+        product numbers start to start + count
+        '''
+
+        rng = self.rng('products', chunk)
+        products, variants = [], []
+
+        # products sampling the same paragraph share one document
+        infos = {}
+
+        for num in range(start, start + count):
+            category = self.categories[num % len(self.categories)]
+            code = category + base36(num)
+            title = self.pool.title(rng)
+            href = title.replace(' ', '-').lower()
+            brand = rng.choice(self.brands)
+
+            products.append({
+                'title': f'{brand} {title}',
+                'product_code': code,
+                'href': f'{code}001/{href}'
+            })
+
+            info = f'<p>{self.pool.paragraph(rng)}</p>'
+            _id = info_id(info)
+            infos[_id] = {'_id': _id, 'info': info}
+
+            for i in range(1, self.variants_per_product + 1):
+                variants.append(
+                    self._variant(rng, category, code, i, href, brand, title,
+                                  _id))
+
+        return products, list(infos.values()), variants
+
+    def _variant(self, rng, category, code, num, href, brand, title,
+                 info_id):
+        sku = f'{code}{num:03d}'
+        color = rng.choice(tuple(self.colors))
+        material = rng.choice(self.materials)
+        country = rng.choice(self.countries)
+        size = self.types[(num - 1) % len(self.types)]
+        price = rng.randint(200, 1000)
+        hex_code = self.colors[color]
+
+        return {
+            'sku': sku,
+            'category_code': category,
+            'product_code': code,
+            'href': f'{sku}/{href}',
+            'title': f'{brand} {title}, {color}, {size}',
+            'price': price,
+            'mrp': price + 40,
+            'gst': 18,
+            'qty': rng.randint(0, 50),
+            'type': [{'k': 'color', 'v': color}, {'k': 'size', 'v': size}],
+            'specs': [
+                {'k': 'brand', 'v': brand},
+                {'k': 'origin', 'v': country},
+                {'k': 'material', 'v': material},
+                {'k': 'basecolor', 'v': color},
+            ],
+            'other_specs': {
+                'weight': '680 grams',
+                'dimensions': '45.7 x 15.2 x 15.2 cms'
+            },
+            'images': [[f'{hex_code}/fff?text={i}&font=roboto', f'image {i}']
+                       for i in range(1, 6)],
+            'z_index': 1 if num == 1 else 0.5,
+            'info_id': info_id
+        }
+
+    def posts(self, chunk: int, start: int, count: int):
+        '''Returns (post_body, posts) lists for post numbers
+        start to start + count
+        '''
+
+        rng = self.rng('posts', chunk)
+        bodies, posts = [], []
+
+        for num in range(start, start + count):
+            title = self.pool.title(rng, 4)
+            body_id = ObjectId(
+                blake2b(f'{self.seed}:{num}'.encode(),
+                        digest_size=12).digest())
+
+            bodies.append({
+                '_id': body_id,
+                'body': f'<p>{self.pool.paragraph(rng)}</p>'
+            })
+
+            posts.append({
+                'title': title,
+                'description': self.pool.text(rng),
+                # post number keeps href unique
+                'href': f"{title.replace(' ', '-').lower()}-{base36(num)}",
+                'body_id': body_id,
+                'author': rng.choice(('John Doe', 'Sam Doe')),
+                'header_image': {
+                    'image': '770x431/485fc7/fff?text=FusionX',
+                    'alt_text': 'alt text'
+                },
+                'tags': [rng.choice(('TagA', 'TagB'))],
+                'mod_dt': POSTS_END_DATE -
+                timedelta(seconds=rng.randint(0, 180 * 86400))
+            })
+
+        return bodies, posts
+
+
+# Worker process globals, set by _init_worker
+_db = None
+_generator = None
+
+
+def _init_worker(env_path: Path, dbName: str, args: tuple):
+    global _db, _generator
+
+    _db = Model(env_path).connect(dbName)
+    _generator = CatalogueGenerator(*args)
+
+
+def _write_products(task: tuple):
+    products, infos, variants = _generator.products(*task)
+
+    _db.products.insert_many(products, ordered=False)
+
+    # another chunk may have inserted the same description
+    try:
+        _db.variant_info.insert_many(infos, ordered=False)
+    except BulkWriteError as e:
+        if any(err.get('code') != DUPLICATE_KEY
+               for err in e.details.get('writeErrors', [])):
+            raise
+
+    _db.product_variants.insert_many(variants, ordered=False)
+
+    return len(products)
+
+
+def _write_posts(task: tuple):
+    bodies, posts = _generator.posts(*task)
+
+    _db.post_body.insert_many(bodies, ordered=False)
+    _db.posts.insert_many(posts, ordered=False)
+
+    return len(posts)
+
+
+def _tasks(total: int, chunk_size: int):
+    'Yields (chunk number, start, count) for each chunk'
+
+    for chunk, start in enumerate(range(0, total, chunk_size)):
+        yield chunk, start, min(chunk_size, total - start)
+
+
+def generate(env_path: Path,
+             dbName: str,
+             products=0,
+             variants_per_product=3,
+             posts=0,
+             seed=0,
+             workers=1,
+             chunk_size=1000,
+             categories=('efacfr', 'camxts', 'cawxts')):
+    '''Generate and insert products and posts in chunks across
+    worker processes. Only the chunks being built are held in memory.
+    '''
+
+    args = (seed, variants_per_product, categories)
+
+    with Pool(workers, _init_worker, (env_path, dbName, args)) as pool:
+        for name, fn, total in (('products', _write_products, products),
+                                ('posts', _write_posts, posts)):
+            if not total:
+                continue
+
+            start = perf_counter()
+            done = 0
+
+            for count in pool.imap_unordered(fn, _tasks(total, chunk_size)):
+                done += count
+                rate = done / (perf_counter() - start)
+                print(f'{name}: {done}/{total} {rate:.0f}/sec')
@@ -8,7 +8,7 @@ class Posts:
 
         self.tags = cycle(("TagA", "TagB"))
         self.names = cycle(('John Doe', 'Sam Doe'))
-        self.titles = []
+        self.titles = set()
 
     def getBody(self):
         para = getParagraph()
@@ -20,6 +20,8 @@ class Posts:
             if title in self.titles:
                 continue
             break
+
+        self.titles.add(title)
         return title
 
     def getPostBody(self, postBodyId):
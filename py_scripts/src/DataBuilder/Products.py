@@ -1,11 +1,12 @@
 from random import randint
 from itertools import cycle
-from DataBuilder.utils import getSentences, generateAlphaNumCode, getParagraph
+from DataBuilder.utils import getSentences, getParagraph
+from CodeAllocator import CodeAllocator
 
 
 class Products:
     def __init__(self):
-        self.codes = []
+        self.allocator = CodeAllocator()
         self.variant_count = 3
         self.brands = cycle(("FooBar", "BarBaz"))
         self.materials = cycle(("Foo", "Bar"))
@@ -26,15 +27,12 @@ class Products:
         return {"info": f'<p>{para}</p>'}
 
     def getCode(self, category):
-        while code := category + generateAlphaNumCode(count=6):
-            if code in self.codes:
-                continue
-            break
-        return code
+        return self.allocator.allocate(category)
 
     def getProduct(self, category):
         self.brand = self.brands.__next__()
         self.title = self.getTitle()
+        self.category = category
         self.code = self.getCode(category)
         self.variant_types = self.buildVariantTypes(self.variant_count)
 
@@ -75,6 +73,8 @@ class Products:
 
         return {
             "sku": self.hrefs[idx].split("/")[0],
+            "category_code": self.category,
+            "product_code": self.code,
             "href": self.hrefs[idx],
             "title": title,
             "price": price,
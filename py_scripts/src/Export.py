@@ -0,0 +1,279 @@
+from collections import OrderedDict
+from csv import writer
+from itertools import groupby
+from pathlib import Path
+from re import escape
+from zlib import decompress
+from Templates import INFO_CACHE
+
+# Documents returned per cursor batch. Export reads every document once,
+# so fewer, larger batches mean fewer round trips
+CURSOR_BATCH = 5000
+
+# Variants buffered before their descriptions are fetched in one $in query
+INFO_BATCH = 1000
+
+PRODUCT_FIELDS = ('product_code', 'title', 'href')
+
+VARIANT_FIELDS = ('sku', 'price', 'mrp', 'gst', 'qty', 'type', 'specs',
+                  'other_specs', 'images', 'info_id')
+
+
+def number(value):
+    'Returns a price or quantity as written in a template file, 600 not 600.0'
+
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+
+    return str(value)
+
+
+def description(doc: dict):
+    'Returns the description of a variant_info document'
+
+    if 'info_z' in doc:
+        return decompress(doc['info_z']).decode()
+
+    return doc.get('info', '')
+
+
+class CatalogueExport:
+    '''
+    Writes the products of a template class in the database back to a
+    template TSV file, in the template's column order. The file can be
+    edited and imported again with addProducts.py --sync, which only
+    writes the variants that changed.
+
+    Products and their variants are streamed per category from two
+    cursors, sorted by product_code and sku, and joined in memory as a
+    merge join. Variants are selected on category_code, run
+    backfillVariantCodes.py first on older databases. A sku is the product code + 3 digit child number, so the
+    variants of a product are consecutive and in child order.
+
+    Descriptions are fetched with one $in query per INFO_BATCH variants.
+    variant_info is content addressed and shared between variants, so
+    the last INFO_CACHE descriptions are kept and not fetched again.
+
+    Only one batch of variants is held in memory at a time.
+
+    Variants are exported if their type keys match the template's
+    type_columns. Retired variants are left out.
+
+    template: BaseTemplate subclass
+    db: pymongo Database
+    categories: list - Optional
+        Category codes to export, every code in product_categories if None
+    '''
+
+    def __init__(self, template, db, categories=None):
+        self.template = template
+        self.db = db
+        self.categories = categories
+
+        self.columns = template.template_columns()
+        self.index = {col: i for i, col in enumerate(self.columns)}
+
+        self.descriptions = OrderedDict()
+
+        self.products = 0
+        self.variants = 0
+
+        # variants without a product or variant_info document
+        self.orphans = 0
+        self.missing_info = 0
+
+    def write(self, file: Path):
+        '''Export to file. The file is written under a temporary name
+        and renamed once complete
+        '''
+
+        categories = self.categories
+
+        if categories is None:
+            categories = self.db.product_categories.distinct('code')
+
+        tmp = file.with_suffix('.tmp')
+
+        with tmp.open('w', newline='', encoding='utf-8') as f:
+            out = writer(f, dialect='excel-tab')
+            out.writerow(self.columns)
+
+            for code in sorted(categories):
+                self._export_category(code, out)
+
+        tmp.replace(file)
+
+    def _export_category(self, code: str, out):
+        'Write the product groups of a category'
+
+        # products have no category_code, longer codes with this prefix
+        # are skipped by the join
+        products = self.db.products.find(
+            {
+                'product_code': {
+                    '$regex': f'^{escape(code)}'
+                }
+            },
+            projection={
+                field: 1
+                for field in PRODUCT_FIELDS
+            },
+            batch_size=CURSOR_BATCH).sort('product_code', 1)
+
+        variants = self.db.product_variants.find(
+            {
+                'category_code': code,
+                'type.k': {
+                    '$all': list(self.template.type_columns)
+                },
+                'type': {
+                    '$size': len(self.template.type_columns)
+                },
+                'retired': {
+                    '$ne': True
+                }
+            },
+            projection={
+                field: 1
+                for field in VARIANT_FIELDS
+            },
+            batch_size=CURSOR_BATCH).sort('sku', 1)
+
+        product = next(products, None)
+        pending = []
+        count = 0
+
+        for product_code, group in groupby(variants,
+                                           key=lambda v: v['sku'][:-3]):
+            while (product is not None
+                   and product['product_code'] < product_code):
+                product = next(products, None)
+
+            group = list(group)
+
+            if product is None or product['product_code'] != product_code:
+                self.orphans += len(group)
+                continue
+
+            pending.append((code, product, group))
+            count += len(group)
+
+            if count >= INFO_BATCH:
+                self._write_groups(pending, out)
+                pending = []
+                count = 0
+
+        if pending:
+            self._write_groups(pending, out)
+
+        products.close()
+
+    def _write_groups(self, groups: list, out):
+        'Fetch the descriptions of the groups, then write their rows'
+
+        self._fetch_descriptions(
+            {item['info_id']
+             for _, _, variants in groups for item in variants})
+
+        for code, product, variants in groups:
+            out.writerow(self._main_row(code, product, variants[0]))
+
+            for item in variants:
+                out.writerow(self._sub_row(item))
+
+            self.products += 1
+            self.variants += len(variants)
+
+    def _fetch_descriptions(self, ids: set):
+        'Load descriptions not already cached in a single query'
+
+        cache = self.descriptions
+
+        for key in ids:
+            if key in cache:
+                cache.move_to_end(key)
+
+        missing = [key for key in ids if key not in cache]
+
+        if not missing:
+            return
+
+        for doc in self.db.variant_info.find({'_id': {'$in': missing}}):
+            cache[doc['_id']] = description(doc)
+
+        while len(cache) > INFO_CACHE:
+            cache.popitem(last=False)
+
+    def _row(self, **values):
+        row = [''] * len(self.columns)
+
+        for column, value in values.items():
+            row[self.index[column]] = value
+
+        return row
+
+    def _main_row(self, code: str, product: dict, first: dict):
+        'Returns the MAIN row, gst and brand are read from the first variant'
+
+        brand = next(
+            (spec['v'] for spec in first['specs'] if spec['k'] == 'brand'),
+            '')
+
+        # the product title is brand + title, see BaseTemplate._set_parent
+        title = product['title']
+
+        if brand and title.startswith(f'{brand} '):
+            title = title[len(brand) + 1:]
+
+        return self._row(listing_type='MAIN',
+                         brand=brand,
+                         title=title,
+                         category_code=code,
+                         href=product['href'].split('/', 1)[1],
+                         gst=number(first['gst']))
+
+    def _sub_row(self, item: dict):
+        'Returns the SUB row of a variant'
+
+        row = self._row(listing_type='SUB',
+                        price=number(item['price']),
+                        mrp=number(item['mrp']),
+                        qty=number(item['qty']))
+
+        index = self.index
+
+        for option in item['type']:
+            row[index[option['k']]] = option['v']
+
+        for spec in item['specs']:
+            if spec['k'] in index and spec['k'] != 'brand':
+                row[index[spec['k']]] = spec['v']
+
+        for k, v in item['other_specs'].items():
+            if k in index:
+                row[index[k]] = v
+
+        for i, (path, alt) in enumerate(item['images'], 1):
+            column = f'image{i}'
+
+            if column in index:
+                row[index[column]] = f'{path}, {alt}'
+
+        text = self.descriptions.get(item.get('info_id'))
+
+        if text is None:
+            self.missing_info += 1
+            text = ''
+
+        row[index['description']] = text
+
+        return row
+
+    def report(self):
+        print(f'{self.products} products, {self.variants} variants exported')
+
+        if self.orphans:
+            print(f'{self.orphans} variants without a product skipped')
+
+        if self.missing_info:
+            print(f'{self.missing_info} variants without a description')
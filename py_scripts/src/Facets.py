@@ -0,0 +1,165 @@
+from collections import Counter
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+from CodeAllocator import CodeAllocator
+
+# Variant fields counted in facet_counts, lists of {'k': key, 'v': value}
+FIELDS = ('specs', 'type')
+
+
+class FacetCounts:
+    '''
+    Counts in stock variants per category code, field, key and value in
+    the facet_counts collection, read by the storefront shop filters
+    instead of scanning product_variants.
+
+    Import scripts count compiled variants with add, and old values of
+    updated variants with remove, then commit the deltas as $inc upserts
+    once the writer is done.
+
+    Stock sold through the storefront does not update the counts,
+    run buildFacets.py to recount them from product_variants.
+    '''
+
+    def __init__(self):
+        # (category code, field, key, value) -> change in count
+        self.delta = Counter()
+        self.categories = set()
+
+    def add(self, category: str, variant: dict, sign=1):
+        'Count the variant values, if the variant is in stock'
+
+        self.categories.add(category)
+
+        if variant.get('qty', 0) <= 0:
+            return
+
+        for field in FIELDS:
+            for option in variant.get(field, ()):
+                self.delta[(category, field, option['k'],
+                            option['v'])] += sign
+
+    def remove(self, category: str, variant: dict):
+        'Uncount the values of a variant as it was before an update'
+
+        self.add(category, variant, -1)
+
+    def add_group(self, product: dict, variants: list):
+        'Count a compiled product group, see BulkWriter.add_group'
+
+        category = product['product_code'][:-CodeAllocator.length]
+
+        for _, _, item in variants:
+            self.add(category, item)
+
+    def commit(self, db, writer):
+        '''Write the deltas once the writer is done. If some documents
+        failed to write, the categories counted are rebuilt instead.
+        Nothing is written if the writer did not commit
+        '''
+
+        if not writer.committed:
+            return
+
+        if writer.errors:
+            rebuild(db, self.categories)
+        else:
+            write_counts(db, self.delta)
+
+        self.delta.clear()
+
+
+def write_counts(db, counts: dict, stamp=None, batch_size=1000):
+    '''Upsert counts into facet_counts, keyed by
+    (category code, field, key, value).
+
+    Counts are added to the stored counts, or if stamp is set,
+    replace them and are marked with the stamp, see rebuild
+    '''
+
+    ops = []
+
+    for (category, field, k, v), count in counts.items():
+        if stamp is not None:
+            update = {'$set': {'count': count, 'built': stamp}}
+        elif count:
+            update = {'$inc': {'count': count}}
+        else:
+            continue
+
+        ops.append(
+            UpdateOne(
+                {
+                    'category_code': category,
+                    'field': field,
+                    'k': k,
+                    'v': v
+                },
+                update,
+                upsert=True))
+
+    for i in range(0, len(ops), batch_size):
+        db.facet_counts.bulk_write(ops[i:i + batch_size], ordered=False)
+
+    return len(ops)
+
+
+def rebuild(db, categories=None):
+    '''Recount facet_counts from product_variants for the category codes,
+    or every code in product_categories if None. Values are grouped on
+    the server, only the distinct values are returned.
+
+    Variants are selected on category_code, with the category page
+    indexes. Run backfillVariantCodes.py first on older databases
+
+    Returns the number of facet values written
+    '''
+
+    if categories is None:
+        categories = db.product_categories.distinct('code')
+
+    total = 0
+
+    for code in categories:
+        counts = {}
+
+        for field in FIELDS:
+            cursor = db.product_variants.aggregate([{
+                '$match': {
+                    'category_code': code,
+                    'qty': {
+                        '$gt': 0
+                    }
+                }
+            }, {
+                '$unwind': f'${field}'
+            }, {
+                '$group': {
+                    '_id': {
+                        'k': f'${field}.k',
+                        'v': f'${field}.v'
+                    },
+                    'count': {
+                        '$sum': 1
+                    }
+                }
+            }])
+
+            for doc in cursor:
+                key = (code, field, doc['_id']['k'], doc['_id']['v'])
+                counts[key] = doc['count']
+
+        # stamp the recounted values, then drop values no longer present,
+        # so the storefront never reads an empty category mid rebuild
+        stamp = ObjectId()
+
+        total += write_counts(db, counts, stamp)
+
+        db.facet_counts.delete_many({
+            'category_code': code,
+            'built': {
+                '$ne': stamp
+            }
+        })
+
+    return total
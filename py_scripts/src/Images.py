@@ -0,0 +1,234 @@
+from json import dumps, loads
+from multiprocessing import Pool
+from pathlib import Path
+from Manifest import file_hash
+
+try:
+    from PIL import Image, ImageOps
+except ModuleNotFoundError:
+    Image = None
+
+# Derivative name -> (width, height) box the image is fitted in.
+# Matches the sizes requested by the storefront for thumbnails,
+# shop list cards and the product page
+SIZES = {'thumb': (97, 73), 'list': (276, 207), 'zoom': (600, 450)}
+
+WEBP_QUALITY = 80
+
+
+def derive(args: tuple):
+    '''Runs in a worker process.
+    Hashes the source image and writes any missing WebP derivatives.
+    Returns (path, digest, {name: {'src', 'w', 'h'}}, error)
+    '''
+
+    path, source, out_dir, quality = args
+
+    try:
+        digest = file_hash(source)
+        derivatives = {}
+
+        with Image.open(source) as img:
+            img = ImageOps.exif_transpose(img)
+
+            if img.mode not in ('RGB', 'RGBA'):
+                img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+
+            for name, (width, height) in SIZES.items():
+                src = f'{width}x{height}/{digest}.webp'
+                file = out_dir / src
+
+                if file.exists():
+                    # generated for an image with the same contents
+                    with Image.open(file) as done:
+                        w, h = done.size
+                else:
+                    copy = img.copy()
+
+                    # keeps the aspect ratio, never upscales
+                    copy.thumbnail((width, height), Image.LANCZOS)
+                    w, h = copy.size
+
+                    file.parent.mkdir(parents=True, exist_ok=True)
+
+                    # rename into place, so a crash never leaves
+                    # a partial file that looks cached
+                    tmp = file.with_suffix('.tmp')
+                    copy.save(tmp, 'WEBP', quality=quality)
+                    tmp.replace(file)
+
+                derivatives[name] = {'src': src, 'w': w, 'h': h}
+
+        return path, digest, derivatives, None
+    except Exception as e:
+        return path, None, None, f'{type(e).__name__}: {e}'
+
+
+class ImageDerivatives:
+    '''
+    Generates resized WebP copies of the product images named in a
+    template file, in a process pool.
+
+    Image cells are resolved as paths relative to source_dir, ignoring
+    any query string. Images not found there, for example remote
+    placeholder urls, and paths leading outside it are left as they are.
+
+    Derivatives are written to out_dir/<width>x<height>/<hash>.webp,
+    named by the blake2b hash of the source contents, so an image is
+    only resized once however many variants or files use it.
+
+    out_dir/.derivatives.json records the size, mtime and hash of each
+    source, so unchanged sources are not read again on the next import.
+
+    Requires Pillow.
+    '''
+
+    def __init__(self,
+                 source_dir: Path,
+                 out_dir: Path,
+                 workers=1,
+                 quality=WEBP_QUALITY):
+        if Image is None:
+            raise ModuleNotFoundError(
+                'Pillow is required to generate image derivatives')
+
+        self.source_dir = source_dir
+        self.root = source_dir.resolve()
+        self.out_dir = out_dir
+        self.workers = workers
+        self.quality = quality
+
+        self.index_path = out_dir / '.derivatives.json'
+        self.index = self._load_index()
+
+        self.cached = 0
+        self.generated = 0
+
+        # (image path, error message)
+        self.errors = []
+
+    def _load_index(self):
+        'Returns the saved index, or an empty one if the sizes changed'
+
+        empty = {'sizes': SIZES, 'quality': self.quality, 'sources': {}}
+
+        if not self.index_path.exists():
+            return empty
+
+        index = loads(self.index_path.read_text())
+
+        # lists in JSON, tuples in SIZES
+        if (index.get('sizes') != {k: list(v) for k, v in SIZES.items()}
+                or index.get('quality') != self.quality):
+            return empty
+
+        return index
+
+    def save(self):
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+
+        tmp = self.index_path.with_suffix('.tmp')
+        tmp.write_text(dumps(self.index))
+        tmp.replace(self.index_path)
+
+    def resolve(self, path: str):
+        '''Returns the source file for an image path or None.
+        Paths outside source_dir, such as ../ paths, are ignored
+        '''
+
+        name = path.split('?', 1)[0].strip()
+
+        if not name:
+            return None
+
+        file = (self.source_dir / name).resolve()
+
+        if not file.is_relative_to(self.root):
+            return None
+
+        return file if file.is_file() else None
+
+    def _cached(self, source: Path):
+        'Returns the recorded derivatives if the source is unchanged'
+
+        entry = self.index['sources'].get(str(source.resolve()))
+
+        if entry is None:
+            return None
+
+        stat = source.stat()
+
+        if (entry['size'] != stat.st_size
+                or entry['mtime'] != stat.st_mtime_ns):
+            return None
+
+        derivatives = entry['derivatives']
+
+        for d in derivatives.values():
+            if not (self.out_dir / d['src']).exists():
+                return None
+
+        return derivatives
+
+    def build(self, paths):
+        '''Returns {image path: derivatives} for the image paths,
+        generating derivatives of new or changed sources. Paths without
+        a source file or that failed to convert are left out
+        '''
+
+        result = {}
+        pending = []
+
+        # counts are reported per build
+        self.cached = self.generated = 0
+        self.errors = []
+
+        for path in set(paths):
+            source = self.resolve(path)
+
+            if source is None:
+                continue
+
+            derivatives = self._cached(source)
+
+            if derivatives is None:
+                pending.append((path, source, self.out_dir, self.quality))
+            else:
+                result[path] = derivatives
+                self.cached += 1
+
+        if not pending:
+            return result
+
+        sources = {path: source for path, source, _, _ in pending}
+
+        with Pool(max(1, min(self.workers, len(pending)))) as pool:
+            for path, digest, derivatives, error in pool.imap_unordered(
+                    derive, pending, chunksize=8):
+                if error is not None:
+                    self.errors.append((path, error))
+                    continue
+
+                stat = sources[path].stat()
+
+                self.index['sources'][str(sources[path].resolve())] = {
+                    'size': stat.st_size,
+                    'mtime': stat.st_mtime_ns,
+                    'hash': digest,
+                    'derivatives': derivatives
+                }
+
+                result[path] = derivatives
+                self.generated += 1
+
+        self.save()
+
+        return result
+
+    def report(self):
+        'Print the counts of the last build and any failed images'
+
+        print(f'Images: {self.generated} generated, {self.cached} cached')
+
+        for path, error in self.errors:
+            print(f'Image {path} failed: {error}')
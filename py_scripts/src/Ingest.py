@@ -0,0 +1,153 @@
+import asyncio
+from threading import Thread
+from Model import AsyncIOMotorClient
+
+
+class IngestEngine:
+    '''
+    Writes batches to MongoDB from concurrent writer tasks on an asyncio
+    event loop, so the caller can parse the next batch while earlier
+    batches wait on the network.
+
+    Batches pass through a bounded queue. Once max_in_flight batches are
+    waiting, put and submit block until a writer picks one up, so memory
+    stays flat however fast the file is parsed.
+
+    If motor is installed and a model is passed, writes use a motor client,
+    else the blocking pymongo call on db runs in a thread.
+
+    In async code use `async with engine` with put and join.
+    In blocking code use `with engine` with submit and drain, the event
+    loop then runs in a background thread.
+
+    A batch is a collection name, a method name on the collection and its
+    arguments, for example submit('pincodes', 'bulk_write', ops).
+    done(result, error) is called once the batch is written or failed.
+    Errors without a done callback are raised by join, drain or on exit.
+    '''
+
+    def __init__(self, db, writers=4, max_in_flight=None, model=None):
+        if writers < 1:
+            raise ValueError('writers must be atleast 1')
+
+        self.db = db
+        self.writers = writers
+        self.max_in_flight = max_in_flight or writers * 2
+        self.model = model
+
+        self.async_db = None
+        self.loop = None
+        self.thread = None
+
+        # first error not handled by a done callback
+        self.error = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, exc_trace):
+        await self.stop()
+
+    def __enter__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+        self._call(self.start())
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_trace):
+        try:
+            self._call(self.stop())
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop.close()
+
+    async def start(self):
+        'Start the writer tasks on the running loop'
+
+        self.queue = asyncio.Queue(self.max_in_flight)
+
+        if self.model is not None and AsyncIOMotorClient is not None:
+            self.async_db = self.model.connect_async(self.db.name)
+
+        self.tasks = [
+            asyncio.create_task(self._writer()) for _ in range(self.writers)
+        ]
+
+    async def stop(self):
+        'Wait for queued batches, then stop the writer tasks'
+
+        try:
+            await self.join()
+        finally:
+            for task in self.tasks:
+                task.cancel()
+
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+            if self.async_db is not None:
+                self.async_db.client.close()
+                self.async_db = None
+
+    async def put(self, collection: str, method: str, *args, done=None,
+                  **kwargs):
+        'Queue a batch, waiting if max_in_flight batches are queued'
+
+        await self.queue.put((collection, method, args, kwargs, done))
+
+    async def join(self):
+        'Wait until every queued batch is written'
+
+        await self.queue.join()
+
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def submit(self, collection: str, method: str, *args, done=None,
+               **kwargs):
+        'Blocking put, for use with `with engine`'
+
+        self._call(self.put(collection, method, *args, done=done, **kwargs))
+
+    def drain(self):
+        'Blocking join, for use with `with engine`'
+
+        self._call(self.join())
+
+    def _call(self, coro):
+        'Run a coroutine on the background loop and wait for its result'
+
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def _write(self, collection: str, method: str, args, kwargs):
+        if self.async_db is not None:
+            fn = getattr(self.async_db[collection], method)
+            return await fn(*args, **kwargs)
+
+        fn = getattr(self.db[collection], method)
+        return await asyncio.to_thread(fn, *args, **kwargs)
+
+    async def _writer(self):
+        while True:
+            collection, method, args, kwargs, done = await self.queue.get()
+
+            try:
+                try:
+                    result = await self._write(collection, method, args,
+                                               kwargs)
+                except Exception as e:
+                    if done is None:
+                        raise
+
+                    done(None, e)
+                else:
+                    if done is not None:
+                        done(result, None)
+            except Exception as e:
+                self.error = self.error or e
+            finally:
+                self.queue.task_done()
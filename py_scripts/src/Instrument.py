@@ -0,0 +1,240 @@
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from threading import Lock
+from time import perf_counter
+from bson import encode
+from pymongo import monitoring
+
+try:
+    from pyinstrument import Profiler
+except ModuleNotFoundError:
+    Profiler = None
+
+
+class CommandStats(monitoring.CommandListener):
+    '''
+    Counts commands sent to MongoDB, bytes sent and received and the
+    server reported duration, per command name.
+
+    Register it with watch_commands before the first connection,
+    pymongo only adds listeners to clients created after registration.
+    '''
+
+    def __init__(self):
+        self.lock = Lock()
+        self.commands = Counter()
+        self.failed_commands = Counter()
+        self.bytes_sent = Counter()
+        self.bytes_received = Counter()
+        self.server_ms = defaultdict(float)
+
+    def started(self, event):
+        size = len(encode(event.command))
+
+        with self.lock:
+            self.commands[event.command_name] += 1
+            self.bytes_sent[event.command_name] += size
+
+    def succeeded(self, event):
+        size = len(encode(event.reply))
+
+        with self.lock:
+            self.bytes_received[event.command_name] += size
+            self.server_ms[event.command_name] += event.duration_micros / 1000
+
+    def failed(self, event):
+        with self.lock:
+            self.failed_commands[event.command_name] += 1
+            self.server_ms[event.command_name] += event.duration_micros / 1000
+
+    def snapshot(self):
+        'Returns the totals so far as a dict per command name'
+
+        with self.lock:
+            return {
+                name: {
+                    'count': count,
+                    'failed': self.failed_commands[name],
+                    'bytes_sent': self.bytes_sent[name],
+                    'bytes_received': self.bytes_received[name],
+                    'server_ms': round(self.server_ms[name], 3)
+                }
+                for name, count in self.commands.items()
+            }
+
+
+# Process wide listener, see watch_commands
+COMMANDS = None
+
+
+def watch_commands():
+    'Register the process wide CommandStats listener, once'
+
+    global COMMANDS
+
+    if COMMANDS is None:
+        COMMANDS = CommandStats()
+        monitoring.register(COMMANDS)
+
+    return COMMANDS
+
+
+class Stats:
+    '''
+    Per stage timers and counters for one import run.
+
+    Hot paths call add with a measured duration, coarser steps use the
+    stage context manager. Stages may nest, for example codes is timed
+    inside compile, so stage times are not additive.
+
+    If watch_commands was called, the report includes the MongoDB
+    commands sent since the Stats was created.
+    '''
+
+    enabled = True
+
+    def __init__(self, name=''):
+        self.name = name
+        self.seconds = defaultdict(float)
+        self.calls = Counter()
+        self.counters = Counter()
+        self.start = perf_counter()
+        self.commands = COMMANDS.snapshot() if COMMANDS else None
+
+    def add(self, stage: str, seconds: float, calls=1):
+        self.seconds[stage] += seconds
+        self.calls[stage] += calls
+
+    def count(self, name: str, n=1):
+        self.counters[name] += n
+
+    @contextmanager
+    def stage(self, stage: str):
+        start = perf_counter()
+
+        try:
+            yield
+        finally:
+            self.add(stage, perf_counter() - start)
+
+    def report(self):
+        'Returns the run statistics as a JSON serialisable dict'
+
+        report = {
+            'name': self.name,
+            'seconds': round(perf_counter() - self.start, 3),
+            'stages': {
+                stage: {
+                    'seconds': round(seconds, 3),
+                    'calls': self.calls[stage]
+                }
+                for stage, seconds in self.seconds.items()
+            },
+            'counters': dict(self.counters)
+        }
+
+        if self.commands is not None:
+            report['commands'] = self._command_delta()
+
+        return report
+
+    def _command_delta(self):
+        'Commands sent since this Stats was created'
+
+        delta = {}
+
+        for name, totals in COMMANDS.snapshot().items():
+            before = self.commands.get(name, {})
+
+            delta[name] = {
+                key: round(value - before.get(key, 0), 3)
+                for key, value in totals.items()
+            }
+
+        return {name: d for name, d in delta.items() if d['count']}
+
+    def print(self):
+        'Print the time spent in each stage'
+
+        report = self.report()
+
+        print(f"{report['name']}: {report['seconds']}s")
+
+        for stage, s in report['stages'].items():
+            print(f"  {stage}: {s['seconds']}s in {s['calls']} calls")
+
+        for name, count in report['counters'].items():
+            print(f'  {name}: {count}')
+
+        for name, c in report.get('commands', {}).items():
+            print(f"  {name}: {c['count']} commands {c['server_ms']}ms "
+                  f"{c['bytes_sent']} bytes sent")
+
+
+class NullStats(Stats):
+    'Stats that records nothing, used when instrumentation is off'
+
+    enabled = False
+
+    def __init__(self, name=''):
+        self.name = name
+
+    def add(self, stage: str, seconds: float, calls=1):
+        pass
+
+    def count(self, name: str, n=1):
+        pass
+
+    def stage(self, stage: str):
+        return nullcontext()
+
+    def report(self):
+        return {'name': self.name}
+
+    def print(self):
+        pass
+
+
+NULL_STATS = NullStats()
+
+
+@contextmanager
+def profile(kind: str, path: Path):
+    '''Profile the block with cProfile or pyinstrument,
+    writing the result to path.
+
+    cProfile output is pstats data, open it with `python -m pstats path`
+    or snakeviz. pyinstrument output is an HTML page.
+    '''
+
+    if kind == 'cprofile':
+        from cProfile import Profile
+
+        profiler = Profile()
+        profiler.enable()
+
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path)
+            print(f'Profile written to {path}')
+
+        return
+
+    if kind != 'pyinstrument':
+        raise ValueError(f'Unknown profiler {kind}')
+
+    if Profiler is None:
+        raise ModuleNotFoundError('pyinstrument is not installed')
+
+    profiler = Profiler()
+    profiler.start()
+
+    try:
+        yield
+    finally:
+        profiler.stop()
+        Path(path).write_text(profiler.output_html())
+        print(f'Profile written to {path}')
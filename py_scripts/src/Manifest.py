@@ -0,0 +1,93 @@
+from hashlib import blake2b
+from json import dumps, loads
+from pathlib import Path
+
+
+def file_hash(file: Path):
+    'Returns a blake2b hash of the file contents, read in 1MB chunks'
+
+    digest = blake2b(digest_size=16)
+
+    with file.open('rb') as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+class Manifest:
+    '''
+    A JSON file recording the size, mtime, content hash and importer
+    version of every file imported, so unchanged files can be skipped.
+
+    If size and mtime match the entry, the file is unchanged without
+    reading it. If only the mtime changed, the content hash decides.
+
+    version: str
+        Identifies the importer, for example Templates.Clothes:1
+        A file is always reprocessed when the version changes.
+
+    Entries can also hold a hash per product group, see BaseTemplate.sync
+    '''
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.entries = loads(path.read_text()) if path.exists() else {}
+
+    @staticmethod
+    def _key(file: Path):
+        return str(file.resolve())
+
+    def is_unchanged(self, file: Path, version: str):
+        entry = self.entries.get(self._key(file))
+
+        if entry is None or entry['version'] != version:
+            return False
+
+        if not file.exists():
+            return False
+
+        stat = file.stat()
+
+        if entry['size'] != stat.st_size:
+            return False
+
+        if entry['mtime'] == stat.st_mtime_ns:
+            return True
+
+        if entry['hash'] != file_hash(file):
+            return False
+
+        # contents unchanged, save the new mtime to skip the hash next time
+        entry['mtime'] = stat.st_mtime_ns
+        return True
+
+    def groups(self, file: Path, version: str):
+        'Returns the stored product group hashes for the file'
+
+        entry = self.entries.get(self._key(file))
+
+        if entry is None or entry['version'] != version:
+            return {}
+
+        return entry.get('groups', {})
+
+    def update(self, file: Path, version: str, groups=None):
+        'Record the file as imported. Call save to write the manifest'
+
+        stat = file.stat()
+
+        self.entries[self._key(file)] = {
+            'version': version,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'hash': file_hash(file),
+            'groups': groups or {}
+        }
+
+    def save(self):
+        # write to a temp file and rename, so a crash never leaves
+        # a partially written manifest
+        tmp = self.path.with_suffix('.tmp')
+        tmp.write_text(dumps(self.entries, indent=2))
+        tmp.replace(self.path)
@@ -0,0 +1,242 @@
+from array import array
+from csv import reader
+from mmap import mmap, ACCESS_READ, PAGESIZE
+from pathlib import Path
+
+try:
+    from mmap import MADV_DONTNEED, MADV_SEQUENTIAL
+except ImportError:
+    # madvise is not available on Windows
+    MADV_DONTNEED = MADV_SEQUENTIAL = None
+
+# Bytes read before pages behind the current row are released
+RELEASE_BYTES = 64 * 1024 * 1024
+
+
+class MappedReader:
+    '''
+    Reads a TSV file through a read only memory map, as a drop-in for
+    csv.reader in BaseTemplate. Rows are lists of str, the first row
+    read is the header and blank lines are returned as [].
+
+    Field boundaries are found by scanning the raw buffer for tabs and
+    newlines. Only the columns passed to use are decoded, the rest are
+    returned as '' without being copied out of the map.
+
+    Lines containing a double quote are parsed with csv.reader, so quoted
+    fields with tabs or newlines read the same as the csv module. As in
+    the csv module, only a quote at the start of a field opens a quoted
+    field, a quote inside a field (12" roller) is read as is.
+
+    index builds the byte offset of every row once, so seek_row can jump
+    straight to a row number as reported in errors (the header is row 1).
+
+    Mapped pages count towards the process RSS once read. Where madvise
+    is supported, pages behind the current row are released every
+    RELEASE_BYTES, so RSS stays flat on files larger than memory.
+    '''
+
+    def __init__(self, file: Path, encoding='utf-8'):
+        self.encoding = encoding
+        self.f = file.open('rb')
+
+        # mmap cannot map an empty file
+        if file.stat().st_size:
+            self.buf = mmap(self.f.fileno(), 0, access=ACCESS_READ)
+            self._advise(MADV_SEQUENTIAL)
+        else:
+            self.buf = b''
+
+        self.pos = 0
+        self.end = len(self.buf)
+        self.release_at = RELEASE_BYTES
+        self.used = None
+        self.offsets = None
+
+    def _advise(self, option, start=0, length=None):
+        'Call madvise if the platform supports it'
+
+        if option is None:
+            return
+
+        if length is None:
+            self.buf.madvise(option)
+        else:
+            self.buf.madvise(option, start, length)
+
+    def _release(self):
+        'Release mapped pages behind the current row'
+
+        end = self.pos - self.pos % PAGESIZE
+
+        self._advise(MADV_DONTNEED, 0, end)
+        self.release_at = self.pos + RELEASE_BYTES
+
+    def close(self):
+        if isinstance(self.buf, mmap):
+            self.buf.close()
+
+        self.f.close()
+
+    def use(self, columns):
+        'Decode only these column positions. None decodes every column'
+
+        self.used = None if columns is None else frozenset(columns)
+
+    def seek(self, offset: int, end=None):
+        '''Move to a byte offset, which must be the start of a row.
+        If end is set, reading stops at the first row starting at or after end
+        '''
+
+        self.pos = offset
+        self.end = len(self.buf) if end is None else end
+        self.release_at = offset + RELEASE_BYTES
+
+    def __iter__(self):
+        return self
+
+    def _line_end(self, pos: int):
+        end = self.buf.find(b'\n', pos)
+        return len(self.buf) if end == -1 else end
+
+    def __next__(self):
+        buf = self.buf
+        pos = self.pos
+
+        if pos >= self.end:
+            raise StopIteration
+
+        if pos >= self.release_at:
+            self._release()
+
+        end = self._line_end(pos)
+
+        if buf.find(b'"', pos, end) != -1:
+            return self._quoted(pos)
+
+        self.pos = end + 1
+
+        # strip \r from \r\n line endings
+        if end > pos and buf[end - 1] == 13:
+            end -= 1
+
+        if end == pos:
+            return []
+
+        used = self.used
+        encoding = self.encoding
+        values = []
+        start = pos
+
+        while True:
+            tab = buf.find(b'\t', start, end)
+            stop = end if tab == -1 else tab
+
+            if used is None or len(values) in used:
+                values.append(buf[start:stop].decode(encoding))
+            else:
+                values.append('')
+
+            if tab == -1:
+                return values
+
+            start = tab + 1
+
+    def _quoted(self, pos: int):
+        '''Parse a row containing quotes with csv.reader, including any
+        lines in a quoted field
+        '''
+
+        end = self._row_end(pos)
+        text = self.buf[pos:end].decode(self.encoding)
+
+        self.pos = end + 1
+
+        return next(reader([text], dialect='excel-tab'), [])
+
+    def _row_end(self, pos: int):
+        '''Returns the offset of the newline ending the row at pos.
+        Newlines in quoted fields do not end the row
+        '''
+
+        buf = self.buf
+        size = len(buf)
+        field = pos
+
+        while True:
+            i = field
+
+            # a quote opens a quoted field only as the first character
+            if i < size and buf[i] == 34:
+                i += 1
+
+                while True:
+                    quote = buf.find(b'"', i)
+
+                    if quote == -1:
+                        return size
+
+                    # "" is an escaped quote
+                    if buf[quote + 1:quote + 2] == b'"':
+                        i = quote + 2
+                        continue
+
+                    i = quote + 1
+                    break
+
+            end = self._line_end(i)
+            tab = buf.find(b'\t', i, end)
+
+            if tab == -1:
+                return end
+
+            field = tab + 1
+
+    def index(self):
+        '''Returns the byte offsets of every non blank row after the header,
+        offsets[0] is row 2. Built once and kept
+        '''
+
+        if self.offsets is not None:
+            return self.offsets
+
+        pos, end = self.pos, self.end
+        self.seek(0)
+
+        # skip the header
+        next(self, None)
+
+        offsets = array('Q')
+
+        while self.pos < len(self.buf):
+            start = self.pos
+
+            if self._skip_row():
+                offsets.append(start)
+
+            if self.pos >= self.release_at:
+                self._release()
+
+        self.seek(pos, end)
+        self.offsets = offsets
+
+        return offsets
+
+    def _skip_row(self):
+        'Move past the next row. Returns False for a blank line'
+
+        buf = self.buf
+        pos = self.pos
+        end = self._line_end(pos)
+
+        if buf.find(b'"', pos, end) != -1:
+            return bool(self._quoted(pos))
+
+        self.pos = end + 1
+
+        return buf[pos:end].strip(b'\r') != b''
+
+    def seek_row(self, row: int):
+        'Move to a row number as reported in errors, row 2 is the first row'
+
+        self.seek(self.index()[row - 2])
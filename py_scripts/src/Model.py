@@ -1,26 +1,284 @@
-from pymongo import MongoClient
+from contextlib import contextmanager
+from os import getpid
+from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
 from pathlib import Path
 
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient
+except ModuleNotFoundError:
+    AsyncIOMotorClient = None
+
+# Indexes used by the import scripts and storefront queries in model.js
+# collection name: [(keys, options), ...]
+INDEXES = {
+    'products': [
+        ([('product_code', ASCENDING)], {'unique': True}),
+
+        # checkpointed imports, see Checkpoint.py
+        ([('import_run', ASCENDING)], {'sparse': True}),
+    ],
+    'product_variants': [
+        # product page lookups and prefix anchored sku queries
+        ([('sku', ASCENDING)], {'unique': True}),
+
+        # shop listing, sorted by _id or price
+        ([('z_index', ASCENDING), ('qty', ASCENDING),
+          ('_id', DESCENDING)], {}),
+        ([('z_index', ASCENDING), ('qty', ASCENDING),
+          ('price', ASCENDING)], {}),
+
+        # category pages, see backfillVariantCodes.py for older variants
+        ([('category_code', ASCENDING), ('z_index', ASCENDING),
+          ('qty', ASCENDING), ('_id', DESCENDING)], {}),
+        ([('category_code', ASCENDING), ('z_index', ASCENDING),
+          ('qty', ASCENDING), ('price', ASCENDING)], {}),
+
+        # variants of a product on the product page
+        ([('product_code', ASCENDING)], {}),
+
+        # catalogue export, a category's variants in sku order
+        ([('category_code', ASCENDING), ('sku', ASCENDING)], {}),
+
+        # variant_info still in use and checkpointed imports,
+        # see Checkpoint.py
+        ([('info_id', ASCENDING)], {}),
+        ([('import_run', ASCENDING)], {'sparse': True}),
+
+        # shop filters on specs and types
+        ([('specs.v', ASCENDING), ('qty', ASCENDING)], {}),
+        ([('type.v', ASCENDING), ('qty', ASCENDING)], {}),
+    ],
+    'variant_info': [
+        ([('import_run', ASCENDING)], {'sparse': True}),
+    ],
+    'product_categories': [
+        ([('code', ASCENDING)], {'unique': True}),
+    ],
+    'product_code_reservations': [
+        # codes only need reserving until their products are written,
+        # see CodeAllocator.py
+        ([('created', ASCENDING)], {'expireAfterSeconds': 7 * 86400}),
+    ],
+    'pincodes': [
+        ([('Pincode', ASCENDING)], {'unique': True}),
+    ],
+    'posts': [
+        # blog post urls, see importPosts.py
+        ([('href', ASCENDING)], {'unique': True}),
+    ],
+    'facet_counts': [
+        # shop filters per category, see Facets.py
+        ([('category_code', ASCENDING), ('field', ASCENDING),
+          ('k', ASCENDING), ('v', ASCENDING)], {'unique': True}),
+    ],
+}
+
+# Index options that must match for an existing index to be used
+COMPARED_OPTIONS = ('unique', 'expireAfterSeconds')
+
+# Optional MongoClient settings read from .env
+# .env key: (MongoClient option, type)
+CLIENT_OPTIONS = {
+    'MONGO_MAX_POOL_SIZE': ('maxPoolSize', int),
+    'MONGO_MIN_POOL_SIZE': ('minPoolSize', int),
+    'MONGO_WRITE_CONCERN': ('w', lambda v: int(v) if v.isdigit() else v),
+    'MONGO_COMPRESSORS': ('compressors', str),
+    'MONGO_CONNECT_TIMEOUT_MS': ('connectTimeoutMS', int),
+    'MONGO_SOCKET_TIMEOUT_MS': ('socketTimeoutMS', int),
+    'MONGO_SERVER_SELECTION_TIMEOUT_MS': ('serverSelectionTimeoutMS', int),
+}
+
 
 class Model:
+    '''
+    Connection to the MongoDB database set in .env
+
+    A single MongoClient is created lazily per connection string and
+    options, and shared by every Model instance in the process. Forked
+    worker processes get their own client. Templates borrow it for a
+    file with borrow, scripts get the database from connect. Neither
+    closes the client.
+    Call close once at the end of a script.
+
+    Set any key in CLIENT_OPTIONS in .env to configure the client,
+    for example MONGO_MAX_POOL_SIZE=50 or MONGO_COMPRESSORS=zstd,snappy
+    Compressors need the zstandard or python-snappy package installed.
+
+    dbName is the database returned by connect when none is passed,
+    so templates can be pointed at another database
+    '''
+
+    # (process id, connection string, options) -> MongoClient
+    _clients = {}
 
-    def __init__(self, env_path: Path):
-        self.con_string = self._getConnectionString(env_path)
+    def __init__(self, env_path: Path, dbName="fusionx"):
+        self.dbName = dbName
 
-    def connect(self, dbName="fusionx"):
-        self.con = MongoClient(self.con_string)
-        self.db = self.con[dbName]
+        env = self._readEnv(env_path)
+
+        self.con_string = self._getConnectionString(env)
+
+        self.options = {
+            option: cast(env[key])
+            for key, (option, cast) in CLIENT_OPTIONS.items() if key in env
+        }
+
+    @property
+    def client(self):
+        'The shared MongoClient, created on first use'
+
+        key = self._key()
+
+        if key not in self._clients:
+            self._clients[key] = MongoClient(self.con_string, **self.options)
+
+        return self._clients[key]
+
+    def connect(self, dbName=None):
+        '''Returns the database on the shared client.
+        The client must not be closed by the caller, see close
+        '''
+
+        self.con = self.client
+        self.db = self.con[dbName or self.dbName]
         return self.db
 
+    @contextmanager
+    def borrow(self, dbName=None):
+        '''Context manager yielding the database, leaving the client open
+        for the next user. Used by BaseTemplate for the length of a file
+        '''
+
+        yield self.connect(dbName)
+
+    def connect_async(self, dbName=None):
+        '''Returns the database on a new motor client, bound to the running
+        event loop. Requires motor. Close it with db.client.close()
+        '''
+
+        if AsyncIOMotorClient is None:
+            raise ModuleNotFoundError('motor is required for async writes')
+
+        client = AsyncIOMotorClient(self.con_string, **self.options)
+        return client[dbName or self.dbName]
+
+    def close(self):
+        'Close the shared client. It is created again if used later'
+
+        client = self._clients.pop(self._key(), None)
+
+        if client is not None:
+            client.close()
+
+    def _key(self):
+        # MongoClient is not fork safe, so the process id is part of the key
+        return (getpid(), self.con_string, tuple(sorted(self.options.items())))
+
     @staticmethod
-    def _getConnectionString(env_path: Path):
+    def _readEnv(env_path: Path):
+        'Returns a dict of KEY=VALUE lines in the .env file'
+
         if not env_path.exists():
             raise FileNotFoundError(env_path)
 
+        env = {}
+
         for line in env_path.read_text().split('\n'):
-            if ('MONGO_CONN_STRING') in line:
-                return line[line.find('=') + 1:]
+            line = line.strip()
+
+            if not line or line.startswith('#') or '=' not in line:
+                continue
+
+            key, value = line.split('=', 1)
+            env[key.strip()] = value.strip().strip('"\'')
+
+        return env
+
+    @staticmethod
+    def _getConnectionString(env: dict):
+        if 'MONGO_CONN_STRING' in env:
+            return env['MONGO_CONN_STRING']
+
         raise LookupError('MONGO_CONN_STRING not set in .env')
 
     def getProductCategoryCodes(self):
         return self.db.product_categories.distinct("code")
+
+    @staticmethod
+    def _index_keys(keys: list):
+        'Normalise index keys, the server may return directions as floats'
+
+        return tuple((field, d if isinstance(d, str) else int(d))
+                     for field, d in keys)
+
+    def ensure_indexes(self, dry_run=False, background=True):
+        '''Create any index in INDEXES missing from the database.
+        Existing indexes not in INDEXES are left alone.
+
+        dry_run: Only print the differences with the existing indexes
+        background: Build without blocking the collection on servers
+        older than 4.2. Newer servers ignore it.
+
+        Returns a list of (collection, keys, status)
+        '''
+
+        actions = []
+
+        for name, indexes in INDEXES.items():
+            collection = self.db[name]
+
+            existing = {
+                self._index_keys(info['key']): info
+                for info in collection.index_information().values()
+            }
+
+            for keys, options in indexes:
+                info = existing.get(tuple(keys))
+
+                if info is not None:
+                    # unique may be reported as False or left out
+                    if all((info.get(option) or None) == (
+                            options.get(option) or None)
+                           for option in COMPARED_OPTIONS):
+                        continue
+
+                    # same keys with different options needs a manual drop
+                    actions.append((name, keys, 'Conflicting options'))
+                    continue
+
+                if dry_run:
+                    actions.append((name, keys, 'Missing'))
+                    continue
+
+                try:
+                    collection.create_index(keys,
+                                            background=background,
+                                            **options)
+                    actions.append((name, keys, 'Created'))
+                except OperationFailure as e:
+                    # Example: duplicate values for a unique index
+                    actions.append((name, keys, f'Failed: {e}'))
+
+        for name, keys, status in actions:
+            print(f'Index {name} {keys}: {status}')
+
+        return actions
+
+
+class MockModel(Model):
+    '''
+    Model on its own in-process client, usually a mongomock.MongoClient,
+    for tests and CPU only benchmarks. Nothing is read from .env and
+    close leaves the client open.
+    '''
+
+    def __init__(self, client, dbName='fusionx_test'):
+        self.con_string = 'mongomock://localhost'
+        self.options = {}
+        self.dbName = dbName
+        self.mock = client
+
+    @property
+    def client(self):
+        return self.mock
@@ -1,10 +1,140 @@
-from csv import DictReader
-from itertools import islice, chain
-from bson.objectid import ObjectId
-from string import ascii_lowercase, digits
-from random import choices
+from collections import OrderedDict, deque
+from contextlib import ExitStack
+from csv import reader
+from hashlib import blake2b
+from itertools import chain
+from json import dumps
+from multiprocessing import Pool
+from time import perf_counter
+from zlib import compress
+from bson.binary import Binary
+from pymongo import UpdateOne
 from pathlib import Path
 from Model import Model
+from CodeAllocator import CodeAllocator
+from Checkpoint import DONE, FAILED, ImportRun, rollback
+from Facets import FacetCounts
+from Instrument import NULL_STATS, Stats
+from MappedReader import MappedReader
+from Validation import ColumnarValidator
+from Writer import BulkWriter
+
+# Maps a TSV file name (without extension) to its template class
+# Populated by setting tsv_name on BaseTemplate subclasses
+TEMPLATES = {}
+
+
+# Maximum number of distinct specs or types shared between variants,
+# see BaseTemplate._interned
+INTERN_LIMIT = 10_000
+
+# Number of variant_info ids remembered per file, see BaseTemplate._info
+INFO_CACHE = 50_000
+
+# Approximate size of the shards a file is split into, see BaseTemplate.shards
+SHARD_BYTES = 8 * 1024 * 1024
+
+# Variant fields compared and updated by BaseTemplate.sync
+SYNC_FIELDS = ('title', 'price', 'mrp', 'gst', 'qty', 'images', 'specs',
+               'other_specs')
+
+
+def get_template(file: Path):
+    'Returns the template class registered for the file or None'
+    return TEMPLATES.get(file.stem)
+
+
+def group_hash(main: dict, subs: list):
+    'Returns a hash of every value in a product group'
+
+    digest = blake2b(digest_size=16)
+
+    for row in chain((main, ), (row for _, row in subs)):
+        digest.update(dumps(row.values).encode())
+
+    return digest.hexdigest()
+
+
+def variant_hash(item: dict, description: str):
+    '''Returns a hash of the variant SYNC_FIELDS and description, and its
+    image derivatives if set, so a sync with images updates variants
+    imported without them
+    '''
+
+    content = [item[field] for field in SYNC_FIELDS]
+    content.append(description)
+
+    if 'derivatives' in item:
+        content.append(item['derivatives'])
+
+    return blake2b(dumps(content).encode(), digest_size=16).hexdigest()
+
+
+def info_id(description: str):
+    '''Returns the variant_info _id for a description.
+    Equal descriptions share one variant_info document
+    '''
+
+    return blake2b(description.encode(), digest_size=16).hexdigest()
+
+
+def _compile_shard(args: tuple):
+    'Compile one shard of a file in a worker process, see BaseTemplate.run'
+
+    cls, file, options, category_codes, shard = args
+
+    tmp = cls(file, None, **options)
+
+    return list(tmp.compile(category_codes, shard))
+
+
+class Row:
+    '''A TSV row read by column name, like the dicts from DictReader.
+    Values are kept in a list and the column index is shared by every row
+    '''
+
+    __slots__ = ('values', 'index')
+
+    def __init__(self, values: list, index: dict):
+        self.values = values
+        self.index = index
+
+    def __getitem__(self, column: str):
+        return self.values[self.index[column]]
+
+
+class ColumnPlan:
+    '''Positions of the template columns in a file, built once from
+    the header row so rows are compiled without looking up column names
+    '''
+
+    __slots__ = ('index', 'width', 'parent', 'child', 'types', 'specs',
+                 'other_specs', 'images', 'used')
+
+    def __init__(self, template, columns: list):
+        self.index = {col: i for i, col in enumerate(columns)}
+        self.width = len(columns)
+
+        # (column, position) pairs checked for empty values
+        self.parent = self._pairs(template.parent_columns)
+        self.child = self._pairs(
+            chain(template.child_columns, template.all_spec_columns,
+                  template.all_other_spec_columns, template.type_columns))
+
+        self.types = self._positions(template.type_columns)
+        self.specs = self._positions(template.all_spec_columns)
+        self.other_specs = self._positions(template.all_other_spec_columns)
+        self.images = self._positions(
+            col for col in template.child_columns if col.startswith('image'))
+
+        # every column position read by the template
+        self.used = frozenset(i for _, i in chain(self.parent, self.child))
+
+    def _positions(self, columns):
+        return tuple(self.index[col] for col in columns)
+
+    def _pairs(self, columns):
+        return tuple((col, self.index[col]) for col in columns)
 
 
 class BaseTemplate:
@@ -24,8 +154,63 @@ class BaseTemplate:
     added_validations: callable - Optional method
         Any additional validations to be run on the file
 
+    tsv_name: str - Optional Attribute
+        TSV file name without extension. Registers the class in TEMPLATES,
+        so importProducts.py can pick the template for a file
+
+    version: int - Optional Attribute
+        Increment when the columns or compiled documents change,
+        so files recorded in the import manifest are processed again
+
     To generate a template file:
     Instantiate the Class and call the generate_file method
+
+    batch_size: int - Optional
+        Number of documents buffered per collection before they are
+        written to the database in a single insert_many
+
+    atomic: bool - Optional
+        If True, documents are staged in temporary collections and merged
+        into the live collections only if the entire file validates.
+        Every document is then written twice, so it is off by default and
+        groups before an invalid row are written
+
+    reserve_codes: bool - Optional
+        If True, product codes are reserved in the database before use,
+        so concurrent imports never assign the same code
+
+    validator: str - Optional
+        'stream' (default) validates rows as they are imported and stops
+        at the first error. 'columnar' first validates the whole file with
+        NumPy and reports every error at once, see Validation.py
+
+    writers: int - Optional
+        Number of batches written concurrently by run and sync, while the
+        next batch is compiled. See Ingest.py
+
+    stats: Stats - Optional
+        Records time spent reading, validating, compiling and writing,
+        printed at the end of run and sync. See Instrument.py
+
+    mmap: bool - Optional
+        If True, the file is read through a memory map and only the
+        template's columns are decoded. See MappedReader.py
+
+    workers: int - Optional
+        If more than 1, run splits the file at MAIN rows into shards of
+        about shard_bytes and compiles them in worker processes.
+        Products are still written in file order. Not used by sync
+
+    compress_info: int - Optional
+        Descriptions of atleast this many bytes are stored zlib compressed
+        in variant_info.info_z, the storefront inflates them on read.
+        Stored uncompressed if None (default)
+
+    images: ImageDerivatives - Optional
+        Resized WebP copies of the file's local images are generated
+        before compiling and recorded on each variant as derivatives,
+        see Images.py. An image replaced under the same name is picked
+        up when its variant changes
     '''
 
     parent_columns = ('listing_type', 'brand', 'title', 'category_code',
@@ -40,57 +225,161 @@ class BaseTemplate:
     # attributes that will not be used in filters
     other_spec_columns = ('weight', 'dimensions')
 
-    alpha_num = ascii_lowercase + digits
-
     type_columns = tuple()
+    tsv_name = None
+    version = 1
     added_validations = None
     added_specs = None
     added_other_specs = None
 
-    def __init__(self, file: Path, model: Model):
+    # spec columns including the added columns, set once per class
+    all_spec_columns = spec_columns
+    all_other_spec_columns = other_spec_columns
+
+    def __init__(self,
+                 file: Path,
+                 model: Model,
+                 batch_size=1000,
+                 atomic=False,
+                 reserve_codes=False,
+                 validator='stream',
+                 writers=1,
+                 stats: Stats = None,
+                 mmap=False,
+                 workers=1,
+                 shard_bytes=SHARD_BYTES,
+                 compress_info=None,
+                 images=None):
         self.file_exists = file.is_file()
 
         self.file = file
         self.model = model
+        self.batch_size = batch_size
+        self.atomic = atomic
+        self.reserve_codes = reserve_codes
+        self.validator = validator
+        self.writers = writers
+        self.stats = stats or NULL_STATS
+        self.mmap = mmap
+        self.workers = workers
+        self.shard_bytes = shard_bytes
+        self.compress_info = compress_info
+        self.images = images
+
+        # image path -> derivatives, see _build_images
+        self.derivatives = None
+
+        # row number of the first row read, the header is row 1
+        self.first_row = 2
+
+        # the database borrowed for the file, see __enter__
+        self.borrowed = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+
+        if cls.tsv_name:
+            TEMPLATES[cls.tsv_name] = cls
+
+        cls.all_spec_columns = cls.spec_columns + (cls.added_specs or ())
+        cls.all_other_spec_columns = (cls.other_spec_columns +
+                                      (cls.added_other_specs or ()))
+
+    @classmethod
+    def manifest_version(cls):
+        'Returns the version string recorded in the import manifest'
+        return f'{cls.__module__}.{cls.__name__}:{cls.version}'
 
     def __enter__(self):
         if not self.file_exists:
             return self
 
-        self.csv = self.file.open()
-        self.reader = DictReader(self.csv, dialect='excel-tab')
-
-        if self.reader.fieldnames:
-            self.length = len(self.reader.fieldnames)
+        self._open()
 
-        self.title = ''
-        self.brand = ''
+        # the database client is shared, the script closes it
+        self.borrowed = ExitStack()
+        self.db = self.borrowed.enter_context(self.model.borrow())
 
-        self.db = self.model.connect()
         self.category_codes = self.model.getProductCategoryCodes()
         return self
 
     def __exit__(self, exc_type, exc_value, exc_trace):
         if self.file_exists:
             self.csv.close()
-            self.model.con.close()
+
+        if self.borrowed is not None:
+            self.borrowed.close()
+            self.borrowed = None
 
         if exc_type:
             exit(f'{exc_type}: {self.file.name}: {exc_value}: {exc_trace}')
         return True
 
-    def _generate_code(self):
-        '''Generates a 6 digit unique product code'''
-        return ''.join(choices(self.alpha_num, k=6))
+    def _open(self):
+        'Open the file for reading'
 
-    def _validate_file(self):
+        if self.mmap:
+            self.csv = self.reader = MappedReader(self.file)
+        else:
+            self.csv = self.file.open(newline='')
+            self.reader = reader(self.csv, dialect='excel-tab')
+
+        self.columns = next(self.reader, None)
+
+        self.title = ''
+        self.brand = ''
+
+        # specs and types shared between variants, see _interned
+        self.interned = {'types': {}, 'specs': {}, 'other_specs': {}}
+
+        # variant_info ids already written, see _info
+        self.info_ids = OrderedDict()
+
+    def _rewind(self):
+        'Seek back to the start of the file and skip the header row'
+
+        self.csv.seek(0)
+
+        if not self.mmap:
+            self.reader = reader(self.csv, dialect='excel-tab')
+
+        next(self.reader, None)
+
+    def _rows(self):
+        'Yields a Row for every line after the header, skipping blank lines'
+
+        index = self.plan.index
+        width = self.plan.width
+
+        # timers only run if stats are recorded
+        timed = self.stats.enabled
+        add = self.stats.add
+
+        start = perf_counter() if timed else 0
+
+        for values in self.reader:
+            if not values:
+                continue
+
+            # short rows read as empty, as DictReader would
+            if len(values) < width:
+                values += [''] * (width - len(values))
+
+            row = Row(values, index)
+
+            if timed:
+                add('read', perf_counter() - start)
+
+            yield row
+
+            if timed:
+                start = perf_counter()
+
+    def _validate_columns(self):
         '''Checks if:
+        File exists
+        Child class defines type_columns
         File contains all columns as expected
-        No blank row or empty values in parent and child columns
-        Has atleast 1 parent row
-        Every parent has atleast 1 child row
-        On child rows, price <= MRP
-        Run the added_validations method defined on the child class
         '''
 
         if not self.file_exists:
@@ -101,81 +390,120 @@ class BaseTemplate:
                 f'{self.__class__.__name__} must have a type_columns attribute'
             )
 
-        columns = self.reader.fieldnames
+        columns = self.columns
 
         if not columns:
             raise ValueError("Not a valid template file.")
 
         for column in chain(self.parent_columns, self.child_columns,
-                            self.type_columns, self.other_spec_columns):
+                            self.type_columns, self.all_spec_columns,
+                            self.all_other_spec_columns):
             if column not in columns:
                 raise KeyError(f'{column} column missing from {self.file}')
 
-        # Must have atleast 1 parent listing with listing_type=MAIN
-        has_main = False
+        self.plan = ColumnPlan(self, columns)
 
-        # Must have atleast 1 child listing with listing_type=SUB
-        has_sub = False
+        if self.mmap:
+            # columns outside the template are read as ''
+            self.reader.use(self.plan.used)
 
-        # suppress pyright unbound warning
-        has_gst_parent = False
+    def _validate_parent(self, row: Row, count: int):
+        '''Checks the MAIN row has no empty parent columns
+        and a known category code.
 
-        # keep track of row count for error tracking
-        count = 2
+        Returns True if GST is set on the parent row
+        '''
 
-        for row in self.reader:
-            if row['listing_type'] == 'MAIN':
-                # for first parent listing, has_main is False we skip check
-                # for second parent listing, has_main is True,
-                # is has_sub is False, child listing is missing
-                if has_main and not has_sub:
-                    raise ValueError(
-                        f'Row {count}: Parent must have atleast 1 child')
-
-                has_main = True
-                has_sub = False
+        has_gst_parent = False
+        values = row.values
+
+        for column, i in self.plan.parent:
+            if column == 'gst' and values[i] == '':
                 has_gst_parent = False
 
-                for column in self.parent_columns:
-                    if column == 'gst' and row[column] == '':
-                        has_gst_parent = False
+            if (column == 'category_code'
+                    and values[i] not in self.category_codes):
+                raise ValueError(
+                    f"Row {count}: {values[i]} not found in product_categories collection."
+                )
 
-                    if (column == 'category_code' and row['category_code']
-                            not in self.category_codes):
-                        raise ValueError(
-                            f"Row {count}: {row['category_code']} not found in product_categories collection."
-                        )
+            if values[i]:
+                continue
 
-                    if row[column]:
-                        continue
+            raise ValueError(
+                f'Row {count}: {column} parent column cannot be empty')
 
-                    raise ValueError(
-                        f'Row {count}: {column} parent column cannot be empty')
+        return has_gst_parent
 
-            elif row['listing_type'] == 'SUB':
-                has_sub = True
+    def _validate_child(self, row: Row, count: int, has_gst_parent: bool):
+        '''Checks the SUB row has no empty child columns
+        and price <= MRP
+        '''
 
-                if not has_main:
-                    raise ValueError(f'Row {count}: Parent row is missing')
+        values = row.values
+
+        for column, i in self.plan.child:
+
+            # GST must be specified in either parent or all child rows
+            if column == 'gst' and not has_gst_parent and values[i] == '':
+                raise ValueError(
+                    f'Row {count}: GST not set on parent or child')
+
+            if values[i]:
+                continue
+
+            raise ValueError(
+                f'Row {count}: {column} child column cannot be empty')
 
-                for column in chain(self.child_columns, self.spec_columns,
-                                    self.other_spec_columns,
-                                    self.type_columns):
+        if float(row['price']) > float(row['mrp']):
+            raise ValueError(f'Row {count}: Price greater than MRP')
 
-                    # GST must be specified in either parent or all child rows
-                    if column == 'gst' and not has_gst_parent and row[
-                            column] == '':
+    def _groups(self):
+        '''Streams the file and yields one validated product group at a time
+        as a tuple (row number, MAIN row, [(row number, SUB row), ...])
+
+        Only the current group is held in memory. A ValueError is raised
+        as soon as an invalid row is read.
+        '''
+
+        main = None
+        subs = []
+        has_gst_parent = False
+        timed = self.stats.enabled
+        add = self.stats.add
+
+        # keep track of row count for error tracking
+        count = self.first_row
+
+        for row in self._rows():
+            if row['listing_type'] == 'MAIN':
+                if main is not None:
+                    if not subs:
                         raise ValueError(
-                            f'Row {count}: GST not set on parent or child')
+                            f'Row {count}: Parent must have atleast 1 child')
 
-                    if row[column]:
-                        continue
+                    yield main[0], main[1], subs
 
-                    raise ValueError(
-                        f'Row {count}: {column} child column cannot be empty')
+                start = perf_counter() if timed else 0
+                has_gst_parent = self._validate_parent(row, count)
 
-                if float(row['price']) > float(row['mrp']):
-                    raise ValueError(f'Row {count}: Price greater than MRP')
+                if timed:
+                    add('validate', perf_counter() - start)
+
+                main = (count, row)
+                subs = []
+
+            elif row['listing_type'] == 'SUB':
+                if main is None:
+                    raise ValueError(f'Row {count}: Parent row is missing')
+
+                start = perf_counter() if timed else 0
+                self._validate_child(row, count, has_gst_parent)
+
+                if timed:
+                    add('validate', perf_counter() - start)
+
+                subs.append((count, row))
             else:
                 raise ValueError(
                     f'Row {count}: Empty row or invalid listing_type column')
@@ -183,61 +511,104 @@ class BaseTemplate:
             # row count for error tracking
             count += 1
 
-        self.csv.seek(0)
+        if main is None:
+            raise ValueError(f'{self.file.name}: No product listings found')
+
+        if not subs:
+            raise ValueError(f'Row {count}: Parent must have atleast 1 child')
+
+        yield main[0], main[1], subs
+
+    def _validate_file(self):
+        '''Checks if:
+        File contains all columns as expected
+        No blank row or empty values in parent and child columns
+        Has atleast 1 parent row
+        Every parent has atleast 1 child row
+        On child rows, price <= MRP
+        Run the added_validations method defined on the child class
+
+        run() validates while it streams the file,
+        this method is only needed to check a file without importing it.
+        '''
+
+        self._validate_columns()
+
+        for _ in self._groups():
+            pass
+
+        self._rewind()
 
         if (callable(self.added_validations)):
             # run any added validations on child classes
             self.added_validations()
-            self.csv.seek(0)
+            self._rewind()
+
+    def _interned(self, kind: str, columns: tuple, values: tuple,
+                  as_dict=False):
+        '''Returns the specs or types for the values, built once and shared
+        by every variant with the same values. Do not modify the result.
+
+        Returns {column: value} if as_dict is True,
+        else [{'k': column, 'v': value}, ...]
+        '''
+
+        cache = self.interned[kind]
+        doc = cache.get(values)
+
+        if doc is None:
+            if len(cache) >= INTERN_LIMIT:
+                cache.clear()
+
+            if as_dict:
+                doc = dict(zip(columns, values))
+            else:
+                doc = [{'k': k, 'v': v} for k, v in zip(columns, values)]
 
-    def _get_types(self, row: dict):
+            cache[values] = doc
+
+        return doc
+
+    def _get_types(self, row: Row):
         '''Returns a list of Dictionaries containing product types
         [{'k': 'Size', 'v': 'XL'}]
         '''
 
-        options = []
-        title = ''
+        values = tuple(row.values[i] for i in self.plan.types)
 
-        if isinstance(self.type_columns, tuple):
-            for option in self.type_columns:
-                options.append({'k': option, 'v': row[option]})
-                title += row[option] + ', '
+        self.option_title = ', '.join(values).strip(', ')
 
-        # remove trailing ', '
-        self.option_title = title.strip(', ')
-        return options
+        return self._interned('types', self.type_columns, values)
 
-    def _get_specs(self, row: dict):
+    def _get_specs(self, row: Row):
         '''Returns a list of Dictionaries containing product specs
         [{'k': 'material', 'v': 'Nylon'}]
         '''
 
-        # additional product specific specs are defined on child classes
-        if type(self.added_specs) is tuple:
-            self.spec_columns += self.added_specs
-
-        specs = [{'k': 'brand', 'v': self.brand}]
+        values = (self.brand, *(row.values[i] for i in self.plan.specs))
 
-        for spec in self.spec_columns:
-            specs.append({'k': spec, 'v': row[spec]})
+        return self._interned('specs', ('brand', *self.all_spec_columns),
+                              values)
 
-        return specs
-
-    def _get_other_specs(self, row: dict):
+    def _get_other_specs(self, row: Row):
         '''Returns a Dictionary containing mandatory product specs
         {'material': 'Nylon'}
         '''
 
-        # additional prouduct specific specs are defined on child classes
-        if type(self.added_other_specs) is tuple:
-            self.other_spec_columns += self.added_other_specs
+        values = tuple(row.values[i] for i in self.plan.other_specs)
 
-        specs = {}
+        return self._interned('other_specs',
+                              self.all_other_spec_columns,
+                              values,
+                              as_dict=True)
 
-        for spec in self.other_spec_columns:
-            specs[spec] = row[spec]
+    @classmethod
+    def template_columns(cls):
+        'Returns the columns of a template file, in file order'
 
-        return specs
+        return (cls.parent_columns + cls.type_columns +
+                cls.all_spec_columns + cls.all_other_spec_columns +
+                cls.child_columns)
 
     def generate_file(self):
         """Generates a template file with the filename supplied in the contructor"""
@@ -247,88 +618,831 @@ class BaseTemplate:
                 f'{self.__class__.__name__} must have a type_columns attribute'
             )
 
-        columns = self.parent_columns + self.type_columns + self.spec_columns
+        columns = self.template_columns()
+
+        with self.file.open("w") as f:
+            f.write('\t'.join(columns) + '\nMAIN\nSUB\n')
 
-        if self.added_specs:
-            columns += self.added_specs
+    def run(self, checkpoint: ImportRun = None, import_run: ImportRun = None):
+        '''Validate and add products to the database in a single pass
+        over the file.
 
-        columns += self.other_spec_columns
+        Each product group is validated and compiled as it is read and
+        handed to the writer. With atomic=True, documents are staged in
+        temporary collections and only merged into the live collections
+        once the whole file has validated.
 
-        if self.added_other_specs:
-            columns += self.added_other_specs
+        Facet counts are updated once the documents are written,
+        see Facets.py
 
-        columns += self.child_columns
+        checkpoint: ImportRun - Optional
+            Documents are written directly, not staged, and tagged with
+            the run id. Each time a batch is written, the writer is
+            drained at the next group boundary and the row of the next
+            group is saved. Reading starts at the saved row, so a failed
+            run resumes where it stopped. See Checkpoint.py
 
-        with self.file.open("w") as f:
-            f.write('\t'.join(columns) + '\nMAIN\nSUB\n')
+        import_run: ImportRun - Optional
+            Documents are written directly and tagged with the run id,
+            without checkpoints. If the import fails or a document fails
+            to write, the run is rolled back, so importing the file again
+            does not add the groups written before the error twice
 
-    def run(self):
-        '''Run validations on the file and if error free,
-        add products to the database
+        Returns True if every document was written
         '''
 
-        self._validate_file()
+        with self.stats.stage('prepare'):
+            self._prepare()
 
-        child_count = 1
-        row_count = 2
+        self.allocator = CodeAllocator(self.db, reserve=self.reserve_codes)
 
-        items = self.db.products.find(projection={'_id': 0, 'product_code': 1})
+        writer = BulkWriter(self.db,
+                            batch_size=self.batch_size,
+                            staging=self.atomic and checkpoint is None,
+                            writers=self.writers,
+                            model=self.model,
+                            stats=self.stats)
 
-        self.codes = [item['product_code'] for item in items]
-        product = None
+        facets = FacetCounts()
+        start_row = 2 if checkpoint is None else checkpoint.row
 
-        for row in self.reader:
-            if row['listing_type'] == 'MAIN':
-                child_count = 1
+        if self.workers > 1:
+            groups = self._compile_sharded(start_row)
+        else:
+            if start_row > 2:
+                self._seek_row(start_row)
+
+            groups = self._compile()
 
-                product = self._compile_product(row)
+        if checkpoint is not None:
+            print(f'Import run {checkpoint.id} from row {start_row}')
 
-                res = self.db.products.insert_one(product)
+            if start_row > 2:
+                checkpoint.discard_unsaved()
 
-                if not res.acknowledged:
-                    print(f'Product insert failed: Row {row_count}')
+        # writer flushes at the last checkpoint
+        flushed = 0
 
-            if row['listing_type'] == 'SUB':
-                if product is None:
-                    raise Exception()
+        try:
+            with writer:
+                for row, product, variants in groups:
+                    if checkpoint is None:
+                        if import_run is not None:
+                            self.tag(import_run, product, variants)
 
-                code = product['product_code']
+                        writer.add_group(row, product, variants)
+                        facets.add_group(product, variants)
+                        continue
 
-                item = self._compile_variant(row, code, child_count)
+                    self.tag(checkpoint, product, variants)
 
-                # Add the variant description to variant_info collection
-                info_result = self.db.variant_info.insert_one(
-                    {'info': row['description']})
+                    writer.add_group(row, product, variants)
+                    facets.add_group(product, variants)
+                    checkpoint.doc['groups'] += 1
 
-                if info_result.acknowledged:
-                    # add the
-                    item['info_id'] = ObjectId(info_result.inserted_id)
-                else:
-                    print('Info insert failed', item['title'])
+                    if writer.flushes > flushed:
+                        self._checkpoint(checkpoint, writer, facets,
+                                         row + 1 + len(variants))
+                        flushed = writer.flushes
 
-                variant_result = self.db.product_variants.insert_one(item)
+            with self.stats.stage('facets'):
+                facets.commit(self.db, writer)
+        except BaseException:
+            if checkpoint is not None:
+                checkpoint.finish(FAILED)
 
-                if not variant_result.acknowledged:
-                    print(f'Variant insert failed: Row {row_count}')
+            if import_run is not None:
+                rollback(self.db, import_run.id)
+                print(f'{self.file.name}: Import run {import_run.id} '
+                      'rolled back')
 
-                child_count += 1
+            raise
 
-            row_count += 1
+        if checkpoint is not None:
+            checkpoint.finish(DONE)
 
+        writer.report()
+
+        if import_run is not None:
+            if writer.errors:
+                rollback(self.db, import_run.id)
+                print(f'{self.file.name}: Import run {import_run.id} '
+                      'rolled back')
+            else:
+                import_run.finish(DONE)
+
+        if self.images is not None:
+            self.images.report()
+
+        self.stats.print()
         print(self.file.name, 'Done')
 
-    def _compile_product(self, row: dict):
-        'Returns a Dictionary representing the product'
+        return writer.committed and not writer.errors
+
+    def _seek_row(self, row: int):
+        'Continue reading from a row number, row 2 is the first row'
+
+        self.first_row = row
+
+        if self.mmap:
+            self.reader.seek_row(row)
+            return
+
+        # csv.reader cannot seek, read past the rows before it
+        skip = row - 2
+
+        if skip:
+            for values in self.reader:
+                if values:
+                    skip -= 1
+
+                    if not skip:
+                        break
+
+    @staticmethod
+    def tag(checkpoint: ImportRun, product: dict, variants: list):
+        'Tag the documents of a group with the import run and batch'
+
+        tag = {
+            'import_run': checkpoint.id,
+            'import_batch': checkpoint.doc['batches']
+        }
+
+        product.update(tag)
+
+        for _, info, item in variants:
+            item.update(tag)
+
+            if info is not None:
+                info.update(tag)
+
+    def _checkpoint(self, checkpoint: ImportRun, writer: BulkWriter,
+                    facets: FacetCounts, row: int):
+        '''Wait for every batch to be written, then save row as the
+        checkpoint along with the facet counts so far
+        '''
+
+        with self.stats.stage('checkpoint'):
+            writer.wait()
+            facets.commit(self.db, writer)
+
+            checkpoint.save(row, checkpoint.doc['groups'],
+                            checkpoint.doc['batches'] + 1)
+
+    def compile(self, category_codes: list, shard=None):
+        '''Validate and compile the file without a database connection.
+        Yields compiled product groups, see _compile
+
+        Product codes are only unique within the file. The caller must
+        check them against the database (see CodeAllocator.claim)
+
+        Used by importProducts.py to compile files in worker processes
+
+        shard: tuple - Optional
+            (start offset, end offset, first row number) from shards.
+            Only that part of the file is compiled. The caller runs
+            added_validations once for the whole file
+        '''
+
+        if shard is not None:
+            # only the memory mapped reader can seek to a byte offset
+            self.mmap = True
+
+        self._open()
+
+        self.category_codes = category_codes
+        self.allocator = CodeAllocator()
+
+        try:
+            if shard is None:
+                self._prepare()
+            else:
+                self._validate_columns()
+
+                start, end, self.first_row = shard
+                self.reader.seek(start, end)
+
+            yield from self._compile()
+        finally:
+            self.csv.close()
+
+    def shards(self, shard_bytes=SHARD_BYTES):
+        '''Split the file at MAIN rows into shards of about shard_bytes.
+        Only the listing_type column is decoded while scanning.
+
+        Returns a list of (start offset, end offset, first row number)
+        '''
+
+        reader = MappedReader(self.file)
+
+        try:
+            column = next(reader).index('listing_type')
+            reader.use((column, ))
+
+            shards = []
+            start = pos = reader.pos
+            first = row = 2
+
+            for values in reader:
+                if values:
+                    if (values[column] == 'MAIN'
+                            and pos - start >= shard_bytes):
+                        shards.append((start, pos, first))
+                        start, first = pos, row
+
+                    row += 1
+
+                pos = reader.pos
+
+            shards.append((start, pos, first))
+        finally:
+            reader.close()
+
+        return shards
+
+    def _compile_sharded(self, from_row=2):
+        '''Yields compiled product groups in file order, compiled in shards
+        by worker processes. Atmost 2 shards per worker are compiled ahead
+        of the writer.
+
+        Product codes clashing with the database or another shard
+        are replaced.
+
+        Groups before from_row are skipped, shards ending before it
+        are not compiled.
+        '''
+
+        shards = self.shards(self.shard_bytes)
+
+        # the last shard always ends after from_row
+        shards = [
+            shard for shard, following in zip(shards, shards[1:] + [None])
+            if following is None or following[2] > from_row
+        ]
+        options = {
+            'batch_size': self.batch_size,
+            'mmap': True,
+            'compress_info': self.compress_info
+        }
+        pending = deque()
+        pool = Pool(min(self.workers, len(shards)))
+
+        try:
+            for shard in shards:
+                pending.append(
+                    pool.apply_async(_compile_shard,
+                                     ((type(self), self.file, options,
+                                       self.category_codes, shard), )))
+
+                if len(pending) >= self.workers * 2:
+                    yield from self._claim(pending.popleft(), from_row)
+
+            while pending:
+                yield from self._claim(pending.popleft(), from_row)
+        finally:
+            # terminate can hang while a task is being handed to a worker,
+            # so if the import stops early, the shards already submitted
+            # are compiled and dropped
+            pool.close()
+            pool.join()
+
+    def _claim(self, result, from_row=2):
+        'Yields the groups of a compiled shard, with product codes claimed'
+
+        start = perf_counter()
+        groups = result.get()
+        self.stats.add('wait', perf_counter() - start)
+
+        for row, product, variants in groups:
+            if row < from_row:
+                continue
+
+            code = product['product_code']
+
+            if not self.allocator.claim(code):
+                prefix = code[:-CodeAllocator.length]
+
+                self.rekey(product, variants, self.allocator.allocate(prefix))
+
+            # workers compile without the derivatives
+            if self.derivatives is not None:
+                for _, _, item in variants:
+                    self._add_derivatives(item)
+
+            self.stats.count('products')
+            self.stats.count('variants', len(variants))
+
+            yield row, product, variants
+
+    def _prepare(self):
+        '''Check the file columns, run any added validations
+        and generate image derivatives
+        '''
+
+        self._validate_columns()
+
+        if self.validator == 'columnar':
+            errors = ColumnarValidator(self).validate()
+
+            if errors:
+                raise ValueError(f'{len(errors)} errors\n' +
+                                 '\n'.join(errors))
+
+        if (callable(self.added_validations)):
+            # added validations read the whole file, so need a separate pass
+            self.added_validations()
+            self._rewind()
+
+        if self.images is not None:
+            with self.stats.stage('images'):
+                self._build_images()
+
+            self._rewind()
+
+    def _build_images(self):
+        '''Generate derivatives for every image path in the file,
+        in a pass before compiling
+        '''
+
+        images = self.plan.images
+        paths = set()
+
+        for values in self.reader:
+            for i in images:
+                if i < len(values) and values[i]:
+                    paths.add(values[i].split(',')[0].strip())
+
+        self.derivatives = self.images.build(paths)
+
+    def _compile(self):
+        '''Yields compiled product groups as a tuple
+        (row number, product, [(row number, variant_info, variant), ...])
+        '''
+
+        timed = self.stats.enabled
+        add = self.stats.add
+        count = self.stats.count
+
+        for row_count, main, subs in self._groups():
+            start = perf_counter() if timed else 0
+
+            product = self._compile_product(main)
+
+            variants = self._compile_variants(product['product_code'], subs)
+
+            if timed:
+                add('compile', perf_counter() - start)
+
+            count('products')
+            count('variants', len(variants))
+
+            yield row_count, product, variants
+
+    def _compile_variants(self, code: str, subs: list, start=1):
+        '''Returns a list of compiled variants for the SUB rows
+        [(row number, variant_info, variant), ...]
+        start is the child number of the first variant
+        '''
+
+        variants = []
+
+        for child_count, (count, row) in enumerate(subs, start):
+            item = self._compile_variant(row, code, child_count)
+
+            item['info_id'], info = self._info(row['description'])
+
+            variants.append((count, info, item))
+
+        return variants
+
+    def _info(self, description: str):
+        '''Returns (info id, variant_info document) for a description.
+
+        variant_info is content addressed, the _id is a hash of the
+        description (see info_id), so variants with the same description
+        share a document and the id is known without a query.
+
+        The document is None if it was already returned for a recent
+        variant. Documents already in the database fail to insert with a
+        duplicate key error, which BulkWriter ignores for variant_info
+        '''
+
+        key = info_id(description)
+
+        if key in self.info_ids:
+            self.info_ids.move_to_end(key)
+            return key, None
+
+        self.info_ids[key] = None
+
+        if len(self.info_ids) > INFO_CACHE:
+            self.info_ids.popitem(last=False)
+
+        if (self.compress_info is not None
+                and len(description) >= self.compress_info):
+            return key, {
+                '_id': key,
+                'info_z': Binary(compress(description.encode()))
+            }
+
+        return key, {'_id': key, 'info': description}
+
+    def sync(self, retire=False, group_hashes=None):
+        '''Update the database to match the file, writing only the changes.
+
+        Variants are matched to existing variants by category code, href
+        and type column values. A matched variant is updated only if its
+        content hash differs, and then only the changed fields are set.
+        The title and href of a matched product are set if they differ
+        from its MAIN row. New variants and products are inserted.
+
+        If retire is True, existing variants in the file's categories that
+        are missing from the file are marked retired with qty set to 0.
+
+        Facet counts are updated by the difference between the old and
+        new values of the variants written, see Facets.py
+
+        Changes are written as the file streams, so an invalid row leaves
+        the earlier groups synced. Fix the file and sync again.
+
+        group_hashes: dict - Optional
+            Product group hashes from a previous sync (see Manifest.groups).
+            Groups with an unchanged hash are skipped without compiling.
+            The new hashes are stored in self.group_hashes
+
+        Returns True if every change was written
+        '''
+
+        group_hashes = group_hashes or {}
+        self.group_hashes = {}
+
+        with self.stats.stage('prepare'):
+            self._prepare()
+
+        self.allocator = CodeAllocator(self.db, reserve=self.reserve_codes)
+
+        # (category code, href, type values) -> existing variant
+        self.existing = {}
+
+        # (category code, href) -> (product code, last child number)
+        self.children = {}
+
+        # (category code, href) -> existing product
+        self.products = {}
+
+        # categories with existing variants loaded
+        self.loaded = set()
+
+        seen = set()
+        changed = []
+        unchanged = 0
+        timed = self.stats.enabled
+
+        writer = BulkWriter(self.db,
+                            batch_size=self.batch_size,
+                            writers=self.writers,
+                            model=self.model,
+                            stats=self.stats)
+
+        facets = FacetCounts()
+
+        with writer:
+            for row_count, main, subs in self._groups():
+                category = main['category_code']
+
+                with self.stats.stage('load'):
+                    self._load_variants(category)
+
+                href = main['href'].lower().replace(' ', '-')
+                product_key = (category, href)
+
+                digest = group_hash(main, subs)
+                self.group_hashes[f'{category}/{href}'] = digest
+
+                if (product_key in self.children
+                        and group_hashes.get(f'{category}/{href}') == digest):
+                    # group unchanged since the last sync
+                    for _, row in subs:
+                        doc = self.existing.get(
+                            (*product_key,
+                             tuple(row.values[i] for i in self.plan.types)))
+
+                        if doc is not None:
+                            seen.add(doc['_id'])
+
+                    unchanged += len(subs)
+                    continue
+
+                if product_key not in self.children:
+                    product = self._compile_product(main)
+                    code = product['product_code']
+                    variants = self._compile_variants(code, subs)
+
+                    writer.add_group(row_count, product, variants)
+                    facets.add_group(product, variants)
+
+                    self.children[product_key] = (code, len(subs))
+                    continue
+
+                self._set_parent(main)
+
+                code, last = self.children[product_key]
+
+                self._update_product(product_key, code, writer, row_count)
+
+                for count, row in subs:
+                    key = (*product_key,
+                           tuple(row.values[i] for i in self.plan.types))
+
+                    doc = self.existing.get(key)
+
+                    if doc is None:
+                        last += 1
+
+                        variants = self._compile_variants(
+                            code, [(count, row)], last)
+
+                        writer.add_group(count, None, variants)
+                        facets.add(category, variants[0][2])
+                        continue
+
+                    seen.add(doc['_id'])
+
+                    start = perf_counter() if timed else 0
+                    item = self._compile_variant(row, code,
+                                                 int(doc['sku'][-3:]))
+
+                    if timed:
+                        self.stats.add('compile', perf_counter() - start)
+
+                    if item['hash'] == doc.get('hash'):
+                        unchanged += 1
+                        continue
+
+                    changed.append(
+                        (count, category, doc, item, row['description']))
+
+                    if len(changed) == self.batch_size:
+                        with self.stats.stage('diff'):
+                            self._update_changed(changed, writer, facets)
+
+                        changed = []
+
+                self.children[product_key] = (code, last)
+
+            with self.stats.stage('diff'):
+                self._update_changed(changed, writer, facets)
+
+            if retire:
+                retired = [(category, doc)
+                           for (category, _, _), doc in self.existing.items()
+                           if doc['_id'] not in seen
+                           and not doc.get('retired')]
+
+                for i in range(0, len(retired), self.batch_size):
+                    self._retire(retired[i:i + self.batch_size], writer,
+                                 facets)
+
+        with self.stats.stage('facets'):
+            facets.commit(self.db, writer)
+
+        writer.report()
+
+        if self.images is not None:
+            self.images.report()
+
+        self.stats.count('unchanged', unchanged)
+        self.stats.print()
+        print(f'{unchanged} variants unchanged')
+        print(self.file.name, 'Done')
+
+        return writer.committed and not writer.errors
+
+    def _load_variants(self, category: str):
+        '''Load existing variants for the category, used by sync.
+        Selected on the indexed category_code, run backfillVariantCodes.py
+        first on older databases
+        '''
+
+        if category in self.loaded:
+            return
+
+        cursor = self.db.product_variants.find(
+            {'category_code': category},
+            projection={
+                'sku': 1,
+                'href': 1,
+                'type': 1,
+                'hash': 1,
+                'info_id': 1,
+                'retired': 1
+            })
+
+        for doc in cursor:
+            href = doc['href'].split('/', 1)[1]
+            types = tuple(option['v'] for option in doc['type'])
+
+            self.existing[(category, href, types)] = doc
+
+            # sku is product code + 3 digit child number
+            code = doc['sku'][:-3]
+            child = int(doc['sku'][-3:])
+
+            last = self.children.get((category, href), (code, 0))[1]
+            self.children[(category, href)] = (code, max(last, child))
+
+        self._load_products(category)
+        self.loaded.add(category)
+
+    def _load_products(self, category: str):
+        'Load the products of the category variants loaded, used by sync'
+
+        keys = {
+            code: key
+            for key, (code, _) in self.children.items() if key[0] == category
+        }
+
+        codes = list(keys)
+
+        for i in range(0, len(codes), self.batch_size):
+            cursor = self.db.products.find(
+                {'product_code': {
+                    '$in': codes[i:i + self.batch_size]
+                }},
+                projection={
+                    'product_code': 1,
+                    'title': 1,
+                    'href': 1
+                })
+
+            for doc in cursor:
+                self.products[keys[doc['product_code']]] = doc
+
+    def _update_product(self, key: tuple, code: str, writer: BulkWriter,
+                        row: int):
+        '''Set the title and href of an existing product, if they differ
+        from the MAIN row. Call after _set_parent
+        '''
+
+        doc = self.products.get(key)
+
+        if doc is None:
+            return
+
+        # as set by _compile_product
+        fields = {'title': self.title, 'href': f'{code}001/{self.href}'}
+
+        fields = {
+            field: value
+            for field, value in fields.items() if doc.get(field) != value
+        }
+
+        if not fields:
+            return
+
+        doc.update(fields)
+        writer.update('products', UpdateOne({'_id': doc['_id']},
+                                            {'$set': fields}), row)
+
+    def _update_changed(self, changed: list, writer: BulkWriter,
+                        facets: FacetCounts):
+        '''Set only the changed fields on variants whose hash differs.
+        Current values are fetched for the whole batch in one query.
+
+        variant_info documents may be shared, so they are never updated.
+        A changed description points the variant to the info of the new
+        description instead
+        '''
+
+        if not changed:
+            return
+
+        ids = [doc['_id'] for _, _, doc, _, _ in changed]
+
+        current = {
+            doc['_id']: doc
+            for doc in self.db.product_variants.find(
+                {'_id': {
+                    '$in': ids
+                }},
+                projection=dict.fromkeys(SYNC_FIELDS + ('derivatives', ), 1))
+        }
+
+        for count, category, doc, item, description in changed:
+            old = current.get(doc['_id'], {})
+
+            facets.remove(category, {**old, 'type': doc['type']})
+            facets.add(category, item)
+
+            fields = {
+                field: item[field]
+                for field in SYNC_FIELDS if old.get(field) != item[field]
+            }
+
+            if ('derivatives' in item
+                    and old.get('derivatives') != item['derivatives']):
+                fields['derivatives'] = item['derivatives']
+
+            fields['hash'] = item['hash']
+
+            key, info = self._info(description)
+
+            if doc.get('info_id') != key:
+                fields['info_id'] = key
+
+                if info is not None:
+                    writer.add('variant_info', info, count)
+
+            writer.update(
+                'product_variants',
+                UpdateOne({'_id': doc['_id']}, {
+                    '$set': fields,
+                    '$unset': {
+                        'retired': ''
+                    }
+                }), count)
+
+    def _retire(self, retired: list, writer: BulkWriter,
+                facets: FacetCounts):
+        '''Mark variants retired with qty set to 0.
+        retired is a list of (category code, existing variant).
+        Current qty and specs are fetched in one query, to uncount them
+        '''
+
+        current = {
+            doc['_id']: doc
+            for doc in self.db.product_variants.find(
+                {'_id': {
+                    '$in': [doc['_id'] for _, doc in retired]
+                }},
+                projection={
+                    'qty': 1,
+                    'specs': 1
+                })
+        }
+
+        for category, doc in retired:
+            facets.remove(category, {
+                **current.get(doc['_id'], {}), 'type': doc['type']
+            })
+
+            writer.update(
+                'product_variants',
+                UpdateOne({'_id': doc['_id']}, {
+                    '$set': {
+                        'qty': 0,
+                        'retired': True
+                    },
+                    '$unset': {
+                        'hash': ''
+                    }
+                }), None)
+
+    def _add_derivatives(self, item: dict):
+        '''Record the derivatives of each image on the variant,
+        None for images without any
+        '''
+
+        item['derivatives'] = [
+            self.derivatives.get(path) for path, _ in item['images']
+        ]
+
+    @staticmethod
+    def rekey(product: dict, variants: list, product_code: str):
+        '''Replace the product code on a compiled product group.
+        Used to resolve code collisions between files compiled in parallel
+        '''
+
+        old_code = product['product_code']
+
+        product['product_code'] = product_code
+        product['href'] = product['href'].replace(old_code, product_code, 1)
+
+        for _, _, item in variants:
+            item['product_code'] = product_code
+            item['sku'] = item['sku'].replace(old_code, product_code, 1)
+            item['href'] = item['href'].replace(old_code, product_code, 1)
+
+    def _set_parent(self, row: Row):
+        'Set the parent attributes used when compiling variants'
 
         self.brand = row['brand']
         self.title = f'{self.brand} {row["title"]}'
+        self.category_code = row['category_code']
         self.href = row['href'].lower().replace(' ', '-')
         self.gst = int(row['gst']) if row['gst'] else None
 
-        product_code = row['category_code'] + self._generate_code()
+    def _compile_product(self, row: Row):
+        'Returns a Dictionary representing the product'
+
+        self._set_parent(row)
 
-        while product_code in self.codes:
-            product_code = row['category_code'] + self._generate_code()
+        if self.stats.enabled:
+            start = perf_counter()
+            product_code = self.allocator.allocate(row['category_code'])
+            self.stats.add('codes', perf_counter() - start)
+        else:
+            product_code = self.allocator.allocate(row['category_code'])
 
         # href links to first child
         link = f'{product_code}001/{self.href}'
@@ -339,17 +1453,19 @@ class BaseTemplate:
             'href': link.lower().replace(' ', '-'),
         }
 
-    def _compile_variant(self, row: dict, category_code: str,
+    def _compile_variant(self, row: Row, product_code: str,
                          child_count: int):
         'Returns a dictionary describing the product variant'
 
         # get the variants and set the variant_title
         # child_count is 0 padded upto 3 chars - 001 002 etc
-        sku = f'{category_code}{child_count:03d}'
+        sku = f'{product_code}{child_count:03d}'
         item_types = self._get_types(row)
 
         item = {
             'sku': sku,
+            'category_code': self.category_code,
+            'product_code': product_code,
             'href': f'{sku}/{self.href}',
             'title': f'{self.title}, {self.option_title}',
             'price': float(row['price']),
@@ -363,22 +1479,29 @@ class BaseTemplate:
             'z_index': 1 if child_count == 1 else 0.5
         }
 
-        # description is the last column,
-        # So with 5 images we start length - 6 and end length - 1
-        for i in islice(row, self.length - 6, self.length - 1):
-            img = row[i].split(',')
+        for i in self.plan.images:
+            img = row.values[i].split(',')
             item['images'].append([img[0].strip(), img[1].strip()])
 
+        if self.derivatives is not None:
+            self._add_derivatives(item)
+
+        # used by sync to detect changed variants
+        item['hash'] = variant_hash(item, row['description'])
+
         return item
 
 
 class FoamRoller(BaseTemplate):
     type_columns = ('density', )
+    tsv_name = 'foam-roller'
 
 
 class Clothes(BaseTemplate):
     type_columns = ('color', 'size')
+    tsv_name = 'clothes'
 
 
 class ExerciseBands(BaseTemplate):
     type_columns = ('tension', )
+    tsv_name = 'exercise-bands'
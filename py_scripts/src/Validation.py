@@ -0,0 +1,163 @@
+from csv import reader
+from itertools import chain, islice
+
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    np = None
+
+
+class ColumnarValidator:
+    '''
+    Validates a template file column by column with NumPy and returns
+    every error in the file, instead of stopping at the first invalid row.
+
+    The file is read in chunks of chunk_size rows. Columns whose values
+    are compared are kept as arrays, for all other required columns only
+    a mask of empty cells is kept. MAIN/SUB group boundaries are computed
+    once and each rule is evaluated as a mask over all rows.
+
+    Requires numpy. Applies the same rules as BaseTemplate._groups
+    '''
+
+    # columns whose values are needed, not just whether they are empty
+    value_columns = ('listing_type', 'category_code', 'price', 'mrp')
+
+    def __init__(self, template, chunk_size=100_000):
+        if np is None:
+            raise ModuleNotFoundError(
+                'numpy is required for columnar validation')
+
+        self.template = template
+        self.chunk_size = chunk_size
+
+        self.parent_columns = template.parent_columns
+        self.child_columns = tuple(
+            chain(template.child_columns, template.all_spec_columns,
+                  template.all_other_spec_columns, template.type_columns))
+
+    def _load(self):
+        '''Returns a tuple (values, empty)
+        values: column name -> array of values for value_columns
+        empty: column name -> boolean array, True where the cell is empty
+        '''
+
+        required = tuple(
+            dict.fromkeys(chain(self.parent_columns, self.child_columns)))
+
+        values = {col: [] for col in self.value_columns}
+        empty = {col: [] for col in required}
+
+        with self.template.file.open(newline='') as f:
+            rows = reader(f, dialect='excel-tab')
+
+            header = next(rows)
+            width = len(header)
+            index = {col: i for i, col in enumerate(header)}
+
+            # blank lines are skipped, as DictReader does
+            rows = (row for row in rows if row)
+
+            while chunk := list(islice(rows, self.chunk_size)):
+                # pad short rows, so every column has a value per row
+                columns = list(
+                    zip(*(row + [''] * (width - len(row)) for row in chunk)))
+
+                for col in values:
+                    values[col].append(
+                        np.array(columns[index[col]], dtype=object))
+
+                for col in empty:
+                    empty[col].append(
+                        np.array(columns[index[col]], dtype=object) == '')
+
+        if not values['listing_type']:
+            return None, None
+
+        return ({col: np.concatenate(arr)
+                 for col, arr in values.items()},
+                {col: np.concatenate(arr)
+                 for col, arr in empty.items()})
+
+    @staticmethod
+    def _to_float(arr):
+        'Returns arr as floats with NaN where a value is not a number'
+
+        try:
+            return arr.astype(float)
+        except ValueError:
+            out = np.full(len(arr), np.nan)
+
+            for i, value in enumerate(arr):
+                try:
+                    out[i] = float(value)
+                except ValueError:
+                    pass
+
+            return out
+
+    def validate(self):
+        'Returns a list of error messages, sorted by row number'
+
+        self.template._validate_columns()
+
+        values, empty = self._load()
+
+        if values is None:
+            return [f'{self.template.file.name}: No product listings found']
+
+        errors = []
+
+        # row numbers as reported by the template, header is row 1
+        row_num = np.arange(2, len(values['listing_type']) + 2)
+
+        def report(mask, message):
+            for num in row_num[mask]:
+                errors.append((int(num), f'Row {num}: {message}'))
+
+        listing_type = values['listing_type']
+        is_main = listing_type == 'MAIN'
+        is_sub = listing_type == 'SUB'
+
+        # group number of each row, 0 for rows before the first MAIN
+        group = np.cumsum(is_main)
+
+        report(~(is_main | is_sub), 'Empty row or invalid listing_type column')
+        report(is_sub & (group == 0), 'Parent row is missing')
+
+        # number of SUB rows in each group
+        children = np.bincount(group[is_sub], minlength=group[-1] + 1)
+        report(is_main & (children[group] == 0),
+               'Parent must have atleast 1 child')
+
+        for col in self.parent_columns:
+            report(is_main & empty[col],
+                   f'{col} parent column cannot be empty')
+
+        category = values['category_code']
+        known = np.isin(category,
+                        np.array(self.template.category_codes, dtype=object))
+
+        for num, code in zip(row_num[is_main & ~known],
+                             category[is_main & ~known]):
+            errors.append(
+                (int(num), f'Row {num}: {code} not found in '
+                 'product_categories collection.'))
+
+        for col in self.child_columns:
+            report(is_sub & empty[col], f'{col} child column cannot be empty')
+
+        price = self._to_float(values['price'])
+        mrp = self._to_float(values['mrp'])
+
+        filled = is_sub & ~empty['price'] & ~empty['mrp']
+
+        report(filled & (np.isnan(price) | np.isnan(mrp)),
+               'Price or MRP is not a number')
+
+        with np.errstate(invalid='ignore'):
+            report(filled & (price > mrp), 'Price greater than MRP')
+
+        errors.sort(key=lambda error: error[0])
+
+        return [message for _, message in errors]
@@ -0,0 +1,379 @@
+from functools import partial
+from bson.objectid import ObjectId
+from pymongo.errors import BulkWriteError
+from Ingest import IngestEngine
+from Instrument import NULL_STATS
+
+# MongoDB error code for a unique index violation
+DUPLICATE_KEY = 11000
+
+
+class BulkWriter:
+    '''
+    Buffers documents per collection and writes them in batches
+    using unordered insert_many. Update operations are buffered the same
+    way and written with unordered bulk_write.
+
+    Each document is stored alongside the TSV row number it was compiled
+    from, so a failed insert can be reported back to the original row.
+
+    Buffers are flushed in the order of the collections tuple, so products
+    are written before variant_info and product_variants.
+
+    If staging is True, documents are written to temporary collections.
+    On a clean exit they are merged into the live collections, see commit.
+    The temporary collections are always dropped on exit.
+
+    If writers is more than 1, batches are handed to an IngestEngine and
+    written concurrently while the caller compiles the next batch.
+    Pass the model to write with motor, if installed.
+
+    Time spent writing, including waiting on the engine, is recorded
+    in the write stage of stats, see Instrument.py
+
+    Documents in content_addressed collections have an _id derived from
+    their content. A duplicate key error means the document already
+    exists, so it is counted as reused instead of failing the row, and
+    staged documents are merged keeping the existing document.
+    '''
+
+    collections = ('products', 'variant_info', 'product_variants')
+
+    content_addressed = ('variant_info', )
+
+    # prefix of the row value in failed write reports
+    row_label = 'Row'
+
+    def __init__(self,
+                 db,
+                 batch_size=1000,
+                 staging=False,
+                 writers=1,
+                 model=None,
+                 stats=NULL_STATS):
+        if batch_size < 1:
+            raise ValueError('batch_size must be atleast 1')
+
+        self.db = db
+        self.batch_size = batch_size
+        self.staging = staging
+        self.stats = stats
+
+        # collection name to write to for each target collection
+        self.targets = {name: name for name in self.collections}
+
+        if staging:
+            suffix = str(ObjectId())
+
+            for name in self.collections:
+                self.targets[name] = f'tmp_{name}_{suffix}'
+
+        self.docs = {name: [] for name in self.collections}
+        self.rows = {name: [] for name in self.collections}
+
+        # update operations and their row numbers
+        self.ops = {name: [] for name in self.collections}
+        self.op_rows = {name: [] for name in self.collections}
+
+        self.inserted = dict.fromkeys(self.collections, 0)
+        self.updated = dict.fromkeys(self.collections, 0)
+        self.reused = dict.fromkeys(self.collections, 0)
+
+        # List of (collection, row number, error message)
+        self.errors = []
+
+        self.committed = not staging
+        self.aborted = False
+
+        # number of times buffered documents were written, see wait
+        self.flushes = 0
+
+        self.engine = None
+
+        if writers > 1:
+            self.engine = IngestEngine(db, writers=writers, model=model)
+
+    def __enter__(self):
+        if self.engine is not None:
+            self.engine.__enter__()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_trace):
+        if self.aborted:
+            return
+
+        # Do not write out buffered documents if the import failed
+        if exc_type is None:
+            self.flush()
+
+        # wait for batches still being written
+        with self.stats.stage('write'):
+            self._stop_engine()
+
+        if not self.staging:
+            return
+
+        try:
+            if exc_type is None and not self.errors:
+                with self.stats.stage('commit'):
+                    self.commit()
+        finally:
+            self.discard()
+
+    def add(self, collection: str, doc: dict, row: int):
+        'Buffer a document for insert, flushing if the batch is full'
+
+        if self.aborted:
+            return
+
+        self.docs[collection].append(doc)
+        self.rows[collection].append(row)
+
+        if len(self.docs[collection]) >= self.batch_size:
+            self.flush()
+
+    def update(self, collection: str, op, row):
+        '''Buffer a pymongo UpdateOne or UpdateMany operation
+        Updates are written to the live collections, they cannot be staged
+        '''
+
+        if self.staging:
+            raise ValueError('Update operations cannot be staged')
+
+        if self.aborted:
+            return
+
+        self.ops[collection].append(op)
+        self.op_rows[collection].append(row)
+
+        if len(self.ops[collection]) >= self.batch_size:
+            self.flush()
+
+    def add_group(self, row: int, product, variants: list):
+        '''Buffer a compiled product group
+        product: dict or None to add variants to an existing product
+        variants: [(row number, variant_info or None, variant), ...]
+        '''
+
+        if product is not None:
+            self.add('products', product, row)
+
+        for count, info, item in variants:
+            # None if already added, see BaseTemplate._info
+            if info is not None:
+                self.add('variant_info', info, count)
+
+            self.add('product_variants', item, count)
+
+    def flush(self):
+        'Write out all buffered documents'
+
+        with self.stats.stage('write'):
+            self._flush()
+
+        self.flushes += 1
+
+    def wait(self):
+        '''Write out buffered documents and wait until every batch,
+        including those handed to the engine, is written
+        '''
+
+        self.flush()
+
+        if self.engine is not None:
+            with self.stats.stage('write'):
+                self.engine.drain()
+
+    def _flush(self):
+        for name in self.collections:
+            docs = self.docs[name]
+
+            if not docs:
+                continue
+
+            done = partial(self._inserted, name, self.rows[name])
+            self.stats.count('batches')
+
+            if self.engine is not None:
+                self.engine.submit(self.targets[name],
+                                   'insert_many',
+                                   docs,
+                                   ordered=False,
+                                   done=done)
+            else:
+                try:
+                    done(self.db[self.targets[name]].insert_many(
+                        docs, ordered=False))
+                except BulkWriteError as e:
+                    done(None, e)
+
+            self.docs[name] = []
+            self.rows[name] = []
+
+        for name in self.collections:
+            ops = self.ops[name]
+
+            if not ops:
+                continue
+
+            done = partial(self._updated, name, self.op_rows[name])
+            self.stats.count('batches')
+
+            if self.engine is not None:
+                self.engine.submit(name,
+                                   'bulk_write',
+                                   ops,
+                                   ordered=False,
+                                   done=done)
+            else:
+                try:
+                    done(self.db[name].bulk_write(ops, ordered=False))
+                except BulkWriteError as e:
+                    done(None, e)
+
+            self.ops[name] = []
+            self.op_rows[name] = []
+
+    def _inserted(self, name: str, rows: list, res, error=None):
+        'Count an insert_many result, recording the rows of failed documents'
+
+        if error is None:
+            self.inserted[name] += len(res.inserted_ids)
+            return
+
+        if not isinstance(error, BulkWriteError):
+            raise error
+
+        self.inserted[name] += error.details.get('nInserted', 0)
+        self._write_errors(name, rows, error)
+
+    def _updated(self, name: str, rows: list, res, error=None):
+        'Count a bulk_write result, recording the rows of failed operations'
+
+        if error is None:
+            self.updated[name] += res.modified_count
+            return
+
+        if not isinstance(error, BulkWriteError):
+            raise error
+
+        self.updated[name] += error.details.get('nModified', 0)
+        self._write_errors(name, rows, error)
+
+    def _write_errors(self, name: str, rows: list, error: BulkWriteError):
+        for err in error.details.get('writeErrors', []):
+            if (name in self.content_addressed
+                    and err.get('code') == DUPLICATE_KEY):
+                self.reused[name] += 1
+                continue
+
+            self.errors.append(
+                (name, rows[err['index']], err.get('errmsg', '')))
+
+    def _stop_engine(self):
+        'Wait for batches being written and stop the engine'
+
+        if self.engine is not None:
+            engine, self.engine = self.engine, None
+            engine.__exit__(None, None, None)
+
+    def commit(self):
+        '''Merge the staged documents into the live collections.
+
+        Each collection is merged with its own $merge, so a commit is not
+        atomic across collections. If a merge fails, for example on a
+        duplicate sku, the documents of the collections merged so far,
+        including the failed one, are deleted again by _id before the
+        error is raised. Documents in content_addressed collections are
+        kept, as they may already have been shared with other documents
+        '''
+
+        merged = []
+
+        try:
+            for name in self.collections:
+                if not self.inserted[name]:
+                    continue
+
+                if name in self.content_addressed:
+                    matched = 'keepExisting'
+                else:
+                    matched = 'fail'
+
+                # a failed $merge may have inserted part of the collection
+                merged.append(name)
+
+                self.db[self.targets[name]].aggregate([{
+                    '$merge': {
+                        'into': name,
+                        'whenMatched': matched,
+                        'whenNotMatched': 'insert'
+                    }
+                }])
+        except BaseException:
+            self._unmerge(merged)
+            raise
+
+        self.committed = True
+
+    def _unmerge(self, names: list):
+        'Delete the staged documents of the collections from the live ones'
+
+        for name in names:
+            if name in self.content_addressed:
+                continue
+
+            cursor = self.db[self.targets[name]].find(
+                projection={'_id': 1}, batch_size=self.batch_size)
+
+            ids = []
+
+            for doc in cursor:
+                ids.append(doc['_id'])
+
+                if len(ids) == self.batch_size:
+                    self.db[name].delete_many({'_id': {'$in': ids}})
+                    ids = []
+
+            if ids:
+                self.db[name].delete_many({'_id': {'$in': ids}})
+
+    def abort(self):
+        'Drop buffered and staged documents. Nothing more will be written'
+
+        self.docs = {name: [] for name in self.collections}
+        self.rows = {name: [] for name in self.collections}
+        self.ops = {name: [] for name in self.collections}
+        self.op_rows = {name: [] for name in self.collections}
+        self.aborted = True
+
+        # batches already handed to the engine are written before discard
+        self._stop_engine()
+
+        if self.staging:
+            self.discard()
+
+    def discard(self):
+        'Drop the temporary staging collections'
+
+        for name in self.collections:
+            self.db.drop_collection(self.targets[name])
+
+    def report(self):
+        'Print inserted counts and any failed rows'
+
+        for name, count in self.inserted.items():
+            print(f'{name}: {count} inserted')
+
+            if self.updated[name]:
+                print(f'{name}: {self.updated[name]} updated')
+
+            if self.reused[name]:
+                print(f'{name}: {self.reused[name]} reused')
+
+        for name, row, msg in self.errors:
+            print(f'{name} write failed: {self.row_label} {row}: {msg}')
+
+        if not self.committed:
+            print('Staged documents discarded. Nothing was written.')
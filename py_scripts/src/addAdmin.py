@@ -32,4 +32,4 @@ else:
 Matched: {result.matched_count}
 Modified: {result.modified_count}''')
 
-model.con.close()
+model.close()
@@ -1,59 +1,60 @@
 from pathlib import Path
 from Model import Model
-from csv import DictReader
+from Manifest import Manifest
+from Categories import read_categories, import_categories
 from sys import argv
 
 ##
 # Add product categories to be displayed in main navigation
 # Pass a CSV file with following fields: category, code, desc, subcategory
 #
-# py addCategory.py <path to CSV file>
+# Existing codes are left unchanged. Pass --update to update their
+# desc and subcategory from the file.
+#
+# Imported files are recorded in tsv/.manifest.json and skipped
+# if unchanged. Pass --force to import anyway.
+#
+# py addCategory.py <path to CSV file> [--update] [--force]
 ##
 
 DIR = Path(__file__).parent
 ENV_PATH = DIR.parent / '..' / 'src' / '.env'
+MANIFEST_PATH = DIR / 'tsv' / '.manifest.json'
+
+# Increment if the documents written by this script change
+VERSION = 'addCategory:1'
 
-cols = ('category', 'code', 'desc', 'subcategory')
-docs = []
+if len(argv) == 1:
+    exit('Pass the path to a CSV file.')
 
 file = Path(argv[1])
+update = '--update' in argv
 
 if not file.exists():
     exit('File does not exist')
 
-reader = DictReader(file.open())
+manifest = Manifest(MANIFEST_PATH)
 
-fields = reader.fieldnames
+if ('--force' not in argv and not update
+        and manifest.is_unchanged(file, VERSION)):
+    exit(f'{file.name} Unchanged. Skipping')
 
-if not isinstance(fields, list):
-    exit('Missing columns')
-
-for col in cols:
-    if col not in fields:
-        exit(f'Invalid CSV file: Missing {col} field.')
+try:
+    docs = read_categories(file)
+except (KeyError, ValueError) as e:
+    exit(e.args[0])
 
 model = Model(ENV_PATH)
 db = model.connect()
+model.ensure_indexes()
 
-for row in reader:
-    res = db.product_categories.find_one({"code": row['code']})
-
-    if res is not None:
-        continue
-
-    docs.append({
-        "category": row["category"],
-        "code": row["code"],
-        "subcategory": row["subcategory"],
-        "desc": row["desc"]
-    })
+inserted, updated = import_categories(db, docs, update=update, model=model)
 
-if len(docs):
-    res = db.product_categories.insert_many(docs)
-    insertCount = len(res.inserted_ids)
+model.close()
 
-    print(f'{insertCount} documents inserted')
-else:
-    print('No documents to insert')
+print(f'''{inserted} documents inserted
+{updated} documents updated
+{len(docs) - inserted - updated} documents unchanged''')
 
-model.con.close()
+manifest.update(file, VERSION)
+manifest.save()
@@ -0,0 +1,27 @@
+from pathlib import Path
+from Model import Model, INDEXES
+from sys import argv
+
+##
+# Create the indexes defined in Model.INDEXES
+#
+# Import scripts already do this on every run. Use --dry-run to list
+# indexes missing from the database without creating them.
+#
+# py addIndexes.py [--dry-run] [--db fusionx]
+##
+
+DIR = Path(__file__).parent
+ENV_PATH = DIR.parent / '..' / 'src' / '.env'
+
+db_name = argv[argv.index('--db') + 1] if '--db' in argv else 'fusionx'
+
+model = Model(ENV_PATH)
+model.connect(dbName=db_name)
+
+actions = model.ensure_indexes(dry_run='--dry-run' in argv)
+
+if not actions:
+    print(f'All {sum(len(v) for v in INDEXES.values())} indexes exist')
+
+model.close()
@@ -1,34 +1,180 @@
-from Model import Model
+from argparse import ArgumentParser
+from csv import reader
+from functools import partial
+from itertools import islice
 from pathlib import Path
+from threading import Lock
+from time import perf_counter
+from pymongo import UpdateOne
+from Model import Model
+from Ingest import IngestEngine
 
 ##
 # Bulk upload all pincodes to Mongodb database
+#
+# The CSV is streamed in fixed size chunks and each chunk is upserted
+# on Pincode, so re-running the script only writes pincodes that are new
+# or changed. If a pincode repeats in the file, the last row wins: repeats
+# within a chunk are dropped before writing, and a chunk repeating a pincode
+# of a chunk still being written waits for it, so chunks that share
+# pincodes are written in file order.
+#
+# Chunks are written by --workers concurrent writers while the next chunk
+# is read. Install motor to write with the asyncio driver.
+#
+# py addPincode.py [--file pincode.csv] [--chunk-size 5000] [--workers 1]
 ##
 
 DIR = Path(__file__).parent
 ENV_PATH = DIR.parent / '..' / 'src' / '.env'
 CSV_PATH = DIR / 'pincode.csv'
 
-model = Model(ENV_PATH)
-db = model.connect()
-docs = []
 
-with CSV_PATH.open() as f:
-    f.readline()
+def read_chunks(path: Path, size: int):
+    '''Yields lists of upto size pincode documents from the CSV file.
+    A pincode repeated within a chunk is only read from its last row
+    '''
+
+    with path.open(newline='') as f:
+        rows = reader(f)
+
+        # skip header
+        next(rows, None)
+
+        # skip blank lines
+        rows = filter(None, rows)
+
+        while chunk := list(islice(rows, size)):
+            docs = {}
+
+            for row in chunk:
+                docs[row[0]] = {
+                    'Pincode': row[0],
+                    'District': row[1],
+                    'State': row[2]
+                }
+
+            yield list(docs.values())
+
+
+def upserts(docs: list):
+    'Returns upserts keyed on Pincode for a chunk of pincodes'
+
+    return [
+        UpdateOne({'Pincode': doc['Pincode']}, {'$set': doc}, upsert=True)
+        for doc in docs
+    ]
+
+
+class Progress:
+    '''Tracks and prints rows written and rows/sec, and the pincodes
+    of chunks still being written
+    '''
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.rows = self.upserted = self.modified = 0
+
+        # updated by the engine's writers, see update
+        self.pending = set()
+        self.lock = Lock()
+
+    def is_pending(self, pincodes: list):
+        'Returns True if any of the pincodes is in a chunk being written'
+
+        with self.lock:
+            return not self.pending.isdisjoint(pincodes)
+
+    def submitted(self, pincodes: list):
+        with self.lock:
+            self.pending.update(pincodes)
+
+    def update(self, pincodes: list, res, error=None):
+        'Count a written chunk, called by the IngestEngine'
+
+        with self.lock:
+            self.pending.difference_update(pincodes)
+
+        if error is not None:
+            raise error
+
+        self.rows += len(pincodes)
+        self.upserted += res.upserted_count
+        self.modified += res.modified_count
+
+        print(f'{self.rows} rows {self.rate():.0f} rows/sec')
+
+    def rate(self):
+        elapsed = perf_counter() - self.start
+        return self.rows / elapsed if elapsed else 0
+
+    def report(self):
+        print(f'''Done. {self.rows} rows in {perf_counter() - self.start:.2f}s
+Inserted: {self.upserted}
+Updated: {self.modified}
+Unchanged: {self.rows - self.upserted - self.modified}''')
+
+
+def load(db, path: Path, chunk_size=5000, workers=1, model=None):
+    '''Stream the CSV into the pincodes collection.
+    Chunks are written by workers concurrent writers, with atmost
+    2 chunks per worker queued. Pass the model to write with motor.
+    '''
+
+    progress = Progress()
+
+    with IngestEngine(db, writers=workers, model=model) as engine:
+        for docs in read_chunks(path, chunk_size):
+            pincodes = [doc['Pincode'] for doc in docs]
+
+            # the last row of a repeated pincode must be written last
+            if progress.is_pending(pincodes):
+                engine.drain()
+
+            progress.submitted(pincodes)
+
+            engine.submit('pincodes',
+                          'bulk_write',
+                          upserts(docs),
+                          ordered=False,
+                          done=partial(progress.update, pincodes))
+
+    return progress
+
+
+def main():
+    parser = ArgumentParser(description='Upload pincodes to the database')
+
+    parser.add_argument('--file',
+                        type=Path,
+                        default=CSV_PATH,
+                        help='CSV file with pincode, district, state columns')
+
+    parser.add_argument('--chunk-size',
+                        type=int,
+                        default=5000,
+                        help='Rows per bulk write')
+
+    parser.add_argument('--workers',
+                        type=int,
+                        default=1,
+                        help='Number of chunks written concurrently')
 
-    print("Collating...")
-    while line := f.readline().strip('\n'):
+    args = parser.parse_args()
 
-        pincode, region, state = line.split(',')
+    if not args.file.exists():
+        exit('File does not exist')
 
-        docs.append({'Pincode': pincode, 'District': region, 'State': state})
+    model = Model(ENV_PATH)
+    db = model.connect()
+    model.ensure_indexes()
 
-print(f'Inserting {len(docs)} pincodes')
+    progress = load(db, args.file, args.chunk_size, args.workers, model)
 
-res = db.pincodes.insert_many(docs)
+    model.close()
 
-inserted_count = len(res.inserted_ids)
+    progress.report()
 
-model.con.close()
 
-print(f'Done. Inserted {inserted_count} pincodes')
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,13 @@
+from argparse import ArgumentParser
+from contextlib import nullcontext
+from json import dumps
+from multiprocessing import cpu_count
 from pathlib import Path
 from Model import Model
+from Checkpoint import ImportRun, rollback
+from Images import ImageDerivatives
+from Manifest import Manifest
+from Instrument import Stats, profile, watch_commands
 from Templates import FoamRoller, Clothes, ExerciseBands
 
 ##
@@ -9,6 +17,42 @@ from Templates import FoamRoller, Clothes, ExerciseBands
 # that implements the BaseTemplate class.
 #
 # See example at the end to generate a new template file.
+#
+# py addProducts.py [--sync] [--retire] [--groups] [--force] [--atomic]
+#                   [--columnar]
+#                   [--writers 1] [--stats stats.json] [--profile out.prof]
+#                   [--mmap] [--workers 1] [--compress-info BYTES]
+#                   [--images DIR] [--image-out DIR]
+#                   [--checkpoint] [--resume] [--rollback RUN_ID]
+#
+# --sync updates existing products to match the files, writing only changes
+# --retire with --sync, retires variants no longer in the files
+# --groups with --sync, skips product groups unchanged since the last sync
+# --force processes files even if unchanged since the last import
+# --atomic stages each file's documents and merges them into the live
+#   collections only if the whole file is valid. Documents are written
+#   twice, so it is off by default
+# --columnar validates each file with NumPy first, reporting every error
+# --writers sets the number of batches written concurrently
+# --stats writes per stage timings and MongoDB command counts as JSON
+# --profile profiles the import, with pyinstrument if the path ends in .html
+#   else with cProfile
+# --mmap reads files through a memory map, decoding only template columns
+# --workers compiles shards of each file in parallel processes, without --sync
+# --compress-info stores descriptions of atleast BYTES zlib compressed
+# --images generates WebP thumbnail, list and zoom sizes of images found in
+#   DIR, written to --image-out (default tsv/derivatives). Requires Pillow
+# --checkpoint writes documents tagged with an import run id, saving the
+#   last written product group after each batch, see Checkpoint.py
+# --resume continues the last failed or interrupted run of each file from
+#   its checkpoint, or starts a checkpointed run. Fails if the file changed
+# --rollback deletes the documents written by an import run and exits
+#
+# Without --atomic, --checkpoint or --sync, documents are tagged with an
+# import run that is rolled back if the file fails partway.
+#
+# Files imported without write errors are recorded in tsv/.manifest.json,
+# so a failed import is retried on the next run
 ##
 
 DIR = Path(__file__).parent
@@ -17,17 +61,193 @@ ENV_PATH = DIR.parent / '..' / 'src' / '.env'
 FOAMROLLER_PATH = DIR / 'tsv' / 'foam-roller.tsv'
 CLOTHES_PATH = DIR / 'tsv' / 'clothes.tsv'
 EXERCISEBANDS_PATH = DIR / 'tsv' / 'exercise-bands.tsv'
+MANIFEST_PATH = DIR / 'tsv' / '.manifest.json'
+DERIVATIVES_PATH = DIR / 'tsv' / 'derivatives'
+
+parser = ArgumentParser(description='Add products to the database')
+
+parser.add_argument('--sync',
+                    action='store_true',
+                    help='Update existing products, writing only changes')
+
+parser.add_argument('--retire',
+                    action='store_true',
+                    help='With --sync, retire variants missing from the file')
+
+parser.add_argument('--groups',
+                    action='store_true',
+                    help='With --sync, skip product groups unchanged '
+                    'since the last sync')
+
+parser.add_argument('--force',
+                    action='store_true',
+                    help='Process files even if unchanged since last import')
+
+parser.add_argument('--atomic',
+                    action='store_true',
+                    help='Write a file only if all of it is valid')
+
+parser.add_argument('--columnar',
+                    action='store_true',
+                    help='Report every error in a file (requires numpy)')
+
+parser.add_argument('--writers',
+                    type=int,
+                    default=1,
+                    help='Number of batches written concurrently')
+
+parser.add_argument('--stats',
+                    type=Path,
+                    help='Write per stage timings for each file as JSON')
+
+parser.add_argument('--profile',
+                    type=Path,
+                    help='Write a profile, .html for pyinstrument '
+                    'else cProfile')
+
+parser.add_argument('--mmap',
+                    action='store_true',
+                    help='Read files through a memory map')
+
+parser.add_argument('--workers',
+                    type=int,
+                    default=1,
+                    help='Number of processes compiling shards of a file')
+
+parser.add_argument('--compress-info',
+                    type=int,
+                    metavar='BYTES',
+                    help='Store descriptions of atleast BYTES '
+                    'zlib compressed')
+
+parser.add_argument('--images',
+                    type=Path,
+                    metavar='DIR',
+                    help='Generate resized WebP images from images in DIR')
+
+parser.add_argument('--image-out',
+                    type=Path,
+                    default=DERIVATIVES_PATH,
+                    metavar='DIR',
+                    help='Folder to write resized images to')
+
+parser.add_argument('--checkpoint',
+                    action='store_true',
+                    help='Save progress after each batch, without --sync')
+
+parser.add_argument('--resume',
+                    action='store_true',
+                    help='Resume the last failed run of each file')
+
+parser.add_argument('--rollback',
+                    metavar='RUN_ID',
+                    help='Delete the documents written by an import run')
+
+args = parser.parse_args()
+
+if (args.checkpoint or args.resume) and args.sync:
+    parser.error('--checkpoint and --resume cannot be used with --sync')
+
+# listeners are only added to clients created after this
+if args.stats:
+    watch_commands()
 
 db = Model(ENV_PATH)
+manifest = Manifest(MANIFEST_PATH)
+
+database = db.connect()
+db.ensure_indexes()
+
+if args.rollback:
+    deleted = rollback(database, args.rollback)
+
+    for name, count in deleted.items():
+        print(f'{name}: {count} deleted')
+
+    db.close()
+    exit()
+
+reports = []
+
+images = None
+
+if args.images:
+    images = ImageDerivatives(args.images, args.image_out, workers=cpu_count())
+
+profiler = nullcontext()
+
+if args.profile:
+    profiler = profile(
+        'pyinstrument' if args.profile.suffix == '.html' else 'cprofile',
+        args.profile)
+
+with profiler:
+    for Template, path in ((FoamRoller, FOAMROLLER_PATH),
+                           (Clothes, CLOTHES_PATH),
+                           (ExerciseBands, EXERCISEBANDS_PATH)):
+        version = Template.manifest_version()
+
+        checkpoint = None
+
+        if args.resume:
+            checkpoint = ImportRun.resumable(database, path, version)
+
+        if checkpoint is None and not args.force and manifest.is_unchanged(
+                path, version):
+            print(path.name, 'Unchanged. Skipping')
+            continue
+
+        if checkpoint is None and (args.checkpoint or args.resume):
+            checkpoint = ImportRun.start(database, path, version)
+
+        # a file written directly is rolled back if it fails partway
+        import_run = None
+
+        if checkpoint is None and not (args.sync or args.atomic):
+            import_run = ImportRun.start(database, path, version)
+
+        group_hashes = None
+        validator = 'columnar' if args.columnar else 'stream'
+
+        stats = Stats(path.name) if args.stats else None
+
+        written = False
+
+        with Template(path,
+                      db,
+                      atomic=args.atomic,
+                      validator=validator,
+                      writers=args.writers,
+                      stats=stats,
+                      mmap=args.mmap,
+                      workers=args.workers,
+                      compress_info=args.compress_info,
+                      images=images) as tmp:
+            if args.sync:
+                written = tmp.sync(
+                    retire=args.retire,
+                    group_hashes=manifest.groups(path, version)
+                    if args.groups else None)
+
+                group_hashes = tmp.group_hashes
+            else:
+                written = tmp.run(checkpoint, import_run)
+
+        if stats:
+            reports.append(stats.report())
+
+        # a failed import is retried on the next run
+        if not written:
+            print(path.name, 'Not recorded in the manifest')
+            continue
 
-with FoamRoller(FOAMROLLER_PATH, db) as tmp:
-    tmp.run()
+        manifest.update(path, version, group_hashes)
+        manifest.save()
 
-with Clothes(CLOTHES_PATH, db) as tmp:
-    tmp.run()
+db.close()
 
-with ExerciseBands(EXERCISEBANDS_PATH, db) as tmp:
-    tmp.run()
+if args.stats:
+    args.stats.write_text(dumps(reports, indent=2))
 
 ##
 # To generate a file see commented example below
@@ -1,14 +1,60 @@
+from argparse import ArgumentParser
 from Model import Model
 from pathlib import Path
 from DataBuilder.Posts import Posts
 from DataBuilder.Products import Products
+from DataBuilder.Generator import generate
+
+##
+# Add test data to the fusionx_test database
+#
+# Without arguments, adds 60 products, 20 posts and a test user for the
+# Cypress tests. Pass --products and/or --posts to generate a large
+# catalogue for load testing instead, for example:
+#
+# py addTestData.py --products 1_000_000 --variants-per-product 5 --workers 8
+##
 
 DIR = Path(__file__).parent
 ENV_PATH = (DIR / '../../src/.env').resolve()
 
+parser = ArgumentParser(description='Add test data to the database')
+
+parser.add_argument('--products', type=int, default=0)
+parser.add_argument('--variants-per-product', type=int, default=3)
+parser.add_argument('--posts', type=int, default=0)
+
+parser.add_argument('--seed',
+                    type=int,
+                    default=0,
+                    help='Same seed generates the same documents')
+
+parser.add_argument('--workers', type=int, default=1)
+parser.add_argument('--chunk-size', type=int, default=1000)
+parser.add_argument('--db', default='fusionx_test')
+
+args = parser.parse_args()
+
 # connect the db
 model = Model(env_path=ENV_PATH)
+
+if args.products or args.posts:
+    model.connect(dbName=args.db)
+    model.ensure_indexes()
+    model.close()
+
+    generate(ENV_PATH,
+             args.db,
+             products=args.products,
+             variants_per_product=args.variants_per_product,
+             posts=args.posts,
+             seed=args.seed,
+             workers=args.workers,
+             chunk_size=args.chunk_size)
+
+    exit()
 db = model.connect(dbName="fusionx_test")
+model.ensure_indexes()
 
 # Initialise Posts class
 posts = Posts()
@@ -48,4 +94,4 @@ db.users.insert_one({
     "hash": "$2b$10$zzULnU02hvJt1IcDKxDbFu/9AjGufGGekMCXUO4QADJ8YXmlR7rXa"
 })
 
-model.con.close()
+model.close()
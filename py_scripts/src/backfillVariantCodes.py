@@ -0,0 +1,142 @@
+from argparse import ArgumentParser
+from pathlib import Path
+from pymongo import UpdateOne
+from Model import Model
+from CodeAllocator import CodeAllocator
+
+##
+# Set category_code and product_code on existing product_variants
+#
+# Variants imported before these fields were added only have the sku,
+# product code + 3 digit child number. The product code is the category
+# code + CodeAllocator.length characters, variants whose category code is
+# not in product_categories are counted and left without one.
+#
+# Variants are read in _id order in batches and updated with one
+# bulk_write per batch. The last _id written is checkpointed in the
+# migrations collection, so an interrupted run resumes where it stopped.
+# Pass --restart to start over.
+#
+# The category_code and product_code indexes in Model.INDEXES are built
+# once every variant is updated.
+#
+# py backfillVariantCodes.py [--batch-size 1000] [--restart]
+##
+
+DIR = Path(__file__).parent
+ENV_PATH = DIR.parent / '..' / 'src' / '.env'
+
+# _id of the checkpoint document in the migrations collection
+MIGRATION = 'variant_codes'
+
+
+def category_of(product_code: str, codes: set):
+    'Returns the category code of a product code or None if unknown'
+
+    code = product_code[:-CodeAllocator.length]
+
+    return code if code in codes else None
+
+
+def backfill(db, batch_size=1000, restart=False):
+    '''Update variants in batches, from the last checkpoint.
+    Returns the checkpoint document
+    '''
+
+    if restart:
+        db.migrations.delete_one({'_id': MIGRATION})
+
+    state = db.migrations.find_one({'_id': MIGRATION}) or {
+        '_id': MIGRATION,
+        'last_id': None,
+        'updated': 0,
+        'unknown': 0,
+        'done': False
+    }
+
+    if state['done']:
+        return state
+
+    codes = set(db.product_categories.distinct('code'))
+
+    while True:
+        query = {}
+
+        if state['last_id'] is not None:
+            query['_id'] = {'$gt': state['last_id']}
+
+        batch = list(
+            db.product_variants.find(query,
+                                     projection={
+                                         'sku': 1,
+                                         'category_code': 1,
+                                         'product_code': 1
+                                     }).sort('_id', 1).limit(batch_size))
+
+        if not batch:
+            break
+
+        ops = []
+
+        for doc in batch:
+            fields = {'product_code': doc['sku'][:-3]}
+            category = category_of(fields['product_code'], codes)
+
+            if category is None:
+                state['unknown'] += 1
+            else:
+                fields['category_code'] = category
+
+            if all(doc.get(k) == v for k, v in fields.items()):
+                continue
+
+            ops.append(UpdateOne({'_id': doc['_id']}, {'$set': fields}))
+
+        if ops:
+            db.product_variants.bulk_write(ops, ordered=False)
+
+        state['last_id'] = batch[-1]['_id']
+        state['updated'] += len(ops)
+
+        db.migrations.replace_one({'_id': MIGRATION}, state, upsert=True)
+
+        print(f"{state['updated']} variants updated", end='\r')
+
+    state['done'] = True
+    db.migrations.replace_one({'_id': MIGRATION}, state, upsert=True)
+
+    return state
+
+
+def main():
+    parser = ArgumentParser(
+        description='Set category_code and product_code on variants')
+
+    parser.add_argument('--batch-size',
+                        type=int,
+                        default=1000,
+                        help='Number of variants updated per bulk_write')
+
+    parser.add_argument('--restart',
+                        action='store_true',
+                        help='Ignore the checkpoint and start over')
+
+    args = parser.parse_args()
+
+    model = Model(ENV_PATH)
+    db = model.connect()
+
+    state = backfill(db, batch_size=args.batch_size, restart=args.restart)
+
+    print(f"{state['updated']} variants updated")
+
+    if state['unknown']:
+        print(f"{state['unknown']} variants without a matching category "
+              'code in product_categories')
+
+    model.ensure_indexes()
+    model.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+from pathlib import Path
+from time import perf_counter
+from Model import Model
+from Facets import rebuild
+from sys import argv
+
+##
+# Rebuild the facet_counts collection used by the shop filters
+#
+# Import scripts update the counts as products are added or synced.
+# Run this after stock changes outside the import scripts, for example
+# sales through the storefront, or if the counts have drifted.
+#
+# Pass category codes to rebuild only those categories,
+# else every category in product_categories is rebuilt.
+#
+# py buildFacets.py [category code ...]
+##
+
+DIR = Path(__file__).parent
+ENV_PATH = DIR.parent / '..' / 'src' / '.env'
+
+model = Model(ENV_PATH)
+db = model.connect()
+model.ensure_indexes()
+
+categories = argv[1:] or None
+
+start = perf_counter()
+count = rebuild(db, categories)
+
+print(f'{count} facet values written in {perf_counter() - start:.2f}s')
+
+model.close()
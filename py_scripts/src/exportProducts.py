@@ -0,0 +1,69 @@
+from argparse import ArgumentParser
+from pathlib import Path
+from time import perf_counter
+from Model import Model
+from Export import CatalogueExport
+from Templates import TEMPLATES
+
+##
+# Export products in the database to template TSV files for bulk editing
+#
+# Each registered template (see tsv_name in Templates.py) is written to
+# <dir>/<tsv_name>.tsv in the template's column order, one MAIN row per
+# product followed by its SUB rows. Only variants whose type columns match
+# the template are written, retired variants are left out.
+#
+# Products, variants and descriptions are streamed and joined in sorted
+# order, see Export.py, so memory use does not grow with the catalogue.
+#
+# To edit and import the changes, copy the file over the template file in
+# tsv and run addProducts.py --sync
+#
+# py exportProducts.py [--dir tsv/export] [--template clothes ...]
+#                      [--category camxts ...]
+##
+
+DIR = Path(__file__).parent
+ENV_PATH = DIR.parent / '..' / 'src' / '.env'
+
+
+def main():
+    parser = ArgumentParser(
+        description='Export products to template TSV files')
+
+    parser.add_argument('--dir',
+                        type=Path,
+                        default=DIR / 'tsv' / 'export',
+                        help='Folder to write the files to')
+
+    parser.add_argument('--template',
+                        nargs='+',
+                        choices=sorted(TEMPLATES),
+                        help='Templates to export, default all')
+
+    parser.add_argument('--category',
+                        nargs='+',
+                        help='Category codes to export, default all')
+
+    args = parser.parse_args()
+
+    model = Model(ENV_PATH)
+    db = model.connect()
+
+    args.dir.mkdir(parents=True, exist_ok=True)
+
+    for name in args.template or sorted(TEMPLATES):
+        start = perf_counter()
+        file = args.dir / f'{name}.tsv'
+
+        export = CatalogueExport(TEMPLATES[name], db, args.category)
+        export.write(file)
+
+        print(file.name, f'{perf_counter() - start:.2f}s')
+        export.report()
+
+    model.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+from argparse import ArgumentParser
+from functools import partial
+from multiprocessing import Pool, cpu_count
+from pathlib import Path
+from Model import Model
+from Blog import EXTENSIONS, PostWriter, convert
+
+##
+# Import a folder of Markdown or HTML blog posts with front matter
+#
+# ---
+# title: Post title
+# description: Shown in the blog list
+# author: Jane Doe
+# tags: [TagA, TagB]
+# date: 2023-06-01
+# ---
+# Post body
+#
+# See Blog.convert for every front matter key. Markdown files require
+# the markdown package, PyYAML is used for front matter if installed.
+#
+# Files are converted in worker processes and written in batches,
+# post_body then posts. Posts whose href exists in the database or was
+# used by an earlier file are skipped.
+#
+# By default nothing is written unless every file converts and writes.
+# Pass --no-atomic to write the valid posts and report the rest.
+#
+# The storefront caches the blog list for upto 2 hours.
+#
+# py importPosts.py <dir> [--workers 4] [--batch-size 500] [--no-atomic]
+#                   [--author 'Jane Doe']
+##
+
+DIR = Path(__file__).parent
+ENV_PATH = DIR.parent / '..' / 'src' / '.env'
+
+# Files sent to a worker at a time
+FILES_PER_TASK = 16
+
+
+def convert_file(file: Path, author=None):
+    '''Runs in a worker process.
+    Returns (file name, (post_body, post), None) or (file name, None, error)
+    '''
+
+    try:
+        return file.name, convert(file, author), None
+    except Exception as e:
+        return file.name, None, f'{type(e).__name__}: {e}'
+
+
+def main():
+    parser = ArgumentParser(description='Import blog posts from a folder')
+
+    parser.add_argument('dir', type=Path, help='Folder of post files')
+
+    parser.add_argument('--workers',
+                        type=int,
+                        default=cpu_count(),
+                        help='Number of processes converting files')
+
+    parser.add_argument('--batch-size',
+                        type=int,
+                        default=500,
+                        help='Number of documents per insert_many')
+
+    parser.add_argument('--no-atomic',
+                        action='store_true',
+                        help='Write valid posts even if some files fail')
+
+    parser.add_argument('--author',
+                        help='Author of posts without one in front matter')
+
+    args = parser.parse_args()
+
+    files = sorted(f for f in args.dir.iterdir()
+                   if f.suffix.lower() in EXTENSIONS)
+
+    if not files:
+        exit(f'No post files in {args.dir}')
+
+    model = Model(ENV_PATH)
+    db = model.connect()
+    model.ensure_indexes()
+
+    # hrefs in use, the unique posts.href index catches concurrent imports
+    hrefs = set(db.posts.distinct('href'))
+
+    errors = []
+    skipped = 0
+
+    writer = PostWriter(db,
+                        batch_size=args.batch_size,
+                        staging=not args.no_atomic)
+
+    with Pool(min(args.workers, len(files))) as pool, writer:
+        results = pool.imap(partial(convert_file, author=args.author),
+                            files,
+                            chunksize=FILES_PER_TASK)
+
+        for name, docs, error in results:
+            if error is not None:
+                errors.append((name, error))
+
+                if writer.staging:
+                    writer.abort()
+
+                continue
+
+            post_body, post = docs
+
+            if post['href'] in hrefs:
+                print(f"{name}: {post['href']} exists. Skipping")
+                skipped += 1
+                continue
+
+            hrefs.add(post['href'])
+
+            writer.add('post_body', post_body, name)
+            writer.add('posts', post, name)
+
+    model.close()
+
+    writer.report()
+
+    for name, error in errors:
+        print(f'{name}: {error}')
+
+    print(f'{len(files)} files, {skipped} skipped, {len(errors)} failed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,367 @@
+from argparse import ArgumentParser
+from os import getpid
+from multiprocessing import Pool, Queue, active_children, cpu_count
+from pathlib import Path
+from queue import Empty
+from time import perf_counter
+from Model import Model
+from Checkpoint import DONE, ImportRun, rollback
+from CodeAllocator import CodeAllocator
+from Facets import FacetCounts
+from Manifest import Manifest
+from Templates import BaseTemplate, get_template
+from Writer import BulkWriter
+
+##
+# Import every template TSV file in a folder in parallel
+#
+# Each file is matched to its template class by file name
+# (see tsv_name in Templates.py). Files are validated and compiled in
+# worker processes and the compiled products are written to the database
+# by a single shared writer in this process.
+#
+# Workers only ensure product codes are unique within a file. Codes are
+# checked against the database and other files in this process and
+# replaced on collision.
+#
+# Files unchanged since their last import, as recorded in the folder's
+# .manifest.json, are skipped unless --force is passed.
+#
+# Without --atomic, the documents of each file are tagged with an import
+# run, see Checkpoint.py. A file that fails partway is rolled back, so
+# importing it again does not add its first groups twice.
+#
+# py importProducts.py [--dir tsv] [--workers 4] [--batch-size 1000]
+#                      [--atomic] [--reserve-codes] [--force]
+#                      [--columnar] [--writers 1] [--mmap]
+#                      [--compress-info BYTES]
+##
+
+DIR = Path(__file__).parent
+ENV_PATH = DIR.parent / '..' / 'src' / '.env'
+
+# Number of compiled product groups sent by a worker in one message
+GROUPS_PER_MESSAGE = 100
+
+# Seconds to wait for a worker message before checking the workers
+POLL_SECONDS = 5
+
+# Worker process globals, set by init_worker
+queue = None
+category_codes = None
+template_options = None
+
+
+def init_worker(q, cat_codes, options):
+    global queue, category_codes, template_options
+
+    queue = q
+    category_codes = cat_codes
+    template_options = options
+
+
+def compile_file(file: Path):
+    '''Runs in a worker process.
+    Validates and compiles the file, sending the compiled product groups
+    to the main process in chunks. Starts with a 'started' message with
+    the worker's process id and always ends with a 'done' or 'error'
+    message for the file.
+    '''
+
+    start = perf_counter()
+    groups = []
+
+    queue.put(('started', file.name, getpid()))
+
+    try:
+        tmp = get_template(file)(file, None, **template_options)
+
+        for group in tmp.compile(category_codes):
+            groups.append(group)
+
+            if len(groups) == GROUPS_PER_MESSAGE:
+                queue.put(('groups', file.name, groups))
+                groups = []
+
+        if groups:
+            queue.put(('groups', file.name, groups))
+
+        queue.put(('done', file.name, perf_counter() - start))
+    except Exception as e:
+        queue.put(('error', file.name, f'{type(e).__name__}: {e}'))
+
+
+def lost_files(summary: dict, result, finished: bool, workers: set):
+    '''Returns error messages for the files that will not get a done or
+    error message, once no message arrived for POLL_SECONDS.
+
+    If every task returned, that is every file not done. Else the files
+    being compiled by a worker that exited. The pool replaces the worker
+    but not its task, so if a worker exited and no file is being
+    compiled, the files not started were lost with it.
+
+    workers: Process ids of the pool workers seen so far
+    '''
+
+    if finished:
+        error = worker_error(result)
+
+        return [('error', name, error) for name, stats in summary.items()
+                if stats['status'] in ('Pending', 'Running')]
+
+    alive = {process.pid for process in active_children()}
+    error = 'Worker exited while compiling the file'
+
+    running = [(name, stats['pid'] in alive)
+               for name, stats in summary.items()
+               if stats['status'] == 'Running']
+
+    lost = [('error', name, error) for name, live in running if not live]
+
+    if not any(live for _, live in running) and not workers <= alive:
+        lost += [('error', name, error) for name, stats in summary.items()
+                 if stats['status'] == 'Pending']
+
+    return lost
+
+
+def worker_error(result):
+    'Returns the error of workers that returned without a done message'
+
+    try:
+        result.get(0)
+    except Exception as e:
+        return f'{type(e).__name__}: {e}'
+
+    return 'Worker returned without a result'
+
+
+def print_summary(summary: dict):
+    print(f"\n{'File':<30}{'Status':<10}{'Products':>10}{'Variants':>10}"
+          f"{'Secs':>8}")
+
+    for name, stats in summary.items():
+        print(f"{name:<30}{stats['status']:<10}{stats['products']:>10}"
+              f"{stats['variants']:>10}{stats['time']:>8.2f}")
+
+        if stats['error']:
+            print(f"  {stats['error']}")
+
+
+def main():
+    parser = ArgumentParser(description='Import template TSV files')
+
+    parser.add_argument('--dir',
+                        type=Path,
+                        default=DIR / 'tsv',
+                        help='Folder containing TSV files')
+
+    parser.add_argument('--workers',
+                        type=int,
+                        default=cpu_count(),
+                        help='Number of worker processes')
+
+    parser.add_argument('--batch-size',
+                        type=int,
+                        default=1000,
+                        help='Documents per insert_many')
+
+    parser.add_argument('--atomic',
+                        action='store_true',
+                        help='Stage documents and write them only if '
+                        'every file is valid, instead of as files are '
+                        'compiled')
+
+    parser.add_argument('--reserve-codes',
+                        action='store_true',
+                        help='Reserve product codes in the database, '
+                        'for concurrent imports')
+
+    parser.add_argument('--force',
+                        action='store_true',
+                        help='Import files even if unchanged since '
+                        'the last import')
+
+    parser.add_argument('--columnar',
+                        action='store_true',
+                        help='Validate each file with NumPy first and '
+                        'report every error (requires numpy)')
+
+    parser.add_argument('--writers',
+                        type=int,
+                        default=1,
+                        help='Number of batches written concurrently')
+
+    parser.add_argument('--mmap',
+                        action='store_true',
+                        help='Read files through a memory map, decoding '
+                        'only template columns')
+
+    parser.add_argument('--compress-info',
+                        type=int,
+                        metavar='BYTES',
+                        help='Store descriptions of atleast BYTES '
+                        'zlib compressed')
+
+    args = parser.parse_args()
+
+    files = []
+    summary = {}
+    manifest = Manifest(args.dir / '.manifest.json')
+
+    for file in sorted(args.dir.glob('*.tsv')):
+        Template = get_template(file)
+
+        if Template is None:
+            print(f'{file.name}: No template registered. Skipping')
+            continue
+
+        if not args.force and manifest.is_unchanged(
+                file, Template.manifest_version()):
+            print(f'{file.name}: Unchanged. Skipping')
+            continue
+
+        files.append(file)
+        summary[file.name] = {
+            'status': 'Pending',
+            'products': 0,
+            'variants': 0,
+            'time': 0,
+            'error': None,
+            'pid': None
+        }
+
+    if not files:
+        exit(f'No new or changed template files in {args.dir}')
+
+    model = Model(ENV_PATH)
+    db = model.connect()
+    model.ensure_indexes()
+
+    cat_codes = model.getProductCategoryCodes()
+
+    allocator = CodeAllocator(db, reserve=args.reserve_codes)
+
+    # bounded queue, so workers pause if the writer falls behind
+    q = Queue(maxsize=args.workers * 4)
+
+    writer = BulkWriter(db,
+                        batch_size=args.batch_size,
+                        staging=args.atomic,
+                        writers=args.writers,
+                        model=model)
+
+    # each file's counts are committed only if the file is done
+    facets = {file.name: FacetCounts() for file in files}
+
+    # import run of each file, when writing without staging
+    runs = {}
+
+    if not writer.staging:
+        for file in files:
+            runs[file.name] = ImportRun.start(
+                db, file,
+                get_template(file).manifest_version())
+
+    pending = len(files)
+
+    with Pool(min(args.workers, len(files)),
+              initializer=init_worker,
+              initargs=(q, cat_codes, {
+                  'validator': 'columnar' if args.columnar else 'stream',
+                  'mmap': args.mmap,
+                  'compress_info': args.compress_info
+              })) as pool:
+
+        result = pool.map_async(compile_file, files)
+        workers = {process.pid for process in active_children()}
+
+        with writer:
+            while pending:
+                # checked before waiting, so messages sent as the last
+                # worker returned are still read
+                finished = result.ready()
+
+                try:
+                    messages = [q.get(timeout=POLL_SECONDS)]
+                except Empty:
+                    messages = lost_files(summary, result, finished,
+                                          workers)
+
+                for kind, name, payload in messages:
+                    stats = summary[name]
+
+                    if kind == 'started':
+                        stats['status'] = 'Running'
+                        stats['pid'] = payload
+                        workers.add(payload)
+                        continue
+
+                    if kind == 'groups':
+                        for row, product, variants in payload:
+                            code = product['product_code']
+
+                            # code exists or was used by another file
+                            if not allocator.claim(code):
+                                prefix = code[:-CodeAllocator.length]
+
+                                BaseTemplate.rekey(
+                                    product, variants,
+                                    allocator.allocate(prefix))
+
+                            if runs:
+                                BaseTemplate.tag(runs[name], product,
+                                                 variants)
+
+                            writer.add_group(row, product, variants)
+                            facets[name].add_group(product, variants)
+
+                            stats['products'] += 1
+                            stats['variants'] += len(variants)
+                        continue
+
+                    pending -= 1
+
+                    if kind == 'done':
+                        stats['status'] = 'Done'
+                        stats['time'] = payload
+                    else:
+                        stats['status'] = 'Failed'
+                        stats['error'] = payload
+
+                        if writer.staging:
+                            # discard staged documents from every file
+                            writer.abort()
+                        else:
+                            # delete the groups already written, once
+                            # they are out of the buffers
+                            writer.wait()
+                            rollback(db, runs[name].id,
+                                     rebuild_facets=False)
+
+    for name, stats in summary.items():
+        if stats['status'] != 'Done':
+            continue
+
+        facets[name].commit(db, writer)
+
+        if runs:
+            runs[name].finish(DONE)
+
+    model.close()
+
+    writer.report()
+    print_summary(summary)
+
+    if not writer.committed:
+        return
+
+    for file in files:
+        if summary[file.name]['status'] == 'Done':
+            manifest.update(file, get_template(file).manifest_version())
+
+    manifest.save()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+from argparse import ArgumentParser
+from json import dumps, loads
+from pathlib import Path
+from Benchmark import CASES, Datasets, compare, parse_size, run
+
+##
+# Benchmark the Python ingest path
+#
+# Generates template, pincode and category files of each size in
+# bench/data and times each case in a fresh process, reporting rows/sec,
+# peak RSS and round trips to the database.
+#
+# By default the database is an in-process mongomock, measuring CPU only.
+# Pass --mongo to use the server in .env. The fusionx_bench database is
+# dropped before and after every case.
+#
+# Results are written to --output. With --baseline, results are compared
+# to a previous output and the script exits with status 1 if rows/sec
+# dropped or peak RSS grew by more than --threshold. Baselines are only
+# comparable on the same machine and backend.
+#
+# py runBenchmark.py [--sizes 1k,100k,1M] [--cases template-run,pincodes]
+#                    [--mongo] [--writers 1] [--batch-size 1000]
+#                    [--output bench/results.json]
+#                    [--baseline bench/baseline.json] [--threshold 0.2]
+#                    [--save-baseline]
+##
+
+DIR = Path(__file__).parent
+ENV_PATH = DIR.parent / '..' / 'src' / '.env'
+BENCH_DIR = DIR / 'bench'
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark the ingest scripts')
+
+    parser.add_argument('--sizes',
+                        help='Comma separated row counts. Default 1k,100k,1M '
+                        'with --mongo else 1k,10k. mongomock upserts slow '
+                        'down with collection size')
+
+    parser.add_argument('--cases',
+                        default=','.join(CASES),
+                        help=f'Comma separated cases from {", ".join(CASES)}')
+
+    parser.add_argument('--mongo',
+                        action='store_true',
+                        help='Use the database server set in .env')
+
+    parser.add_argument('--writers',
+                        type=int,
+                        default=1,
+                        help='Number of batches written concurrently')
+
+    parser.add_argument('--batch-size',
+                        type=int,
+                        default=1000,
+                        help='Documents per write')
+
+    parser.add_argument('--seed',
+                        type=int,
+                        default=0,
+                        help='Seed for generated datasets')
+
+    parser.add_argument('--output',
+                        type=Path,
+                        default=BENCH_DIR / 'results.json',
+                        help='File to write results to')
+
+    parser.add_argument('--baseline',
+                        type=Path,
+                        help='Previous results to compare against')
+
+    parser.add_argument('--threshold',
+                        type=float,
+                        default=0.2,
+                        help='Allowed slowdown or memory growth, 0.2 is 20%%')
+
+    parser.add_argument('--save-baseline',
+                        action='store_true',
+                        help='Also write the results to bench/baseline.json')
+
+    args = parser.parse_args()
+
+    cases = args.cases.split(',')
+
+    for name in cases:
+        if name not in CASES:
+            exit(f'Unknown case {name}. Choose from {", ".join(CASES)}')
+
+    sizes = args.sizes or ('1k,100k,1M' if args.mongo else '1k,10k')
+    sizes = [parse_size(size) for size in sizes.split(',')]
+
+    results = run(cases,
+                  sizes,
+                  Datasets(BENCH_DIR / 'data', args.seed),
+                  env_path=ENV_PATH if args.mongo else None,
+                  batch_size=args.batch_size,
+                  writers=args.writers,
+                  # mongomock does not support $merge
+                  atomic=args.mongo)
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(dumps(results, indent=2))
+
+    print(f'Results written to {args.output}')
+
+    if args.save_baseline:
+        (BENCH_DIR / 'baseline.json').write_text(dumps(results, indent=2))
+
+    if not args.baseline:
+        return
+
+    if not args.baseline.exists():
+        exit(f'{args.baseline} does not exist')
+
+    regressions = compare(results, loads(args.baseline.read_text()),
+                          args.threshold)
+
+    if regressions:
+        print('Regressions:', *regressions, sep='\n')
+        exit(1)
+
+    print('No regressions')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import sys
+from pathlib import Path
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+SRC = Path(__file__).parent.parent / 'src'
+
+# scripts import modules from src by name, as when run from that folder
+sys.path.insert(0, str(SRC))
+
+from Model import MockModel
+from Categories import import_categories, read_categories
+from Facets import rebuild
+from Writer import DUPLICATE_KEY
+
+CLOTHES = SRC / 'tsv' / 'clothes.tsv'
+
+
+@pytest.fixture
+def model():
+    '''Model on an empty mongomock database with the categories in
+    categories.csv and the INDEXES
+    '''
+
+    mongomock = pytest.importorskip('mongomock')
+
+    model = MockModel(mongomock.MongoClient())
+    db = model.connect()
+
+    import_categories(db, read_categories(SRC / 'categories.csv'))
+    model.ensure_indexes()
+
+    return model
+
+
+@pytest.fixture
+def db(model):
+    return model.connect()
+
+
+@pytest.fixture
+def merge(monkeypatch):
+    '''Runs $merge stages on mongomock, which does not implement them,
+    so staged imports can be tested. Only whenMatched 'fail' and
+    'keepExisting' are supported. Documents are inserted one at a time,
+    so a failed merge leaves the documents before it, as on a server
+    '''
+
+    mongomock = pytest.importorskip('mongomock')
+    aggregate = mongomock.Collection.aggregate
+
+    def merging(collection, pipeline, *args, **kwargs):
+        if not pipeline or '$merge' not in pipeline[-1]:
+            return aggregate(collection, pipeline, *args, **kwargs)
+
+        stage = pipeline[-1]['$merge']
+        target = collection.database[stage['into']]
+
+        for doc in aggregate(collection, pipeline[:-1] or [{'$match': {}}]):
+            if target.find_one({'_id': doc['_id']}) is None:
+                target.insert_one(doc)
+            elif stage['whenMatched'] == 'fail':
+                raise DuplicateKeyError(f"E11000 duplicate key {doc['_id']}",
+                                        DUPLICATE_KEY)
+
+        return iter(())
+
+    monkeypatch.setattr(mongomock.Collection, 'aggregate', merging)
+
+
+def read_rows(file=CLOTHES):
+    'Returns the lines of a template file, split into cells'
+
+    return [line.split('\t') for line in file.read_text().splitlines()]
+
+
+def write_rows(file: Path, rows: list):
+    file.write_text('\n'.join('\t'.join(row) for row in rows) + '\n')
+    return file
+
+
+def facets(db):
+    return sorted((doc['category_code'], doc['field'], doc['k'], doc['v'],
+                   doc['count']) for doc in db.facet_counts.find()
+                  if doc['count'])
+
+
+def recounted(db):
+    'Returns True if the facet counts match a rebuild'
+
+    counted = facets(db)
+    rebuild(db)
+
+    return facets(db) == counted
+
+
+@pytest.fixture
+def clothes(tmp_path):
+    '''Returns a copy of the first n product groups of tsv/clothes.tsv
+    as (file, rows)
+    '''
+
+    def copy(groups=5, name='clothes.tsv'):
+        rows = read_rows()
+        mains = [i for i, row in enumerate(rows) if row[0] == 'MAIN']
+        end = mains[groups] if groups < len(mains) else len(rows)
+
+        rows = rows[:end]
+
+        return write_rows(tmp_path / name, rows), rows
+
+    return copy
@@ -0,0 +1,10 @@
+from backfillVariantCodes import category_of
+
+
+def test_category_is_code_without_allocator_suffix():
+    # camxts + suffix 'ab1234' starts with another code, camxtsab
+    codes = {'camxts', 'camxtsab'}
+
+    assert category_of('camxtsab1234', codes) == 'camxts'
+    assert category_of('camxtsabcd1234', codes) == 'camxtsab'
+    assert category_of('zzzzzzab1234', codes) is None
@@ -0,0 +1,77 @@
+import pytest
+from Blog import PostWriter, convert
+from importPosts import convert_file
+
+POST = '''---
+title: {title}
+description: A post imported from a file
+author: Jane Doe
+date: {date}
+---
+<p>Post body</p>
+'''
+
+
+def post(tmp_path, name, date='2023-06-01', title=None):
+    file = tmp_path / f'{name}.html'
+    file.write_text(POST.format(title=title or f'Post called {name}',
+                                date=date))
+    return file
+
+
+def test_convert_dates_id(tmp_path):
+    body, doc = convert(post(tmp_path, 'first'))
+
+    assert doc['body_id'] == body['_id']
+    assert doc['href'] == 'first'
+    assert doc['_id'].generation_time == doc['mod_dt']
+
+
+def test_out_of_range_date_fails_the_file(tmp_path):
+    name, docs, error = convert_file(post(tmp_path, 'old', '1960-01-01'))
+
+    assert (name, docs) == ('old.html', None)
+    assert error.startswith('ValueError: date must be between')
+
+
+def test_post_writer(db, tmp_path):
+    docs = [convert(post(tmp_path, name)) for name in ('first', 'second')]
+
+    with PostWriter(db) as writer:
+        for name, (body, doc) in zip(('first', 'second'), docs):
+            writer.add('post_body', body, name)
+            writer.add('posts', doc, name)
+
+    assert writer.inserted == {'post_body': 2, 'posts': 2}
+    assert db.posts.count_documents({}) == 2
+
+    # posts.href is unique, the file name is reported
+    body, doc = convert(post(tmp_path, 'first', title='Another first post'))
+
+    with PostWriter(db) as writer:
+        writer.add('post_body', body, 'copy.html')
+        writer.add('posts', doc, 'copy.html')
+
+    assert [(name, row) for name, row, _ in writer.errors] == [('posts',
+                                                                'copy.html')]
+
+
+def test_staged_post_writer_discards_on_error(db, tmp_path, merge):
+    body, doc = convert(post(tmp_path, 'first'))
+
+    with pytest.raises(RuntimeError):
+        with PostWriter(db, staging=True) as writer:
+            writer.add('post_body', body, 'first.html')
+            writer.add('posts', doc, 'first.html')
+            raise RuntimeError('conversion failed')
+
+    assert db.posts.count_documents({}) == 0
+    assert [name for name in db.list_collection_names()
+            if name.startswith('tmp_')] == []
+
+    with PostWriter(db, staging=True) as writer:
+        writer.add('post_body', body, 'first.html')
+        writer.add('posts', doc, 'first.html')
+
+    assert writer.committed
+    assert db.posts.count_documents({}) == 1
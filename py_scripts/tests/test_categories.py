@@ -0,0 +1,38 @@
+import pytest
+from Categories import import_categories, read_categories
+
+CSV = ('category,code,desc,subcategory\n'
+       "Men,camxts,Men's T-Shirts,T-Shirts\n"
+       "Women,cawxts,Women's T-Shirts,T-Shirts\n")
+
+
+def test_read_reports_repeated_codes(tmp_path):
+    file = tmp_path / 'categories.csv'
+    file.write_text(CSV + 'Men,camxts,Again,T-Shirts\n')
+
+    with pytest.raises(ValueError, match='Row 4: camxts repeats Row 2'):
+        read_categories(file)
+
+    file.write_text('category,code,desc\n')
+
+    with pytest.raises(KeyError, match='Missing subcategory'):
+        read_categories(file)
+
+
+def test_import_keeps_or_updates_existing_codes(db, tmp_path):
+    file = tmp_path / 'categories.csv'
+    file.write_text(CSV.replace("Men's", 'Mens') +
+                    'Clothes,bench1,Bench,Bench\n')
+
+    before = db.product_categories.count_documents({})
+    docs = read_categories(file)
+
+    # camxts and cawxts are in categories.csv, loaded by the db fixture
+    assert import_categories(db, docs, batch_size=2) == (1, 0)
+    assert db.product_categories.count_documents({}) == before + 1
+    assert db.product_categories.find_one({'code': 'camxts'
+                                           })['desc'] != 'Mens T-Shirts'
+
+    assert import_categories(db, docs, update=True, writers=2) == (0, 1)
+    assert db.product_categories.find_one({'code': 'camxts'
+                                           })['desc'] == 'Mens T-Shirts'
@@ -0,0 +1,174 @@
+import pytest
+from Checkpoint import DONE, FAILED, ROLLED_BACK, ImportRun, rollback
+from Templates import Clothes
+
+VERSION = Clothes.manifest_version()
+
+
+def snapshot(db):
+    'Returns the imported catalogue, without generated codes and ids'
+
+    return (sorted(doc['title'] for doc in db.products.find()),
+            sorted((doc['title'], doc['info_id'])
+                   for doc in db.product_variants.find()),
+            sorted(db.variant_info.distinct('_id')))
+
+
+def import_file(file, model, checkpoint=None, **options):
+    with Clothes(file, model, atomic=False, batch_size=20, **options) as tmp:
+        return tmp.run(checkpoint)
+
+
+def fail_after(monkeypatch, groups):
+    'Make run raise after tagging the given number of product groups'
+
+    tag = Clothes.tag
+    calls = []
+
+    def failing(checkpoint, product, variants):
+        if len(calls) == groups:
+            raise KeyboardInterrupt
+
+        calls.append(1)
+        tag(checkpoint, product, variants)
+
+    monkeypatch.setattr(Clothes, 'tag', staticmethod(failing))
+
+
+@pytest.fixture
+def expected(model, db, clothes):
+    'The catalogue after an uninterrupted import, in an empty database'
+
+    file, _ = clothes(groups=12)
+    import_file(file, model)
+
+    result = snapshot(db)
+
+    for name in ('products', 'product_variants', 'variant_info'):
+        db[name].delete_many({})
+
+    return result
+
+
+@pytest.mark.parametrize('options', [{}, {
+    'mmap': True
+}, {
+    'workers': 2,
+    'shard_bytes': 4096
+}],
+                         ids=['csv', 'mmap', 'sharded'])
+def test_resume_after_failure(monkeypatch, model, db, clothes, expected,
+                              options):
+    file, _ = clothes(groups=12)
+    run = ImportRun.start(db, file, VERSION)
+
+    fail_after(monkeypatch, 7)
+
+    # templates exit on errors
+    with pytest.raises(SystemExit):
+        import_file(file, model, run, **options)
+
+    monkeypatch.undo()
+
+    saved = db.import_runs.find_one({'_id': run.id})
+    assert saved['status'] == FAILED
+    assert 2 < saved['row']
+
+    # every group before the checkpoint is written
+    assert db.products.count_documents({}) == saved['groups']
+
+    # as if a batch was written but the checkpoint not saved,
+    # it is deleted on resume
+    db.products.insert_one({
+        'title': 'unsaved',
+        'import_run': run.id,
+        'import_batch': saved['batches']
+    })
+
+    run = ImportRun.resumable(db, file, VERSION)
+    assert run.id == saved['_id']
+
+    assert import_file(file, model, run, **options)
+
+    assert snapshot(db) == expected
+    assert db.import_runs.find_one({'_id': run.id})['status'] == DONE
+    assert db.products.count_documents({'import_run': run.id}) == 12
+
+
+def test_changed_file_cannot_resume(db, clothes):
+    file, _ = clothes()
+    run = ImportRun.start(db, file, VERSION)
+    run.finish(FAILED)
+
+    assert ImportRun.resumable(db, file, VERSION).id == run.id
+
+    file.write_text(file.read_text() + '\n')
+
+    with pytest.raises(ValueError):
+        ImportRun.resumable(db, file, VERSION)
+
+
+def test_rollback_keeps_shared_info(model, db, clothes):
+    first, _ = clothes(groups=3)
+    run = ImportRun.start(db, first, VERSION)
+    import_file(first, model, run)
+
+    created = set(db.variant_info.distinct('_id'))
+
+    # a later import uses the descriptions the run created
+    second, _ = clothes(groups=5, name='more.tsv')
+    import_file(second, model)
+
+    deleted = rollback(db, run.id, batch_size=1)
+
+    assert deleted['products'] == 3
+    assert db.products.count_documents({}) == 5
+    assert db.product_variants.count_documents({'import_run': run.id}) == 0
+
+    used = set(db.product_variants.distinct('info_id'))
+
+    assert created & used
+    assert set(db.variant_info.distinct('_id')) == used
+    assert db.import_runs.find_one({'_id': run.id})['status'] == ROLLED_BACK
+
+    with pytest.raises(ValueError):
+        rollback(db, 'unknown')
+
+
+def test_rollback_deletes_unused_info(model, db, clothes):
+    file, _ = clothes(groups=3)
+    run = ImportRun.start(db, file, VERSION)
+    import_file(file, model, run)
+
+    infos = db.variant_info.count_documents({})
+    deleted = rollback(db, run.id)
+
+    assert deleted['variant_info'] == infos
+    assert db.variant_info.count_documents({}) == 0
+    assert db.facet_counts.count_documents({}) == 0
+
+
+def test_failed_import_run_is_rolled_back(monkeypatch, model, db, clothes):
+    file, _ = clothes(groups=12)
+    run = ImportRun.start(db, file, VERSION)
+
+    fail_after(monkeypatch, 7)
+
+    with pytest.raises(SystemExit):
+        with Clothes(file, model, batch_size=20) as tmp:
+            tmp.run(import_run=run)
+
+    monkeypatch.undo()
+
+    assert snapshot(db) == ([], [], [])
+    assert db.import_runs.find_one({'_id': run.id})['status'] == ROLLED_BACK
+
+    # write errors roll the run back too
+    db.product_variants.create_index('qty', unique=True)
+    run = ImportRun.start(db, file, VERSION)
+
+    with Clothes(file, model, batch_size=20) as tmp:
+        assert not tmp.run(import_run=run)
+
+    assert snapshot(db) == ([], [], [])
+    assert db.facet_counts.count_documents({'count': {'$gt': 0}}) == 0
@@ -0,0 +1,37 @@
+from string import ascii_lowercase, digits
+from CodeAllocator import CodeAllocator
+
+
+class OneChar(CodeAllocator):
+    'Codes of 1 character, so collisions are likely'
+
+    length = 1
+
+
+def test_reserved_codes_are_not_allocated_again(db):
+    first = OneChar(db, reserve=True)
+
+    taken = first.allocate_many('ab', 35)
+
+    assert len(set(taken)) == 35
+    assert all(doc['created'] for doc in db.product_code_reservations.find())
+
+    # the only code left, after colliding with the first allocator's
+    second = OneChar(db, reserve=True)
+
+    left = set('ab' + c for c in ascii_lowercase + digits) - set(taken)
+
+    assert second.allocate_many('ab', 1) == list(left)
+    assert not second.claim(taken[0])
+
+
+def test_existing_product_codes_are_skipped(db):
+    db.products.insert_one({'product_code': 'abx'})
+
+    allocator = OneChar(db)
+
+    assert not allocator.claim('abx')
+    assert 'abx' not in allocator.allocate_many('ab', 35)
+    assert allocator.claim('cdx')
+    assert not allocator.claim('cdx')
+
@@ -0,0 +1,103 @@
+from csv import reader
+import pytest
+import Export
+from Export import CatalogueExport
+from Templates import Clothes
+
+
+def groups(file):
+    '''Returns the product groups of a template file, sorted, as sets of
+    non empty cells by column. Hrefs are compared as imported
+    '''
+
+    with file.open(newline='') as f:
+        rows = reader(f, dialect='excel-tab')
+        header = next(rows)
+        result = []
+
+        for row in rows:
+            cells = {k: v for k, v in zip(header, row) if v}
+
+            if cells['listing_type'] == 'MAIN':
+                cells['href'] = cells['href'].lower().replace(' ', '-')
+                result.append([])
+
+            result[-1].append(tuple(sorted(cells.items())))
+
+    return sorted(result)
+
+
+def variants(db):
+    return {
+        doc['sku']: doc
+        for doc in db.product_variants.find({}, projection={'_id': 0})
+    }
+
+
+@pytest.fixture
+def imported(monkeypatch, model, clothes):
+    # several description batches, with compressed descriptions
+    monkeypatch.setattr(Export, 'INFO_BATCH', 16)
+
+    file, _ = clothes(groups=8)
+
+    with Clothes(file, model, atomic=False, compress_info=100) as tmp:
+        tmp.run()
+
+    return file
+
+
+def test_round_trip(tmp_path, model, db, imported):
+    out = tmp_path / 'export' / 'clothes.tsv'
+    out.parent.mkdir()
+
+    export = CatalogueExport(Clothes, db)
+    export.write(out)
+
+    assert export.products == 8
+    assert export.orphans == export.missing_info == 0
+    assert groups(out) == groups(imported)
+
+    header = out.read_text().split('\n', 1)[0].split('\t')
+    assert tuple(header) == Clothes.template_columns()
+
+    before = variants(db)
+
+    with Clothes(out, model) as tmp:
+        assert tmp.sync()
+
+    assert variants(db) == before
+
+
+def test_skips_retired_and_orphans(tmp_path, db, imported):
+    sku = min(variants(db))
+    category = sku[:-9]
+
+    db.product_variants.update_one({'sku': sku},
+                                   {'$set': {
+                                       'retired': True,
+                                       'qty': 0
+                                   }})
+
+    # a variant without a product
+    orphan = db.product_variants.find_one({'sku': {'$ne': sku}},
+                                          projection={'_id': 0})
+    orphan['sku'] = f'{category}zzzzzz001'
+    orphan['category_code'] = category
+    db.product_variants.insert_one(orphan)
+
+    export = CatalogueExport(Clothes, db, categories=[category])
+    export.write(tmp_path / 'clothes.tsv')
+
+    exported = [
+        cells for group in groups(tmp_path / 'clothes.tsv') for cells in group
+    ]
+
+    assert export.orphans == 1
+    assert export.variants == db.product_variants.count_documents({
+        'category_code': category,
+        'retired': {
+            '$ne': True
+        }
+    }) - 1
+    assert len(exported) == export.products + export.variants
@@ -0,0 +1,58 @@
+from Checkpoint import ImportRun, rollback
+from conftest import facets, recounted
+from Templates import Clothes
+
+
+def test_import_deltas_match_rebuild(model, db, clothes):
+    file, _ = clothes(groups=12)
+
+    with Clothes(file, model) as tmp:
+        assert tmp.run()
+
+    assert facets(db) and recounted(db)
+
+    # counts are added to, a second import of the file doubles them
+    before = facets(db)
+
+    with Clothes(file, model) as tmp:
+        assert tmp.run()
+
+    assert recounted(db)
+    assert facets(db) == [(*key, count * 2) for *key, count in before]
+
+
+def test_failed_writes_rebuild_counts(model, db, clothes):
+    file, _ = clothes()
+
+    with Clothes(file, model) as tmp:
+        assert tmp.run()
+
+    # every variant fails on the unique title, no count may change
+    before = facets(db)
+    db.product_variants.create_index('title', unique=True)
+
+    with Clothes(file, model) as tmp:
+        assert not tmp.run()
+
+    assert facets(db) == before
+    assert recounted(db)
+
+
+def test_rollback_recounts(model, db, clothes):
+    first, _ = clothes(groups=3, name='first.tsv')
+    second, _ = clothes(groups=8, name='second.tsv')
+
+    with Clothes(first, model) as tmp:
+        assert tmp.run()
+
+    before = facets(db)
+    run = ImportRun.start(db, second, Clothes.manifest_version())
+
+    with Clothes(second, model) as tmp:
+        assert tmp.run(import_run=run)
+
+    assert facets(db) != before
+
+    rollback(db, run.id)
+
+    assert facets(db) == before
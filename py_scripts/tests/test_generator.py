@@ -0,0 +1,20 @@
+import pytest
+
+pytest.importorskip('faker')
+
+from DataBuilder.Generator import CatalogueGenerator
+
+
+def test_chunks_are_reproducible():
+    first = CatalogueGenerator(7, 3, ('efacfr', 'camxts'))
+    second = CatalogueGenerator(7, 3, ('efacfr', 'camxts'))
+
+    assert first.products(2, 100, 50) == second.products(2, 100, 50)
+    assert first.posts(2, 100, 50) == second.posts(2, 100, 50)
+
+    _, infos, variants = first.products(0, 0, 200)
+    ids = {doc['_id'] for doc in infos}
+
+    # shared descriptions are written once
+    assert len(ids) == len(infos)
+    assert {doc['info_id'] for doc in variants} == ids
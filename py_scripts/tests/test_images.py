@@ -0,0 +1,68 @@
+import pytest
+
+pytest.importorskip('PIL')
+
+from PIL import Image
+from Images import SIZES, ImageDerivatives
+from Templates import Clothes
+
+
+@pytest.fixture
+def images(tmp_path):
+    source = tmp_path / 'images'
+    source.mkdir()
+
+    Image.new('RGB', (800, 600), 'red').save(source / 'a.png')
+    Image.new('RGB', (800, 600), 'red').save(source / 'copy.png')
+    Image.new('RGB', (10, 10), 'blue').save(tmp_path / 'outside.png')
+
+    return ImageDerivatives(source, tmp_path / 'out', workers=1)
+
+
+def test_resolve_rejects_paths_outside_source(images):
+    assert images.resolve('a.png?text=1') == images.root / 'a.png'
+    assert images.resolve('../outside.png') is None
+    assert images.resolve(str(images.root.parent / 'outside.png')) is None
+    assert images.resolve('missing.png') is None
+
+
+def test_build_shares_files_and_caches(images):
+    result = images.build(['a.png', 'copy.png', '../outside.png'])
+
+    assert set(result) == {'a.png', 'copy.png'}
+    assert result['a.png'] == result['copy.png']
+
+    # 800x600 fits the 4:3 list box exactly
+    derivative = result['a.png']['list']
+    assert (derivative['w'], derivative['h']) == SIZES['list']
+    assert images.generated == 2
+
+    images.build(['a.png'])
+
+    assert images.cached == 1 and images.generated == 0
+
+
+def test_sync_adds_derivatives(model, db, clothes, tmp_path):
+    file, rows = clothes(groups=2)
+
+    with Clothes(file, model) as tmp:
+        assert tmp.run()
+
+    # image cells are like 323299/eee?text=1&font=roboto, image 1
+    source = tmp_path / 'images'
+
+    for row in rows[1:]:
+        for cell in row[16:21]:
+            if cell:
+                path = source / cell.split('?')[0]
+                path.parent.mkdir(parents=True, exist_ok=True)
+                Image.new('RGB', (800, 600), 'red').save(path, 'PNG')
+
+    images = ImageDerivatives(source, tmp_path / 'out', workers=1)
+
+    # the catalogue is unchanged, only the derivatives are new
+    with Clothes(file, model, images=images) as tmp:
+        assert tmp.sync()
+
+    for doc in db.product_variants.find():
+        assert [d['list']['w'] for d in doc['derivatives']] == [276] * 5
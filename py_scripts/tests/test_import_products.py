@@ -0,0 +1,79 @@
+from conftest import write_rows
+import importProducts
+from importProducts import compile_file, init_worker, lost_files
+
+PRICE, MRP = 6, 7
+
+
+class Messages(list):
+    'Stands in for the queue to the main process'
+
+    put = list.append
+
+
+def compile_messages(model, file):
+    messages = Messages()
+    init_worker(messages, model.getProductCategoryCodes(), {})
+    compile_file(file)
+
+    return [(kind, name) for kind, name, _ in messages], messages
+
+
+def test_worker_sends_groups_then_done(model, clothes):
+    file, _ = clothes(groups=12)
+
+    kinds, messages = compile_messages(model, file)
+
+    assert kinds[0] == ('started', 'clothes.tsv')
+    assert kinds[-1] == ('done', 'clothes.tsv')
+    assert sum(len(groups) for kind, _, groups in messages
+               if kind == 'groups') == 12
+
+
+def test_worker_reports_errors(model, clothes):
+    file, rows = clothes()
+
+    rows[-1][PRICE] = str(int(rows[-1][MRP]) + 1)
+    write_rows(file, rows)
+
+    kinds, messages = compile_messages(model, file)
+
+    assert kinds[-1] == ('error', 'clothes.tsv')
+    assert messages[-1][2] == (f'ValueError: Row {len(rows)}: '
+                               'Price greater than MRP')
+
+
+class Failed:
+    'A finished map_async result of a worker that raised'
+
+    def get(self, timeout=None):
+        raise MemoryError('out of memory')
+
+
+def summary(*statuses):
+    return {
+        f'{i}.tsv': {
+            'status': status,
+            'pid': 1 if status == 'Running' else None
+        }
+        for i, status in enumerate(statuses)
+    }
+
+
+def test_lost_files_once_every_task_returned():
+    lost = lost_files(summary('Done', 'Running', 'Pending'), Failed(), True,
+                      set())
+
+    assert lost == [('error', '1.tsv', 'MemoryError: out of memory'),
+                    ('error', '2.tsv', 'MemoryError: out of memory')]
+
+
+def test_lost_files_of_an_exited_worker(monkeypatch):
+    monkeypatch.setattr(importProducts, 'active_children', lambda: [])
+
+    error = 'Worker exited while compiling the file'
+
+    # the worker compiling 1.tsv exited and took the pending file with it
+    assert lost_files(summary('Done', 'Running', 'Pending'), None, False,
+                      {1}) == [('error', '1.tsv', error),
+                               ('error', '2.tsv', error)]
@@ -0,0 +1,31 @@
+def test_dry_run_reports_missing_and_conflicting_indexes(model, db):
+    # every index was created by the model fixture
+    assert model.ensure_indexes(dry_run=True) == []
+
+    db.posts.drop_indexes()
+    db.pincodes.drop_indexes()
+    db.pincodes.create_index('Pincode')
+
+    actions = model.ensure_indexes(dry_run=True)
+
+    assert actions == [
+        ('pincodes', [('Pincode', 1)], 'Conflicting options'),
+        ('posts', [('href', 1)], 'Missing'),
+    ]
+
+    # a dry run changes nothing
+    assert model.ensure_indexes(dry_run=True) == actions
+
+
+def test_conflicting_index_is_left_alone(model, db):
+    db.pincodes.drop_indexes()
+    db.pincodes.create_index('Pincode')
+    db.posts.drop_indexes()
+
+    assert model.ensure_indexes() == [
+        ('pincodes', [('Pincode', 1)], 'Conflicting options'),
+        ('posts', [('href', 1)], 'Created'),
+    ]
+
+    assert not db.pincodes.index_information()['Pincode_1'].get('unique')
+    assert db.posts.index_information()['href_1']['unique']
@@ -0,0 +1,55 @@
+import asyncio
+import pytest
+from pymongo.errors import DuplicateKeyError
+from Ingest import IngestEngine
+
+
+def test_batches_are_written_by_concurrent_writers(db):
+    results = []
+
+    with IngestEngine(db, writers=3, max_in_flight=2) as engine:
+        for start in range(0, 100, 10):
+            engine.submit('pincodes',
+                          'insert_many',
+                          [{
+                              'Pincode': str(n)
+                          } for n in range(start, start + 10)],
+                          done=lambda res, error: results.append(error))
+
+        engine.drain()
+
+        assert db.pincodes.count_documents({}) == 100
+
+    assert results == [None] * 10
+
+
+def test_errors_without_a_callback_are_raised(db):
+    errors = []
+
+    with pytest.raises(DuplicateKeyError):
+        with IngestEngine(db, writers=2) as engine:
+            engine.submit('batches', 'insert_one', {'_id': 1})
+
+            # reported to its callback, not raised
+            engine.submit('batches',
+                          'insert_one', {'_id': 1},
+                          done=lambda res, error: errors.append(error))
+            engine.drain()
+
+            engine.submit('batches', 'insert_one', {'_id': 1})
+
+    assert len(errors) == 1
+
+
+def test_async_use(db):
+
+    async def write():
+        async with IngestEngine(db, writers=2) as engine:
+            for n in range(5):
+                await engine.put('pincodes', 'insert_one', {'Pincode': n})
+
+            await engine.join()
+
+    asyncio.run(write())
+
+    assert db.pincodes.count_documents({}) == 5
@@ -0,0 +1,58 @@
+from os import utime
+from Manifest import Manifest
+from Templates import Clothes
+
+VERSION = 'Templates.Clothes:1'
+
+
+def test_unchanged_after_update(tmp_path, clothes):
+    file, _ = clothes()
+    manifest = Manifest(tmp_path / '.manifest.json')
+
+    assert not manifest.is_unchanged(file, VERSION)
+
+    manifest.update(file, VERSION, {'group': 'hash'})
+    manifest.save()
+
+    manifest = Manifest(tmp_path / '.manifest.json')
+
+    assert manifest.is_unchanged(file, VERSION)
+    assert manifest.groups(file, VERSION) == {'group': 'hash'}
+
+    # a new importer version reprocesses the file
+    assert not manifest.is_unchanged(file, 'Templates.Clothes:2')
+    assert manifest.groups(file, 'Templates.Clothes:2') == {}
+
+
+def test_touched_file_is_hashed(tmp_path, clothes):
+    file, _ = clothes()
+    manifest = Manifest(tmp_path / '.manifest.json')
+    manifest.update(file, VERSION)
+
+    stat = file.stat()
+    utime(file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    assert manifest.is_unchanged(file, VERSION)
+
+    # same size, different contents
+    text = file.read_text()
+    file.write_text(text.replace('Apollo', 'Apolla', 1))
+
+    assert not manifest.is_unchanged(file, VERSION)
+
+
+def test_run_reports_write_errors(model, db, clothes):
+    file, _ = clothes()
+
+    with Clothes(file, model, atomic=False) as tmp:
+        assert tmp.run()
+
+    # importing the file again fails on the unique title, so addProducts.py
+    # must not record it in the manifest
+    db.products.create_index('title', unique=True)
+
+    with Clothes(file, model, atomic=False) as tmp:
+        assert not tmp.run()
+
+    with Clothes(file, model) as tmp:
+        assert tmp.sync()
@@ -0,0 +1,56 @@
+from csv import reader
+from io import StringIO
+import pytest
+from MappedReader import MappedReader
+
+TEXT = {
+    'plain': 'a\tb\nSUB\tplain\n\nSUB\tlast',
+    'inch mark': 'a\tb\nSUB\t12" roller\nSUB\tplain\n',
+    'quoted': 'a\tb\n"x\ty"\t"multi\nline"\nc\t"he said ""hi"""\n',
+    'mixed': 'a\tb\nq\t5" and 6"\n"x""\nstill"\tz\n',
+    'crlf': 'a\tb\r\nSUB\t"1\r\n2"\r\nSUB\tx\r\n',
+}
+
+
+def read(tmp_path, text):
+    file = tmp_path / 'file.tsv'
+    file.write_bytes(text.encode())
+
+    return MappedReader(file)
+
+
+@pytest.mark.parametrize('name', TEXT)
+def test_reads_as_csv_module(tmp_path, name):
+    text = TEXT[name]
+    expected = list(reader(StringIO(text, newline=''), dialect='excel-tab'))
+
+    assert list(read(tmp_path, text)) == expected
+
+
+def test_unquoted_quote_does_not_join_lines(tmp_path):
+    rows = list(read(tmp_path, TEXT['inch mark']))
+
+    assert rows == [['a', 'b'], ['SUB', '12" roller'], ['SUB', 'plain']]
+
+
+def test_use_decodes_only_columns(tmp_path):
+    rows = read(tmp_path, 'a\tb\tc\n1\t2\t3\n')
+    rows.use((0, 2))
+
+    assert list(rows) == [['a', '', 'c'], ['1', '', '3']]
+
+
+def test_seek_row_skips_blank_lines(tmp_path):
+    rows = read(tmp_path, 'h\n1\n\n"2\n2"\n3\n')
+
+    assert len(rows.index()) == 3
+
+    rows.seek_row(4)
+    assert next(rows) == ['3']
+
+    rows.seek_row(3)
+    assert next(rows) == ['2\n2']
+
+
+def test_empty_file(tmp_path):
+    assert list(read(tmp_path, '')) == []
@@ -0,0 +1,44 @@
+from Model import Model
+
+
+def env(tmp_path, **options):
+    file = tmp_path / '.env'
+    lines = ['MONGO_CONN_STRING=mongodb://localhost:27017/?connect=false']
+    lines += [f'{key}={value}' for key, value in options.items()]
+    file.write_text('\n'.join(lines) + '\n')
+    return file
+
+
+def test_models_share_a_client(tmp_path):
+    first = Model(env(tmp_path))
+    second = Model(env(tmp_path), 'fusionx_test')
+    client = first.client
+
+    assert second.client is client
+    assert second.connect().name == 'fusionx_test'
+
+    # borrowing leaves the client open for the next template
+    with first.borrow() as db:
+        assert db.client is client
+
+    assert second.client is client
+
+    # closed once by the script, a later use creates a new client
+    first.close()
+
+    assert second.client is not client
+
+    second.close()
+
+
+def test_client_options_are_read_from_env(tmp_path):
+    model = Model(env(tmp_path, MONGO_MAX_POOL_SIZE=50, MONGO_WRITE_CONCERN=1))
+    default = Model(env(tmp_path))
+
+    assert model.options == {'maxPoolSize': 50, 'w': 1}
+
+    # a client with other options is not shared
+    assert model.client is not default.client
+
+    model.close()
+    default.close()
@@ -0,0 +1,34 @@
+from addPincode import load, read_chunks
+
+CSV = ('Pincode,District,State\n'
+       '1,A,X\n'
+       '2,B,X\n'
+       '\n'
+       '1,C,Y\n'
+       '3,D,Y\n'
+       '3,E,Z\n')
+
+
+def test_repeated_pincode_in_chunk_keeps_last_row(tmp_path):
+    file = tmp_path / 'pincode.csv'
+    file.write_text(CSV)
+
+    chunks = list(read_chunks(file, 3))
+
+    assert [[doc['District'] for doc in chunk]
+            for chunk in chunks] == [['C', 'B'], ['E']]
+
+
+def test_repeated_pincode_across_chunks_keeps_last_row(db, tmp_path):
+    file = tmp_path / 'pincode.csv'
+    file.write_text(CSV)
+
+    progress = load(db, file, chunk_size=1, workers=4)
+
+    pincodes = {
+        doc['Pincode']: doc['District']
+        for doc in db.pincodes.find()
+    }
+
+    assert pincodes == {'1': 'C', '2': 'B', '3': 'E'}
+    assert progress.upserted == 3 and progress.pending == set()
@@ -0,0 +1,45 @@
+import pytest
+from conftest import facets
+from Templates import Clothes
+
+
+def catalogue(db):
+    'Returns the imported catalogue, without the random product codes'
+
+    titles = {
+        doc['product_code']: doc['title']
+        for doc in db.products.find()
+    }
+
+    variants = sorted(
+        (titles[doc['product_code']], doc['sku'][-3:], doc['title'],
+         doc['price'], doc['qty'], doc['info_id'], doc['category_code'])
+        for doc in db.product_variants.find())
+
+    return sorted(titles.values()), variants, facets(db)
+
+
+def clear(db):
+    for name in ('products', 'product_variants', 'variant_info',
+                 'facet_counts'):
+        db[name].delete_many({})
+
+
+@pytest.mark.parametrize('options', [{}, {'mmap': True}],
+                         ids=['csv', 'mmap'])
+def test_sharded_import_matches_unsharded(model, db, clothes, options):
+    file, _ = clothes(groups=12)
+
+    with Clothes(file, model, **options) as tmp:
+        assert tmp.run()
+
+    expected = catalogue(db)
+    clear(db)
+
+    # several shards, each starting at a MAIN row
+    with Clothes(file, model, workers=3, shard_bytes=2048, **options) as tmp:
+        assert len(tmp.shards(2048)) > 3
+        assert tmp.run()
+
+    assert catalogue(db) == expected
+    assert len(expected[0]) == 12
@@ -0,0 +1,116 @@
+from conftest import recounted, write_rows
+from Templates import Clothes
+
+BRAND, TITLE, PRICE, SIZE = 1, 2, 6, 11
+
+
+def variants(db):
+    return {
+        doc['sku']: doc
+        for doc in db.product_variants.find({}, projection={'_id': 0})
+    }
+
+
+def first_sku(db, rows):
+    'Returns the sku of the first SUB row, product codes are random'
+
+    href = rows[1][4].lower().replace(' ', '-')
+    product = db.products.find_one({'href': {'$regex': f'/{href}$'}})
+
+    return f"{product['product_code']}001"
+
+
+def sync(file, model, **kwargs):
+    with Clothes(file, model) as tmp:
+        assert tmp.sync(**kwargs)
+
+
+def test_unchanged_file_writes_nothing(model, db, clothes):
+    file, _ = clothes()
+
+    with Clothes(file, model, atomic=False) as tmp:
+        tmp.run()
+
+    before = variants(db)
+    sync(file, model)
+
+    assert variants(db) == before
+    assert db.products.count_documents({}) == 5
+
+
+def test_changes_keep_skus(model, db, clothes):
+    file, rows = clothes(groups=2)
+
+    with Clothes(file, model, atomic=False) as tmp:
+        tmp.run()
+
+    before = variants(db)
+    sku = first_sku(db, rows)
+
+    # a new price on the first variant and a new size in the first group
+    rows[1 + 1][PRICE] = '599'
+    new = list(rows[2])
+    new[SIZE] = 'XXXL'
+    rows.insert(3, new)
+
+    write_rows(file, rows)
+    sync(file, model)
+
+    after = variants(db)
+    product_code = sku[:-3]
+
+    assert after[sku]['price'] == 599
+    assert after[sku]['title'] == before[sku]['title']
+
+    added = set(after) - set(before)
+    last = max(int(sku[-3:]) for sku in before if sku[:-3] == product_code)
+
+    assert added == {f'{product_code}{last + 1:03d}'}
+    # every other variant is untouched
+    del after[sku], before[sku]
+    assert {k: v for k, v in after.items() if k not in added} == before
+
+    assert db.products.count_documents({}) == 2
+    assert recounted(db)
+
+
+def test_retire_missing_variants(model, db, clothes):
+    file, rows = clothes(groups=2)
+
+    with Clothes(file, model, atomic=False) as tmp:
+        tmp.run()
+
+    sku = first_sku(db, rows)
+    del rows[2]
+    write_rows(file, rows)
+
+    # without retire, missing variants are left alone
+    sync(file, model)
+    assert variants(db)[sku]['qty'] > 0
+
+    sync(file, model, retire=True)
+    retired = variants(db)[sku]
+
+    assert retired['retired'] and retired['qty'] == 0
+    assert recounted(db)
+
+
+def test_changed_title_updates_product(model, db, clothes):
+    file, rows = clothes(groups=2)
+
+    with Clothes(file, model) as tmp:
+        tmp.run()
+
+    sku = first_sku(db, rows)
+    rows[1][TITLE] = 'Renamed T-Shirt'
+    write_rows(file, rows)
+
+    sync(file, model)
+
+    brand = rows[1][BRAND]
+    product = db.products.find_one({'product_code': sku[:-3]})
+
+    assert product['title'] == f'{brand} Renamed T-Shirt'
+    assert product['href'].startswith(f'{sku}/')
+    assert variants(db)[sku]['title'].startswith(f'{brand} Renamed T-Shirt, ')
+    assert db.products.count_documents({}) == 2
@@ -0,0 +1,46 @@
+import pytest
+from conftest import write_rows
+from Templates import Clothes
+
+PRICE, MRP = 6, 7
+
+
+def test_groups_stream_before_a_later_error(model, clothes):
+    file, rows = clothes()
+
+    rows[-1][PRICE] = str(int(rows[-1][MRP]) + 1)
+    write_rows(file, rows)
+
+    # compiled without a database, as importProducts.py does
+    groups = Clothes(file, None).compile(model.getProductCategoryCodes())
+
+    # the first group is compiled before the last row is read
+    row, product, variants = next(groups)
+
+    assert row == 2
+    assert product['title'] == f'{rows[1][1]} {rows[1][2]}'
+    assert [count for count, _, _ in variants] == list(
+        range(3, 3 + len(variants)))
+
+    with pytest.raises(ValueError,
+                       match=f'Row {len(rows)}: Price greater than MRP'):
+        list(groups)
+
+
+
+def test_rows_share_the_column_plan(model, clothes):
+    file, rows = clothes(groups=1)
+
+    # a short row reads its missing cells as empty
+    rows[2] = rows[2][:-2]
+    write_rows(file, rows)
+
+    with Clothes(file, model) as tmp:
+        tmp._prepare()
+        read = list(tmp._rows())
+
+    assert len(read) == len(rows) - 1
+    assert all(row.index is tmp.plan.index for row in read)
+    assert read[0]['title'] == rows[1][2]
+    assert read[1]['description'] == ''
+    assert not hasattr(read[0], '__dict__')
@@ -0,0 +1,67 @@
+import pytest
+
+pytest.importorskip('numpy')
+
+from conftest import write_rows
+from Templates import Clothes
+from Validation import ColumnarValidator
+
+PRICE, MRP, QTY = 6, 7, 8
+
+
+def validate(file, model):
+    with Clothes(file, model, validator='columnar') as tmp:
+        tmp._validate_columns()
+        return ColumnarValidator(tmp).validate()
+
+
+def first_stream_error(file, model):
+    # compiled without a database, as importProducts.py does
+    tmp = Clothes(file, None)
+
+    with pytest.raises(ValueError) as error:
+        list(tmp.compile(model.getProductCategoryCodes()))
+
+    return str(error.value)
+
+
+def test_valid_file(model, clothes):
+    file, _ = clothes()
+
+    assert validate(file, model) == []
+
+
+def test_reports_every_error(tmp_path, model, clothes):
+    file, rows = clothes(groups=3)
+    mains = [i for i, row in enumerate(rows) if row[0] == 'MAIN']
+
+    rows[2][PRICE] = '900'
+    rows[3][QTY] = ''
+    rows[4][MRP] = 'abc'
+    rows[mains[1]][3] = 'nope'
+    rows.append(rows[mains[0]])
+
+    write_rows(file, rows)
+    last = len(rows)
+
+    errors = validate(file, model)
+
+    assert errors == [
+        'Row 3: Price greater than MRP',
+        'Row 4: qty child column cannot be empty',
+        'Row 5: Price or MRP is not a number',
+        f'Row {mains[1] + 1}: nope not found in product_categories '
+        'collection.',
+        f'Row {last}: Parent must have atleast 1 child',
+    ]
+
+    # the streaming validator stops at the first of the same errors
+    assert first_stream_error(file, model) == errors[0]
+
+
+def test_sub_before_main(tmp_path, model, clothes):
+    _, rows = clothes(groups=1)
+
+    file = write_rows(tmp_path / 'orphan.tsv', [rows[0], rows[2], *rows[1:]])
+
+    assert validate(file, model)[0] == 'Row 2: Parent row is missing'
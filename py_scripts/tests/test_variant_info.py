@@ -0,0 +1,50 @@
+from zlib import decompress
+from Templates import Clothes, info_id
+
+DESCRIPTION = 21
+
+
+def descriptions(rows):
+    return {row[DESCRIPTION] for row in rows[1:] if row[0] == 'SUB'}
+
+
+def test_equal_descriptions_share_a_document(model, db, clothes, capsys):
+    file, rows = clothes(groups=12)
+
+    with Clothes(file, model) as tmp:
+        assert tmp.run()
+
+    stored = {doc['_id']: doc['info'] for doc in db.variant_info.find()}
+    ids = set(stored)
+
+    assert stored == {info_id(text): text for text in descriptions(rows)}
+    assert set(db.product_variants.distinct('info_id')) == ids
+
+    # variants with the same description share its document
+    assert db.product_variants.count_documents({}) > len(ids)
+
+    capsys.readouterr()
+
+    # a second import reuses every document
+    with Clothes(file, model) as tmp:
+        assert tmp.run()
+
+    out = capsys.readouterr().out
+
+    assert 'variant_info: 0 inserted' in out
+    assert f'variant_info: {len(ids)} reused' in out
+    assert db.variant_info.count_documents({}) == len(ids)
+
+
+def test_compressed_descriptions(model, db, clothes):
+    file, rows = clothes()
+
+    with Clothes(file, model, compress_info=0) as tmp:
+        assert tmp.run()
+
+    stored = {
+        doc['_id']: decompress(doc['info_z']).decode()
+        for doc in db.variant_info.find()
+    }
+
+    assert stored == {info_id(text): text for text in descriptions(rows)}
@@ -0,0 +1,94 @@
+import pytest
+from pymongo import UpdateOne
+from conftest import write_rows
+from Templates import Clothes
+from Writer import BulkWriter
+
+PRICE, MRP = 6, 7
+
+
+def staged(db):
+    return [name for name in db.list_collection_names()
+            if name.startswith('tmp_')]
+
+
+def counts(db):
+    return (db.products.count_documents({}),
+            db.product_variants.count_documents({}),
+            db.variant_info.count_documents({}))
+
+
+def test_staged_import(model, db, clothes, merge):
+    file, _ = clothes()
+
+    with Clothes(file, model, atomic=True) as tmp:
+        assert tmp.run()
+
+    assert db.products.count_documents({}) == 5
+    assert db.product_variants.count_documents({}) > 5
+    assert staged(db) == []
+
+
+def test_staged_import_of_invalid_file_writes_nothing(model, db, clothes,
+                                                      merge):
+    file, rows = clothes()
+
+    # the last variant of the file, after every other group is compiled
+    rows[-1][PRICE] = str(int(rows[-1][MRP]) + 1)
+    write_rows(file, rows)
+
+    with pytest.raises(SystemExit):
+        with Clothes(file, model, atomic=True, batch_size=5) as tmp:
+            tmp.run()
+
+    assert counts(db) == (0, 0, 0)
+    assert staged(db) == []
+
+
+def test_failed_merge_is_undone(model, db, clothes, merge):
+    file, _ = clothes()
+
+    with Clothes(file, model) as tmp:
+        assert tmp.run()
+
+    before = counts(db)
+
+    # products merge, then product_variants fail on the unique title
+    db.product_variants.create_index('title', unique=True)
+
+    with pytest.raises(SystemExit):
+        with Clothes(file, model, atomic=True) as tmp:
+            tmp.run()
+
+    # variant_info is content addressed, so every document is shared
+    assert counts(db) == before
+    assert staged(db) == []
+
+
+def test_failed_documents_are_reported_by_row(db):
+    # product_code is unique
+    with BulkWriter(db, batch_size=3) as writer:
+        for row, code in zip((2, 3, 5, 6, 8), 'aabcb'):
+            writer.add('products', {'product_code': code}, row)
+
+        # content addressed documents already written are reused
+        writer.add('variant_info', {'_id': 'x', 'info': 'x'}, 9)
+        writer.add('variant_info', {'_id': 'x', 'info': 'x'}, 10)
+
+        writer.update('products',
+                      UpdateOne({'product_code': 'c'},
+                                {'$set': {
+                                    'product_code': 'a'
+                                }}), 11)
+
+    assert writer.inserted == {
+        'products': 3,
+        'variant_info': 1,
+        'product_variants': 0
+    }
+    assert writer.reused['variant_info'] == 1
+    assert [(name, row) for name, row, _ in writer.errors] == [
+        ('products', 3),
+        ('products', 8),
+        ('products', 11),
+    ]
@@ -14,6 +14,11 @@ const config = {
   // in production other options include Cloudinary, aws, filestack etc.
   imgUrl: "https://placehold.co", // base url for loading images.
 
+  // base url the resized images generated by py_scripts addProducts.py
+  // --images are uploaded or served at, the contents of --image-out.
+  // Resized images are only used if set.
+  derivativeUrl: "",
+
   // express-precompressed
   static: {
     enableBrotli: true,
@@ -1,6 +1,10 @@
 const securityHeaders = (req, res, next) => {
-  const imgURl = new URL(req.app.locals.imgUrl).origin;
-  const csp = `default-src 'self'; frame-src 'none'; img-src 'self' ${imgURl}; report-uri /csp;`;
+  const { imgUrl, derivativeUrl } = req.app.locals;
+  let imgSrc = new URL(imgUrl).origin;
+
+  if (derivativeUrl) imgSrc += ` ${new URL(derivativeUrl).origin}`;
+
+  const csp = `default-src 'self'; frame-src 'none'; img-src 'self' ${imgSrc}; report-uri /csp;`;
 
   res.set({
     // use secure https
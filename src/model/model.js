@@ -1,6 +1,7 @@
 /* eslint new-cap: ["error", {capIsNewExceptions: ["ObjectId"]}]*/
 const { ObjectId } = require("mongodb");
 const { join } = require("path");
+const { inflateSync } = require("zlib");
 const cache = require(join(__dirname, "cache"));
 const { fetchPostalData, to } = require(join(
   __dirname,
@@ -17,6 +18,16 @@ const transactionOptions = {
   writeConcern: { w: "majority" },
 };
 
+// derivatives of the first image, as images and derivatives are parallel
+// arrays. $first on "$derivatives.list" would skip a missing derivative
+// and pair a later image's file with the first image's alt text
+const listImageExpr = {
+  $let: {
+    vars: { first: { $arrayElemAt: ["$derivatives", 0] } },
+    in: "$$first.list",
+  },
+};
+
 /**
  * Set the logger variable for logging
  * @param {Pino} logObj
@@ -38,7 +49,23 @@ class ProductFilter {
    */
   static async init(db, category) {
     const cls = new ProductFilter();
-    const query = category ? { sku: { $regex: category } } : {};
+
+    // in stock values counted by the import scripts, see py_scripts Facets.py
+    const facets = await getFacets(db, category);
+
+    if (facets?.length) {
+      for (const { field, k, v } of facets) {
+        if (field === "type" && k === "color") continue;
+        if (!Object.hasOwn(cls[field], k)) cls[field][k] = [];
+        if (cls[field][k].includes(v)) continue;
+        cls[field][k].push(v);
+        cls[`${field}Length`] += 1;
+      }
+      return cls;
+    }
+
+    // facet_counts not built, scan the variants
+    const query = category ? { category_code: category } : {};
 
     await Promise.all([
       (async () => {
@@ -366,7 +393,7 @@ function compileProductPipeline(filter, limit, len) {
   let query = {};
 
   if (filter.category) {
-    query.sku = { $regex: filter.category };
+    query.category_code = filter.category;
   }
 
   if (filter.type || (filter.specs && "basecolor" in filter.specs)) {
@@ -417,6 +444,8 @@ function compileProductPipeline(filter, limit, len) {
     $project: {
       href: 1,
       image: { $first: "$images" },
+      // resized copy of the first image, see py_scripts Images.py
+      listImage: listImageExpr,
       title: 1,
       price: 1,
     },
@@ -438,7 +467,7 @@ function compileProductQuery(filter, len) {
   // all colors may not have z_index of 1
   if (filter.specs?.basecolor) delete query.z_index;
 
-  if (category) query.sku = { $regex: category };
+  if (category) query.category_code = category;
 
   specsLength &&
     Object.values(filter.specs).forEach((val) => {
@@ -539,6 +568,7 @@ async function getProductLists(db, filters, limit, key) {
     projection: {
       href: 1,
       image: { $first: "$images" },
+      listImage: listImageExpr,
       title: 1,
       price: 1,
     },
@@ -593,6 +623,20 @@ async function getProductBySku(db, sku, projection = null) {
   return result;
 }
 
+/**
+ * Inflate a zlib compressed variant_info description in place.
+ * Large descriptions may be stored compressed in info_z by the import scripts
+ * @param {object} item product variant with info looked up from variant_info
+ * @return {object} item
+ */
+function inflateInfo(item) {
+  if (item.info && item.info.info_z) {
+    item.info.info = inflateSync(item.info.info_z.buffer).toString();
+    delete item.info.info_z;
+  }
+  return item;
+}
+
 /**
  *  Aggregates the product data and description for product page
  *  @param {Db} db
@@ -642,7 +686,7 @@ async function getProduct(db, sku) {
   const cursor = db.collection("product_variants").aggregate(pipeline);
 
   if (await cursor.hasNext()) {
-    const result = await cursor.next();
+    const result = inflateInfo(await cursor.next());
     cache.set(key, result);
     return result;
   }
@@ -652,7 +696,7 @@ async function getProduct(db, sku) {
 /**
  *
  * @param {Db} db
- * @param {string} sku product sku
+ * @param {string} sku product code, the variant sku without the child number
  * @return {Promise.<object | null>}
  */
 async function getProductVariants(db, sku) {
@@ -676,7 +720,7 @@ async function getProductVariants(db, sku) {
 
   const pipeline = [
     {
-      $match: { sku: { $regex: sku } },
+      $match: { product_code: sku },
     },
     {
       $lookup: {
@@ -704,7 +748,7 @@ async function getProductVariants(db, sku) {
 
   if (err) return null;
 
-  const mapped = mapItems(items);
+  const mapped = mapItems(items.map(inflateInfo));
 
   cache.set(key, mapped, 2 * 60 * 60);
 
@@ -1720,7 +1764,7 @@ function updateAddress(db, userId, addressId, addressObj) {
  * @param {object} [query={}]
  */
 async function getDistinct(db, collectionName, fieldName, query = {}) {
-  const key = `${collectionName}_${fieldName}_${query.sku?.$regex}`;
+  const key = `${collectionName}_${fieldName}_${query.category_code}`;
 
   if (cache.has(key)) return cache.get(key);
 
@@ -1734,6 +1778,34 @@ async function getDistinct(db, collectionName, fieldName, query = {}) {
   return result;
 }
 
+/**
+ * Get the in stock spec and type values of a category from facet_counts
+ * @param {Db} db
+ * @param {string} [category] category code, all categories if not set
+ * @return {Promise.<Array.<{field: string, k: string, v: string}>>}
+ */
+async function getFacets(db, category) {
+  const key = `facets_${category}`;
+
+  if (cache.has(key)) return cache.get(key);
+
+  const filter = { count: { $gt: 0 } };
+
+  if (category) filter.category_code = category;
+
+  const [err, result] = await to(
+    db
+      .collection("facet_counts")
+      .find(filter, { projection: { _id: 0, field: 1, k: 1, v: 1 } })
+      .toArray(),
+    logger
+  );
+
+  if (!err) cache.set(key, result);
+
+  return result;
+}
+
 module.exports = {
   setLogger,
   ProductFilter,
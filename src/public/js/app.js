@@ -1,4 +1,9 @@
-import { imgUrl, shopListLimit, blogListLimit } from "./variables.js";
+import {
+  imgUrl,
+  derivativeUrl,
+  shopListLimit,
+  blogListLimit,
+} from "./variables.js";
 import comment from "./comment.js";
 import modal from "./modal.js";
 import itemPage from "./itemPage.js";
@@ -405,12 +410,22 @@ async function loadShopItems(el, url) {
     // card image
     const cardImg = node.create("div", { class: "card-image" });
     const fig = node.create("figure", { class: "image is-4by3" });
-    const img = node.create("img", {
-      src: `${imgUrl}/276x207/${item.image[0]}`,
-      alt: item.image[1],
-      width: 276,
-      height: 207,
-    });
+    const img = node.create(
+      "img",
+      derivativeUrl && item.listImage
+        ? {
+            src: `${derivativeUrl}/${item.listImage.src}`,
+            alt: item.image[1],
+            width: item.listImage.w,
+            height: item.listImage.h,
+          }
+        : {
+            src: `${imgUrl}/276x207/${item.image[0]}`,
+            alt: item.image[1],
+            width: 276,
+            height: 207,
+          }
+    );
     fig.appendChild(img);
     cardImg.appendChild(fig);
 
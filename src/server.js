@@ -27,6 +27,7 @@ app.locals.shopListLimit = config.shopListLimit;
 app.locals.commentListLimit = config.commentListLimit;
 app.locals.pwdInputs = config.pwdInputs;
 app.locals.imgUrl = config.imgUrl;
+app.locals.derivativeUrl = config.derivativeUrl;
 app.locals.staticFileExt = config.staticFileExt;
 
 app.set("views", join(__dirname, "views"));
@@ -66,6 +67,7 @@ const client = new MongoClient(process.env.MONGO_CONN_STRING, config.mongo);
   await writeFile(
     join(__dirname, "public", "js", "variables.js"),
     `export const imgUrl = "${config.imgUrl}";
+export const derivativeUrl = "${config.derivativeUrl}";
 export const shopListLimit = ${config.shopListLimit};
 export const blogListLimit = ${config.blogListLimit};
 export const commentListLimit = ${config.commentListLimit};`